@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+
+import vat_moss
+import vat_moss.calling_codes
+import vat_moss.phone_number
+from vat_moss.instrumentation import timer
+
+
+EU_COUNTRY_CODES = set([
+    'AT', 'BE', 'BG', 'CY', 'CZ', 'DE', 'DK', 'EE', 'ES', 'FI', 'FR', 'GB', 'GR', 'HR', 'HU', 'IE', 'IT', 'LT',
+    'LU', 'LV', 'MT', 'NL', 'PL', 'PT', 'RO', 'SE', 'SI', 'SK'
+])
+
+
+def calling_code_prefixes(mappings):
+    """
+    :param mappings:
+        A dict in the format of CALLING_CODE_MAPPING or CALLING_CODE_EXCEPTIONS
+
+    :return:
+        A list of (unicode string digit prefix, country code) tuples
+    """
+
+    prefixes = []
+    for key in sorted(mappings):
+        for info in mappings[key]:
+            for prefix in vat_moss.phone_number._expand_regex(info['regex']):
+                prefixes.append((prefix, info['country_code']))
+    return prefixes
+
+
+def phone_number(rand, prefix):
+    """
+    :return:
+        A unicode string phone number formatted with spaces, starting with the
+        prefix and padded with random digits
+    """
+
+    digits = prefix + ''.join(rand.choice('0123456789') for _ in range(max(6, 12 - len(prefix))))
+    return '+%s %s %s' % (digits[0:3], digits[3:7], digits[7:])
+
+
+def corpora(size, seed):
+    """
+    Generates the lists of phone numbers to benchmark with
+
+    :param size:
+        The integer number of phone numbers per corpus
+
+    :param seed:
+        The integer random seed, so runs are comparable
+
+    :return:
+        A dict of unicode string corpus name to list of unicode string phone
+        numbers
+    """
+
+    rand = random.Random(seed)
+
+    prefixes = calling_code_prefixes(vat_moss.calling_codes.CALLING_CODE_MAPPING)
+    exception_prefixes = calling_code_prefixes(vat_moss.calling_codes.CALLING_CODE_EXCEPTIONS)
+    nanp_prefixes = [prefix for prefix in prefixes if prefix[0].startswith('1')]
+    eu_prefixes = [prefix for prefix in prefixes if prefix[1] in EU_COUNTRY_CODES]
+
+    invalid = [
+        '',
+        '555-0100',
+        '+',
+        '+0 123 4567',
+        '++44 20 7229 8331',
+        'not a phone number',
+        '0 800 123 456',
+    ]
+
+    return {
+        'uniform': [phone_number(rand, rand.choice(prefixes)[0]) for _ in range(size)],
+        'nanp': [phone_number(rand, rand.choice(nanp_prefixes)[0]) for _ in range(size)],
+        'eu': [phone_number(rand, rand.choice(eu_prefixes)[0]) for _ in range(size)],
+        'exceptions': [phone_number(rand, rand.choice(exception_prefixes)[0]) for _ in range(size)],
+        'invalid': [rand.choice(invalid) for _ in range(size)],
+    }
+
+
+def measure(func, values):
+    """
+    Calls a function once for each value, timing each call
+
+    :param func:
+        The function to call with a single argument
+
+    :param values:
+        A list of arguments
+
+    :return:
+        A dict with the keys "calls", "seconds", "calls_per_second" and
+        "latency", a dict of percentile name to seconds
+    """
+
+    latencies = []
+    for value in values:
+        start = timer()
+        try:
+            func(value)
+        except (ValueError):
+            pass
+        latencies.append(timer() - start)
+
+    total = sum(latencies)
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+    return {
+        'calls': len(latencies),
+        'seconds': total,
+        'calls_per_second': len(latencies) / total if total else None,
+        'latency': {
+            'p50': percentile(50),
+            'p90': percentile(90),
+            'p99': percentile(99),
+            'p999': percentile(99.9),
+            'max': latencies[-1],
+        }
+    }
+
+
+def lookup_country_code(number):
+    """
+    Benchmarks _lookup_country_code() on the normalized form of a number
+    """
+
+    digits, error = vat_moss.phone_number.normalize(number)
+    if error:
+        raise ValueError(error)
+    return vat_moss.phone_number._lookup_country_code(digits)
+
+
+def run(size, seed, engine, cache_size):
+    """
+    Runs the phone number benchmarks
+
+    :param size:
+        The integer number of phone numbers per corpus
+
+    :param seed:
+        The integer random seed
+
+    :param engine:
+        A unicode string of "trie" or "table"
+
+    :param cache_size:
+        An integer size for vat_moss.phone_number.enable_cache(), or None
+
+    :return:
+        A dict of the results
+    """
+
+    temp_dir = None
+    if engine == 'table':
+        temp_dir = tempfile.mkdtemp()
+        path = os.path.join(temp_dir, 'calling_codes.bin')
+        vat_moss.phone_number.compile_table(path)
+        vat_moss.phone_number.load_table(path)
+    if cache_size:
+        vat_moss.phone_number.enable_cache(cache_size)
+
+    try:
+        # Ensure any lazily-built structures are not part of the measurements
+        vat_moss.phone_number.calculate_rate('+1 978 572 0330')
+
+        results = {}
+        for name, numbers in sorted(corpora(size, seed).items()):
+            results[name] = {
+                'calculate_rate': measure(vat_moss.phone_number.calculate_rate, numbers),
+                '_lookup_country_code': measure(lookup_country_code, numbers),
+            }
+
+    finally:
+        vat_moss.phone_number.disable_cache()
+        vat_moss.phone_number.unload_table()
+        if temp_dir:
+            os.unlink(path)
+            os.rmdir(temp_dir)
+
+    return {
+        'benchmark': 'phone_number',
+        'version': vat_moss.__version__,
+        'python': platform.python_implementation() + ' ' + platform.python_version(),
+        'engine': engine,
+        'cache_size': cache_size,
+        'size': size,
+        'seed': seed,
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark vat_moss.phone_number, writing the results as JSON')
+    parser.add_argument('--size', type=int, default=10000, help='The number of phone numbers per corpus')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed for generating the corpora')
+    parser.add_argument('--engine', choices=['trie', 'table'], default='trie', help='The prefix lookup structure to use')
+    parser.add_argument('--cache-size', type=int, default=None, help='Enable the lookup cache with this size')
+    parser.add_argument('-o', '--output', default=None, help='The file to write results to, defaults to stdout')
+    args = parser.parse_args(argv)
+
+    results = run(args.size, args.seed, args.engine, args.cache_size)
+    output = json.dumps(results, indent=2, sort_keys=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
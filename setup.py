@@ -1,7 +1,36 @@
+import os
+
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
+
 import vat_moss
 
 
+class BuildPyCommand(build_py):
+
+    """
+    Generates the binary calling code table for vat_moss.phone_number, which
+    maps it when imported instead of building its lookup structures
+    """
+
+    def run(self):
+        build_py.run(self)
+
+        from vat_moss import phone_number
+
+        target = self._table_path()
+        self.announce('generating %s' % target, 2)
+        if not self.dry_run:
+            self.mkpath(os.path.dirname(target))
+            phone_number.compile_table(target)
+
+    def get_outputs(self, include_bytecode=1):
+        return build_py.get_outputs(self, include_bytecode) + [self._table_path()]
+
+    def _table_path(self):
+        return os.path.join(self.build_lib, 'vat_moss', 'calling_codes.table')
+
+
 setup(
     name='vat_moss',
     version=vat_moss.__version__,
@@ -30,5 +59,10 @@ setup(
 
     keywords='vat',
 
-    packages=find_packages(exclude=['tests*'])
+    packages=find_packages(exclude=['tests*']),
+    package_data={'vat_moss': ['calling_codes.table']},
+
+    cmdclass={
+        'build_py': BuildPyCommand,
+    }
 )
@@ -1,11 +1,19 @@
 import sys
 import unittest
 
+from tests.test_access_log import AccessLogTests
 from tests.test_billing_address import BillingAddressTests
+from tests.test_cache import CacheTests
 from tests.test_declared_residence import DeclaredResidenceTests
 from tests.test_geoip2 import Geoip2Tests
+from tests.test_id_transport import IdTransportTests
+from tests.test_instrumentation import InstrumentationTests
+from tests.test_mmdb import MmdbTests
+from tests.test_parallel import ParallelTests
 from tests.test_phone_number import PhoneNumberTests
+from tests.test_radix import RadixTests
 from tests.test_exchange_rates import ExchangeRatesTests
+from tests.test_streaming import StreamingTests
 
 if len(sys.argv) < 2 or sys.argv[1] != '--skip-id':
     from tests.test_id import IdTests
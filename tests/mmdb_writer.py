@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import socket
+import struct
+
+try:
+    # Python 2
+    str_cls = unicode
+    int_types = (int, long)
+except (NameError):
+    # Python 3
+    str_cls = str
+    int_types = (int,)
+
+
+def write_mmdb(path, networks, record_size=28, ip_version=6, database_type='GeoLite2-City'):
+    """
+    Writes a small MaxMind DB file for tests. Networks must not overlap.
+
+    :param path:
+        A unicode string filesystem path to write to
+
+    :param networks:
+        A list of (unicode string CIDR network, record) tuples. IPv4 networks
+        in an IPv6 database are placed under ::/96.
+
+    :param record_size:
+        24, 28 or 32
+
+    :param ip_version:
+        4 or 6
+
+    :param database_type:
+        A unicode string for the metadata
+    """
+
+    # Each node is a two-element list of children, which are None for empty,
+    # ('node', number) or ('data', offset in the data section)
+    nodes = [[None, None]]
+    data = bytearray()
+
+    for network, record in networks:
+        address, prefix_length = network.split('/')
+        packed = bytearray(_pack_ip(address))
+        prefix_length = int(prefix_length)
+        if len(packed) == 4 and ip_version == 6:
+            packed = bytearray(12) + packed
+            prefix_length += 96
+
+        record_offset = len(data)
+        data.extend(encode(record))
+
+        node = 0
+        for i in range(prefix_length):
+            bit = (packed[i >> 3] >> (7 - (i & 7))) & 1
+            if i == prefix_length - 1:
+                nodes[node][bit] = ('data', record_offset)
+                break
+            child = nodes[node][bit]
+            if child is None:
+                nodes.append([None, None])
+                child = ('node', len(nodes) - 1)
+                nodes[node][bit] = child
+            node = child[1]
+
+    node_count = len(nodes)
+
+    def value(child):
+        if child is None:
+            return node_count
+        if child[0] == 'node':
+            return child[1]
+        return node_count + 16 + child[1]
+
+    tree = bytearray()
+    for left, right in nodes:
+        left = value(left)
+        right = value(right)
+        if record_size == 24:
+            tree.extend(struct.pack(str('>I'), left)[1:])
+            tree.extend(struct.pack(str('>I'), right)[1:])
+        elif record_size == 28:
+            tree.extend(struct.pack(str('>I'), left)[1:])
+            tree.append(((left >> 20) & 0xF0) | ((right >> 24) & 0x0F))
+            tree.extend(struct.pack(str('>I'), right)[1:])
+        else:
+            tree.extend(struct.pack(str('>II'), left, right))
+
+    metadata = {
+        'node_count': _Uint(6, node_count),
+        'record_size': _Uint(5, record_size),
+        'ip_version': _Uint(5, ip_version),
+        'database_type': database_type,
+        'languages': ['en'],
+        'binary_format_major_version': _Uint(5, 2),
+        'binary_format_minor_version': _Uint(5, 0),
+        'build_epoch': _Uint(9, 0),
+        'description': {'en': 'vat_moss test database'},
+    }
+
+    if node_count + 16 + len(data) >= 2 ** record_size:
+        raise ValueError('The data does not fit a record size of %s' % record_size)
+
+    with open(path, 'wb') as f:
+        f.write(bytes(tree))
+        f.write(b'\x00' * 16)
+        f.write(bytes(data))
+        f.write(b'\xab\xcd\xefMaxMind.com')
+        f.write(bytes(encode(metadata)))
+
+
+class _Uint(object):
+
+    """
+    An unsigned integer with an explicit MaxMind DB type
+    """
+
+    def __init__(self, type_, value):
+        self.type_ = type_
+        self.value = value
+
+
+def encode(value):
+    """
+    Encodes a value in the MaxMind DB data format, without pointers
+
+    :param value:
+        A dict, list, unicode string, bool, float, integer or _Uint
+
+    :return:
+        A bytearray
+    """
+
+    if isinstance(value, dict):
+        output = _control(7, len(value))
+        for key in sorted(value):
+            output.extend(encode(key))
+            output.extend(encode(value[key]))
+        return output
+
+    if isinstance(value, list):
+        output = _control(11, len(value))
+        for element in value:
+            output.extend(encode(element))
+        return output
+
+    if isinstance(value, str_cls):
+        encoded = value.encode('utf-8')
+        return _control(2, len(encoded)) + bytearray(encoded)
+
+    if isinstance(value, bool):
+        return _control(14, 1 if value else 0)
+
+    if isinstance(value, float):
+        return _control(3, 8) + bytearray(struct.pack(str('>d'), value))
+
+    if isinstance(value, int_types):
+        value = _Uint(6 if value < 2 ** 32 else 9, value)
+
+    if isinstance(value, _Uint):
+        encoded = bytearray()
+        number = value.value
+        while number:
+            encoded.insert(0, number & 0xFF)
+            number >>= 8
+        return _control(value.type_, len(encoded)) + encoded
+
+    raise TypeError('%r can not be encoded' % value)
+
+
+def _control(type_, size):
+    """
+    :return:
+        A bytearray of the control byte, extended type and size bytes
+    """
+
+    extended = None
+    if type_ > 7:
+        extended = type_ - 7
+        type_ = 0
+
+    if size < 29:
+        output = bytearray([(type_ << 5) | size])
+        size_bytes = bytearray()
+    elif size < 285:
+        output = bytearray([(type_ << 5) | 29])
+        size_bytes = bytearray([size - 29])
+    elif size < 65821:
+        output = bytearray([(type_ << 5) | 30])
+        size_bytes = bytearray(struct.pack(str('>H'), size - 285))
+    else:
+        output = bytearray([(type_ << 5) | 31])
+        size_bytes = bytearray(struct.pack(str('>I'), size - 65821)[1:])
+
+    if extended is not None:
+        output.append(extended)
+    return output + size_bytes
+
+
+def _pack_ip(address):
+    """
+    :return:
+        A byte string of 4 or 16 bytes
+    """
+
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    return socket.inet_pton(family, str(address))
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import gc
+import gzip
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from decimal import Decimal
+
+import vat_moss.access_log
+import vat_moss.geoip2
+import vat_moss.streaming
+from vat_moss.__main__ import main
+from .mmdb_writer import write_mmdb
+from .test_mmdb import city_record
+
+
+COMBINED_LOG = (
+    '81.2.69.1 - - [10/Oct/2015:13:55:36 -0700] "GET / HTTP/1.1" 200 2326 "-" "Mozilla/5.0"\n'
+    '81.2.71.1 - frank [10/Oct/2015:13:55:37 -0700] "GET /buy HTTP/1.1" 200 512 "http://example.com/" "curl/7.0"\n'
+    '\n'
+    '81.2.70.1 - - [10/Oct/2015:13:55:38 -0700] "GET / HTTP/1.1" 200 2326\n'
+    '2a02:2f0::1 - - [10/Oct/2015:13:55:39 -0700] "GET / HTTP/1.1" 200 2326\n'
+    'example.com - - [10/Oct/2015:13:55:40 -0700] "GET / HTTP/1.1" 200 2326\n'
+    '10.0.0.1 - - [10/Oct/2015:13:55:41 -0700] "GET / HTTP/1.1" 200 2326\n'
+    '81.2.69.2 - - [10/Oct/2015:13:55:42 -0700] "GET / HTTP/1.1" 200 2326\n'
+)
+
+
+class AccessLogTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.database_path = os.path.join(self.temp_dir, 'GeoLite2-City.mmdb')
+        write_mmdb(self.database_path, [
+            ('81.2.69.0/24', city_record('AT', 'Vorarlberg', 'Mittelberg')),
+            ('81.2.70.0/24', city_record('IT', 'Lombardy', 'Como')),
+            ('81.2.71.0/24', city_record('IT', 'Lombardy', 'Livigno')),
+            ('2a02:2f0::/29', city_record('AT', 'Vorarlberg', 'Mittelberg')),
+        ])
+        vat_moss.geoip2.load_database(self.database_path)
+
+    def tearDown(self):
+        vat_moss.geoip2.unload_database()
+        shutil.rmtree(self.temp_dir)
+
+    def write_log(self, name, contents):
+        path = os.path.join(self.temp_dir, name)
+        if name.endswith('.gz'):
+            f = gzip.open(path, 'wb')
+        else:
+            f = io.open(path, 'wb')
+        with f:
+            f.write(contents.encode('utf-8'))
+        return path
+
+    def test_read_ips(self):
+        self.assertEqual(
+            ['81.2.69.1', '81.2.71.1', '81.2.70.1', '2a02:2f0::1', 'example.com', '10.0.0.1', '81.2.69.2'],
+            list(vat_moss.access_log.read_ips(io.StringIO(COMBINED_LOG)))
+        )
+        jsonl = '{"remote_addr": "81.2.69.1"}\n\n{"status": 200}\n'
+        self.assertEqual(
+            ['81.2.69.1', None],
+            list(vat_moss.access_log.read_ips(io.StringIO(jsonl), 'jsonl', 'remote_addr'))
+        )
+        with self.assertRaises(ValueError):
+            list(vat_moss.access_log.read_ips(io.StringIO('[1]\n'), 'jsonl'))
+        with self.assertRaises(ValueError):
+            list(vat_moss.access_log.read_ips(io.StringIO(COMBINED_LOG), 'csv'))
+
+    def test_summarize(self):
+        ips = vat_moss.access_log.read_ips(io.StringIO(COMBINED_LOG))
+        summary = vat_moss.access_log.summarize(ips, chunk_size=2)
+        self.assertEqual(
+            {
+                ('AT', 'Mittelberg', Decimal('0.19')): 3,
+                ('IT', 'Livigno', Decimal('0.0')): 1,
+            },
+            dict(summary['jurisdictions'])
+        )
+        self.assertEqual(1, summary['undefinitive'])
+        self.assertEqual(2, summary['unresolved'])
+
+    def test_summarize_files(self):
+        paths = [
+            self.write_log('access.log', COMBINED_LOG),
+            self.write_log('access.log.1.gz', COMBINED_LOG),
+            self.write_log('access.log.2.gz', '81.2.71.9 - - [09/Oct/2015:00:00:00 -0700] "GET / HTTP/1.1" 200 1\n'),
+        ]
+        for workers in (1, 2):
+            summary = vat_moss.access_log.summarize_files(paths, workers=workers)
+            self.assertEqual(
+                {
+                    ('AT', 'Mittelberg', Decimal('0.19')): 6,
+                    ('IT', 'Livigno', Decimal('0.0')): 3,
+                },
+                dict(summary['jurisdictions'])
+            )
+            self.assertEqual(2, summary['undefinitive'])
+            self.assertEqual(4, summary['unresolved'])
+
+    def test_access_log_command(self):
+        paths = [
+            self.write_log('access.log', COMBINED_LOG),
+            self.write_log('access.log.1.gz', COMBINED_LOG),
+        ]
+        output_path = os.path.join(self.temp_dir, 'report.jsonl')
+        args = ['access_log'] + paths + [
+            '--database', self.database_path, '-o', output_path, '--report-format', 'jsonl', '--workers', '0'
+        ]
+        self.assertEqual(0, main(args))
+
+        with io.open(output_path, 'r', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(
+            [
+                {'country_code': 'AT', 'exception_name': 'Mittelberg', 'vat_rate': '0.19', 'vat_error': None, 'requests': 6},
+                {'country_code': 'IT', 'exception_name': 'Livigno', 'vat_rate': '0.0', 'vat_error': None, 'requests': 2},
+                {'country_code': None, 'exception_name': None, 'vat_rate': None, 'vat_error': 'UndefinitiveError', 'requests': 2},
+                {'country_code': None, 'exception_name': None, 'vat_rate': None, 'vat_error': 'ValueError', 'requests': 4},
+            ],
+            rows
+        )
+
+    @unittest.skipIf(sys.version_info < (3,), 'Python 2 uses stdin directly')
+    def test_access_log_command_stdin(self):
+        output_path = os.path.join(self.temp_dir, 'report.csv')
+        stdin = sys.stdin
+        sys.stdin = io.TextIOWrapper(io.BytesIO(COMBINED_LOG.encode('utf-8')), encoding='utf-8')
+        try:
+            self.assertEqual(0, main(['access_log', '--database', self.database_path, '-o', output_path]))
+            gc.collect()
+            self.assertFalse(sys.stdin.closed)
+        finally:
+            sys.stdin = stdin
+
+        with io.open(output_path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        self.assertEqual('country_code,exception_name,vat_rate,vat_error,requests', lines[0])
+        self.assertEqual('AT,Mittelberg,0.19,,3', lines[1])
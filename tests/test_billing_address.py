@@ -147,3 +147,149 @@ class BillingAddressTests(unittest.TestCase):
     @data('invalid_addresses')
     def calculate_rate_invalid(self, country_code, postal_code, city):
         self.assertRaises(ValueError, vat_moss.billing_address.calculate_rate, country_code, postal_code, city)
+
+    @staticmethod
+    def unnormalized_addresses():
+        return (
+            ('de',  ' 27498 ',      ' Heligoland ',     'DE', '27498',   'heligoland'),
+            ('DE',  'D-27498',      'Heligoland',       'DE', '27498',   'heligoland'),
+            ('DE',  'de-27498',     'Heligoland',       'DE', '27498',   'heligoland'),
+            ('AT',  'A-66\u00a091', 'Jungholz',         'AT', '6691',    'jungholz'),
+            ('PT',  '9000-001',     'Funchal',          'PT', '9000001', 'funchal'),
+            ('GB',  'bf1\t2at',     'Sandwich',         'GB', 'BF12AT',  'sandwich'),
+            ('DE',  '78266',        'B\u00fcsingen',    'DE', '78266',   'b\u00fcsingen'),
+            ('IE',  None,           'Dublin',           'IE', None,      'dublin'),
+        )
+
+    @data('unnormalized_addresses')
+    def normalize(self, country_code, postal_code, city, expected_country_code, expected_postal_code, expected_city):
+        result = vat_moss.billing_address.normalize(country_code, postal_code, city)
+        self.assertEqual((expected_country_code, expected_postal_code, expected_city), result)
+
+    def test_calculate_normalized_rate(self):
+        for params in self.addresses():
+            normalized = vat_moss.billing_address.normalize(*params[0:3])
+            self.assertEqual(
+                vat_moss.billing_address.calculate_rate(*params[0:3]),
+                vat_moss.billing_address.calculate_normalized_rate(*normalized)
+            )
+
+    @data('invalid_addresses')
+    def normalize_invalid(self, country_code, postal_code, city):
+        self.assertRaises(ValueError, vat_moss.billing_address.normalize, country_code, postal_code, city)
+
+    @staticmethod
+    def postal_regexes():
+        return (
+            ('^6691$',                     [('6691', 0, 0, True)]),
+            ('^699[123]$',                 [('6991', 0, 0, True), ('6992', 0, 0, True), ('6993', 0, 0, True)]),
+            ('^(5107[0-1]|51081)$',        [('51070', 0, 0, True), ('51071', 0, 0, True), ('51081', 0, 0, True)]),
+            ('^(35\\d{3}|38\\d{3})$',      [('35', 3, 3, True), ('38', 3, 3, True)]),
+            ('^9[0-1]\\d{2,}$',            [('90', 2, None, True), ('91', 2, None, True)]),
+            ('^BFPO57|BF12AT$',            [('BFPO57', 0, 0, False), ('BF12AT', 0, 0, True)]),
+            ('^12\\d{1,3}',                [('12', 1, 3, False)]),
+        )
+
+    @data('postal_regexes')
+    def expand_postal_regex(self, regex, expected):
+        self.assertEqual(expected, vat_moss.billing_address._expand_postal_regex(regex))
+
+    def test_expand_postal_regex_unsupported(self):
+        for regex in ('^1.3$', '^\\d3$', '^(12$)', '^[^1]$', '^(12'):
+            with self.assertRaises(ValueError):
+                vat_moss.billing_address._expand_postal_regex(regex)
+
+    def test_index_fallback(self):
+        index = vat_moss.billing_address._build_index({
+            'XX': {
+                ('^1.3$', 'a(b|c)'): {
+                    'country_code': 'XX',
+                    'name': 'Test'
+                }
+            }
+        })
+        self.assertEqual({}, index['XX']['prefixes'])
+        self.assertEqual(1, len(index['XX']['fallback']))
+        self.assertEqual(None, index['XX']['rules'][0]['city_token'])
+        self.assertTrue(index['XX']['rules'][0]['city_regex'].search('xac'))
+
+    def test_matching_rules_order(self):
+        rules = vat_moss.billing_address._matching_rules('GB', 'BFPO57', 'akrotiri')
+        self.assertEqual(['CY'], [rule['country_code'] for rule in rules])
+        self.assertEqual([], vat_moss.billing_address._matching_rules('AT', '6991', 'hard'))
+        self.assertEqual([], vat_moss.billing_address._matching_rules('ES', '3500', 'las palmas'))
+        self.assertEqual([], vat_moss.billing_address._matching_rules('PT', '9x00', 'funchal'))
+
+    def test_calculate_rates(self):
+        columns = ([], [], [])
+        expected = ([], [], [], [])
+        for params in self.addresses():
+            for column, value in zip(columns, params[0:3]):
+                column.append(value)
+            result = vat_moss.billing_address.calculate_rate(*params[0:3])
+            for column, value in zip(expected, result + (None,)):
+                column.append(value)
+
+        self.assertEqual(expected, vat_moss.billing_address.calculate_rates(*columns))
+
+    def test_calculate_rates_errors(self):
+        rates, country_codes, exception_names, errors = vat_moss.billing_address.calculate_rates(
+            ['US', 'DE', 'CA', 'DE'],
+            ['02108', '27498', None, '10115'],
+            ['Boston', 'Heligoland', 'Ottawa', 'Berlin']
+        )
+        self.assertEqual([Decimal('0.0'), Decimal('0.0'), None, Decimal('0.19')], rates)
+        self.assertEqual(['US', 'DE', None, 'DE'], country_codes)
+        self.assertEqual([None, 'Heligoland', None, None], exception_names)
+        self.assertEqual([None, None], errors[0:2])
+        self.assertIsInstance(errors[2], ValueError)
+        self.assertEqual(None, errors[3])
+
+        with self.assertRaises(ValueError):
+            vat_moss.billing_address.calculate_rates(['US', 'DE'], ['02108', '27498'], ['Boston'])
+
+    def test_calculate_rate_rows(self):
+        rows = [
+            {'id': '1', 'country': 'DE', 'zip': '27498', 'town': 'Heligoland'},
+            {'id': '2', 'country': 'US', 'zip': '', 'town': 'Boston'},
+            {'id': '3', 'country': 'IE', 'zip': '', 'town': 'Dublin'},
+        ]
+        results = list(vat_moss.billing_address.calculate_rate_rows(iter(rows), 'country', 'zip', 'town', chunk_size=2))
+        self.assertEqual(['1', '2', '3'], [row['id'] for row in results])
+        self.assertEqual('Heligoland', results[0]['vat_exception_name'])
+        self.assertEqual(None, results[1]['vat_rate'])
+        self.assertIsInstance(results[1]['vat_error'], ValueError)
+        self.assertEqual('IE', results[2]['vat_country_code'])
+        self.assertNotIn('vat_rate', rows[0])
+
+        rejected = []
+        results = list(vat_moss.billing_address.calculate_rate_rows(rows, 'country', 'zip', 'town', rejected=rejected.append))
+        self.assertEqual(['1', '3'], [row['id'] for row in results])
+        self.assertEqual(['2'], [row['id'] for row in rejected])
+
+    def test_cache(self):
+        self.assertEqual(None, vat_moss.billing_address.cache_stats())
+
+        vat_moss.billing_address.enable_cache(10)
+        try:
+            for city in ('Heligoland', ' HELIGOLAND '):
+                self.assertEqual(
+                    (Decimal('0.0'), 'DE', 'Heligoland'),
+                    vat_moss.billing_address.calculate_rate('DE', '27498', city)
+                )
+            # Spain has no city-specific exceptions, so the city is not part of the key
+            for city in ('Las Palmas', 'Santa Cruz'):
+                self.assertEqual(
+                    (Decimal('0.0'), 'ES', 'Canary Islands'),
+                    vat_moss.billing_address.calculate_rate('ES', '35001', city)
+                )
+            vat_moss.billing_address.calculate_rate('US', '02108', 'Boston')
+
+            stats = vat_moss.billing_address.cache_stats()
+            self.assertEqual(2, stats['hits'])
+            self.assertEqual(2, stats['misses'])
+            self.assertEqual(2, stats['size'])
+        finally:
+            vat_moss.billing_address.disable_cache()
+
+        self.assertEqual(None, vat_moss.billing_address.cache_stats())
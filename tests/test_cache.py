@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import unittest
+
+from vat_moss.cache import LRUCache
+
+
+class CacheTests(unittest.TestCase):
+
+    def test_get_set(self):
+        cache = LRUCache(2)
+        self.assertEqual(None, cache.get('a'))
+        self.assertEqual(False, cache.get('a', False))
+        cache.set('a', 1)
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual({'hits': 1, 'misses': 2, 'evictions': 0, 'size': 1, 'maxsize': 2}, cache.stats())
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(2, len(cache))
+        self.assertEqual(None, cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual(1, cache.stats()['evictions'])
+
+    def test_clear(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.clear()
+        self.assertEqual({'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0, 'maxsize': 2}, cache.stats())
+
+    def test_invalid_size(self):
+        with self.assertRaises(ValueError):
+            LRUCache(0)
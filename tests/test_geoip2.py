@@ -1,10 +1,18 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import io
+import os
+import shutil
+import tempfile
 import unittest
 from decimal import Decimal
+from .mmdb_writer import write_mmdb
+from .test_mmdb import city_record
 from .unittest_data import DataDecorator, data
+import vat_moss.errors
 import vat_moss.geoip2
+from vat_moss.__main__ import main
 
 
 @DataDecorator
@@ -94,3 +102,330 @@ class Geoip2Tests(unittest.TestCase):
         self.assertEqual(result_rate, expected_rate)
         self.assertEqual(result_country_code, expected_country_code)
         self.assertEqual(result_exception_name, expected_exception_name)
+
+    def test_build_index(self):
+        city_info = {'name': 'Livigno', 'definitive': True}
+        subdivision_info = {'name': "Campione d'Italia", 'definitive': False}
+        index = vat_moss.geoip2._build_index({
+            'IT': {
+                'lombardy': subdivision_info,
+                ('lombardy', 'livigno'): city_info,
+            }
+        })
+        self.assertEqual(
+            {'IT': {'lombardy': {'cities': {'livigno': city_info}, 'default': subdivision_info}}},
+            index
+        )
+
+    def test_matching_rules_order(self):
+        exceptions = vat_moss.geoip2.GEOIP2_EXCEPTIONS['IT']
+        self.assertEqual(
+            [exceptions[('lombardy', 'livigno')], exceptions['lombardy']],
+            vat_moss.geoip2._matching_rules('IT', 'lombardy', 'livigno')
+        )
+        self.assertEqual([exceptions['lombardy']], vat_moss.geoip2._matching_rules('IT', 'lombardy', 'como'))
+        self.assertEqual([], vat_moss.geoip2._matching_rules('IT', 'lazio', 'rome'))
+        self.assertEqual([], vat_moss.geoip2._matching_rules('FR', 'corsica', 'ajaccio'))
+
+    def test_calculate_rate_for_ip(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'GeoLite2-City.mmdb')
+            write_mmdb(path, [
+                ('81.2.69.0/24', city_record('AT', 'Vorarlberg', 'Mittelberg')),
+                ('81.2.70.0/24', city_record('IT', 'Lombardy', 'Como')),
+                ('2.125.160.0/19', city_record('FI', None, 'Helsinki')),
+                ('2001:218::/32', city_record('US', 'Massachusetts', 'Newburyport')),
+            ])
+
+            with self.assertRaises(ValueError):
+                vat_moss.geoip2.calculate_rate_for_ip('81.2.69.1')
+
+            vat_moss.geoip2.load_database(path)
+            try:
+                self.assertEqual(
+                    (Decimal('0.19'), 'AT', 'Mittelberg'),
+                    vat_moss.geoip2.calculate_rate_for_ip('81.2.69.1')
+                )
+                self.assertEqual(
+                    (Decimal('0.24'), 'FI', None),
+                    vat_moss.geoip2.calculate_rate_for_ip('2.125.160.1')
+                )
+                self.assertEqual(
+                    (Decimal('0.0'), 'US', None),
+                    vat_moss.geoip2.calculate_rate_for_ip('2001:218::1')
+                )
+                with self.assertRaises(vat_moss.errors.UndefinitiveError):
+                    vat_moss.geoip2.calculate_rate_for_ip('81.2.70.1')
+                self.assertEqual(
+                    (Decimal('0.0'), 'IT', "Campione d'Italia"),
+                    vat_moss.geoip2.calculate_rate_for_ip('81.2.70.1', 'IT', "Campione d'Italia")
+                )
+                with self.assertRaises(ValueError):
+                    vat_moss.geoip2.calculate_rate_for_ip('10.0.0.1')
+                with self.assertRaises(ValueError):
+                    vat_moss.geoip2.calculate_rate_for_ip('not an ip')
+            finally:
+                vat_moss.geoip2.unload_database()
+
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def write_csvs(self, temp_dir):
+        locations_path = os.path.join(temp_dir, 'GeoLite2-City-Locations-en.csv')
+        with io.open(locations_path, 'w', encoding='utf-8') as f:
+            f.write(
+                'geoname_id,locale_code,continent_code,continent_name,country_iso_code,country_name,'
+                'subdivision_1_iso_code,subdivision_1_name,subdivision_2_iso_code,subdivision_2_name,'
+                'city_name,metro_code,time_zone,is_in_european_union\n'
+                '1,en,EU,Europe,AT,Austria,8,Vorarlberg,,,Mittelberg,,Europe/Vienna,1\n'
+                '2,en,EU,Europe,IT,Italy,25,Lombardy,CO,Como,Como,,Europe/Rome,1\n'
+                '3,en,EU,Europe,IT,Italy,25,Lombardy,SO,Sondrio,Livigno,,Europe/Rome,1\n'
+                '4,en,EU,Europe,DE,Germany,BE,Berlin,,,Berlin,,Europe/Berlin,1\n'
+                '5,en,EU,Europe,DE,Germany,HH,Hamburg,,,Hamburg,,Europe/Berlin,1\n'
+                '6,en,NA,"North America",US,"United States",MA,Massachusetts,,,Newburyport,,,0\n'
+                '7,en,EU,Europe,,,,,,,,,,0\n'
+            )
+
+        blocks_path = os.path.join(temp_dir, 'GeoLite2-City-Blocks-IPv4.csv')
+        with io.open(blocks_path, 'w', encoding='utf-8') as f:
+            f.write(
+                'network,geoname_id,registered_country_geoname_id,represented_country_geoname_id,'
+                'is_anonymous_proxy,is_satellite_provider,postal_code,latitude,longitude,accuracy_radius\n'
+                '81.2.69.0/24,1,1,,0,0,6991,47.3,10.1,20\n'
+                '81.2.70.0/24,2,2,,0,0,,45.8,9.1,20\n'
+                '81.2.71.0/24,3,2,,0,0,,46.5,10.1,20\n'
+                '81.2.72.0/23,4,4,,0,0,,52.5,13.4,20\n'
+                '81.2.74.0/24,5,4,,0,0,,53.5,10.0,20\n'
+                '81.2.76.0/24,7,,,1,0,,,,\n'
+                '81.2.77.0/24,,4,,0,0,,,,\n'
+                '223.255.255.0/24,6,6,,0,0,,,,\n'
+            )
+
+        blocks_v6_path = os.path.join(temp_dir, 'GeoLite2-City-Blocks-IPv6.csv')
+        with io.open(blocks_v6_path, 'w', encoding='utf-8') as f:
+            f.write(
+                'network,geoname_id,registered_country_geoname_id,represented_country_geoname_id,'
+                'is_anonymous_proxy,is_satellite_provider,postal_code,latitude,longitude,accuracy_radius\n'
+                '2001:218::/32,6,6,,0,0,,,,\n'
+                '2a02:2f0::/29,1,1,,0,0,,,,\n'
+            )
+        return (locations_path, blocks_path, blocks_v6_path)
+
+    def test_compile_database(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            locations_path, blocks_path, blocks_v6_path = self.write_csvs(temp_dir)
+
+            path = os.path.join(temp_dir, 'vat.table')
+            self.assertEqual(0, main(['compile_geoip2_database', path, locations_path, blocks_path, blocks_v6_path]))
+
+            vat_moss.geoip2.load_database(path)
+            try:
+                table = vat_moss.geoip2._database
+                self.assertEqual(('AT', 'vorarlberg', 'mittelberg'), table.location('81.2.69.1'))
+                self.assertEqual(('IT', 'lombardy', None), table.location('81.2.70.1'))
+                self.assertEqual(('IT', 'lombardy', 'livigno'), table.location('81.2.71.255'))
+                # Berlin and Hamburg have the same outcome, so are one range
+                self.assertEqual(('DE', None, None), table.location('81.2.74.1'))
+                self.assertEqual(4, len(table._ipv4) - 3)
+                self.assertEqual(None, table.location('81.2.75.1'))
+                self.assertEqual(None, table.location('81.2.76.1'))
+                self.assertEqual(None, table.location('81.2.77.1'))
+                self.assertEqual(None, table.location('1.1.1.1'))
+                self.assertEqual(('US', None, None), table.location('223.255.255.255'))
+                self.assertEqual(('US', None, None), table.location('2001:218::1'))
+                self.assertEqual(('AT', 'vorarlberg', 'mittelberg'), table.location('::ffff:81.2.69.1'))
+                self.assertEqual(None, table.location('::1'))
+
+                self.assertEqual(
+                    (Decimal('0.19'), 'AT', 'Mittelberg'),
+                    vat_moss.geoip2.calculate_rate_for_ip('81.2.69.1')
+                )
+                self.assertEqual(
+                    (Decimal('0.0'), 'IT', 'Livigno'),
+                    vat_moss.geoip2.calculate_rate_for_ip('81.2.71.1')
+                )
+                with self.assertRaises(vat_moss.errors.UndefinitiveError):
+                    vat_moss.geoip2.calculate_rate_for_ip('81.2.70.1')
+                self.assertEqual(
+                    (Decimal('0.19'), 'AT', 'Mittelberg'),
+                    vat_moss.geoip2.calculate_rate_for_ip('2a02:2f0::1')
+                )
+            finally:
+                vat_moss.geoip2.unload_database()
+
+            with open(path, 'r+b') as f:
+                f.seek(16)
+                f.write(b'\x00' * 20)
+            with self.assertRaises(ValueError):
+                vat_moss.geoip2.load_database(path)
+
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_range_columns(self):
+        self.assertEqual(
+            ([0, 10, 15, 20, 30], [0, 1, vat_moss.geoip2._NONE_ID, 2, vat_moss.geoip2._NONE_ID]),
+            vat_moss.geoip2._range_columns([(20, 24, 2), (0, 9, 0), (25, 29, 2), (10, 14, 1), (15, 19, vat_moss.geoip2._NONE_ID)], 4)
+        )
+        with self.assertRaises(ValueError):
+            vat_moss.geoip2._range_columns([(0, 10, 0), (5, 15, 1)], 4)
+
+    def test_calculate_rates_for_ips(self):
+        ips = [
+            '81.2.69.1', '81.2.70.1', 1359103233, '81.2.71.1', '10.0.0.1', 'bad', '2a02:2f0::1', '81.2.70.1',
+            '::ffff:81.2.69.2', '223.255.255.1', '81.2.70.2', '81.2.73.1', None,
+        ]
+        address_country_codes = ['AT', None, None, None, None, None, None, 'IT', None, 'US', 'IT', 'DE', None]
+        address_exceptions = [None, None, None, None, None, None, None, "Campione d'Italia", None, None, None, None, None]
+
+        temp_dir = tempfile.mkdtemp()
+        try:
+            table_path = os.path.join(temp_dir, 'vat.table')
+            locations_path, blocks_path, blocks_v6_path = self.write_csvs(temp_dir)
+            vat_moss.geoip2.compile_database(table_path, locations_path, [blocks_path, blocks_v6_path])
+
+            mmdb_path = os.path.join(temp_dir, 'GeoLite2-City.mmdb')
+            write_mmdb(mmdb_path, [
+                ('81.2.69.0/24', city_record('AT', 'Vorarlberg', 'Mittelberg')),
+                ('81.2.70.0/24', city_record('IT', 'Lombardy', 'Como')),
+                ('81.2.71.0/24', city_record('IT', 'Lombardy', 'Livigno')),
+                ('81.2.72.0/23', city_record('DE', 'Berlin', 'Berlin')),
+                ('223.255.255.0/24', city_record('US', 'Massachusetts', 'Newburyport')),
+                ('2a02:2f0::/29', city_record('AT', 'Vorarlberg', 'Mittelberg')),
+            ])
+
+            for path in (table_path, mmdb_path):
+                vat_moss.geoip2.load_database(path)
+                try:
+                    expected = ([], [], [], [])
+                    for params in zip(ips, address_country_codes, address_exceptions):
+                        try:
+                            result = vat_moss.geoip2.calculate_rate_for_ip(*params) + (None,)
+                        except (ValueError, vat_moss.errors.UndefinitiveError) as e:
+                            result = (None, None, None, e.__class__)
+                        for column, value in zip(expected, result):
+                            column.append(value)
+
+                    rates, country_codes, exception_names, errors = vat_moss.geoip2.calculate_rates_for_ips(
+                        ips,
+                        address_country_codes,
+                        address_exceptions
+                    )
+                    self.assertEqual(expected[0], rates)
+                    self.assertEqual(expected[1], country_codes)
+                    self.assertEqual(expected[2], exception_names)
+                    self.assertEqual(expected[3], [e.__class__ if e else None for e in errors])
+                    self.assertEqual(Decimal('0.19'), rates[2])
+                    self.assertIsInstance(errors[1], vat_moss.errors.UndefinitiveError)
+                    self.assertEqual("Campione d'Italia", exception_names[7])
+
+                    with self.assertRaises(ValueError):
+                        vat_moss.geoip2.calculate_rates_for_ips(ips, address_country_codes[1:])
+                    with self.assertRaises(ValueError):
+                        vat_moss.geoip2.calculate_rates_for_ips(ips, None, address_exceptions + [None])
+                finally:
+                    vat_moss.geoip2.unload_database()
+
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_reload_database(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'GeoLite2-City.mmdb')
+            write_mmdb(path, [('81.2.69.0/24', city_record('AT', 'Vorarlberg', 'Mittelberg'))])
+
+            with self.assertRaises(ValueError):
+                vat_moss.geoip2.reload_database()
+
+            self.assertEqual(None, vat_moss.geoip2.database_path())
+            vat_moss.geoip2.load_database(path)
+            try:
+                self.assertEqual(path, vat_moss.geoip2.database_path())
+                old_database = vat_moss.geoip2._database
+                self.assertEqual('AT', vat_moss.geoip2.calculate_rate_for_ip('81.2.69.1')[1])
+
+                # Replace the file, as a weekly update would
+                new_path = os.path.join(temp_dir, 'GeoLite2-City.mmdb.new')
+                write_mmdb(new_path, [('81.2.69.0/24', city_record('FR', 'Corsica', 'Ajaccio'))])
+                os.rename(new_path, path)
+
+                vat_moss.geoip2.reload_database()
+                self.assertEqual('FR', vat_moss.geoip2.calculate_rate_for_ip('81.2.69.1')[1])
+                # A lookup holding the old database is unaffected
+                self.assertEqual('AT', old_database.location('81.2.69.1')[0])
+
+                invalid_path = os.path.join(temp_dir, 'invalid.mmdb')
+                with open(invalid_path, 'wb') as f:
+                    f.write(b'\x00' * 100)
+                with self.assertRaises(ValueError):
+                    vat_moss.geoip2.reload_database(invalid_path)
+                self.assertEqual('FR', vat_moss.geoip2.calculate_rate_for_ip('81.2.69.1')[1])
+
+                errors = []
+                vat_moss.geoip2.reload_database(invalid_path, background=True, callback=errors.append).join()
+                self.assertIsInstance(errors[0], ValueError)
+                self.assertEqual('FR', vat_moss.geoip2.calculate_rate_for_ip('81.2.69.1')[1])
+
+                table_path = os.path.join(temp_dir, 'vat.table')
+                locations_path, blocks_path, blocks_v6_path = self.write_csvs(temp_dir)
+                vat_moss.geoip2.compile_database(table_path, locations_path, [blocks_path])
+                thread = vat_moss.geoip2.reload_database(table_path, background=True, callback=errors.append)
+                thread.join()
+                self.assertEqual(None, errors[1])
+                self.assertEqual(table_path, vat_moss.geoip2.database_path())
+                self.assertEqual(('AT', 'vorarlberg', 'mittelberg'), vat_moss.geoip2._database.location('81.2.69.1'))
+            finally:
+                vat_moss.geoip2.unload_database()
+            self.assertEqual(None, vat_moss.geoip2.database_path())
+
+            with self.assertRaises(ValueError):
+                vat_moss.geoip2.reload_database()
+
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_cache(self):
+        self.assertEqual(None, vat_moss.geoip2.cache_stats())
+
+        vat_moss.geoip2.enable_cache(10)
+        try:
+            # Definitive, so the address is not part of the key
+            for address_country_code in (None, 'ES', 'DE'):
+                self.assertEqual(
+                    (Decimal('0.0'), 'ES', 'Canary Islands'),
+                    vat_moss.geoip2.calculate_rate('ES', 'Canary Islands', 'Santa Cruz de Tenerife', address_country_code)
+                )
+            self.assertEqual(
+                {'hits': 2, 'misses': 1, 'evictions': 0, 'size': 1, 'maxsize': 10},
+                vat_moss.geoip2.cache_stats()
+            )
+
+            for _ in range(2):
+                with self.assertRaises(vat_moss.errors.UndefinitiveError):
+                    vat_moss.geoip2.calculate_rate('IT', 'Lombardy', 'Como')
+                self.assertEqual(
+                    (Decimal('0.0'), 'IT', "Campione d'Italia"),
+                    vat_moss.geoip2.calculate_rate('IT', 'Lombardy', 'Como', 'IT', "Campione d'Italia")
+                )
+                self.assertEqual(
+                    (Decimal('0.22'), 'IT', None),
+                    vat_moss.geoip2.calculate_rate('IT', 'Lombardy', 'Como', 'IT', None)
+                )
+            self.assertEqual(
+                (Decimal('0.0'), 'IT', 'Livigno'),
+                vat_moss.geoip2.calculate_rate('IT', 'Lombardy', 'Livigno')
+            )
+
+            # The location entry for Como, plus one entry per address
+            self.assertEqual(6, vat_moss.geoip2.cache_stats()['size'])
+
+            # Countries without exceptions are not cached
+            vat_moss.geoip2.calculate_rate('FR', 'Île-de-France', 'Paris')
+            self.assertEqual(6, vat_moss.geoip2.cache_stats()['size'])
+        finally:
+            vat_moss.geoip2.disable_cache()
+
+        self.assertEqual(None, vat_moss.geoip2.cache_stats())
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import socket
+import threading
+import unittest
+
+try:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.error import HTTPError, URLError
+except (ImportError):
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib2 import HTTPError, URLError
+
+import vat_moss.errors
+import vat_moss.id
+
+
+VIES_RESPONSE = (
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+    '<soap:Body>'
+    '<checkVatResponse xmlns="urn:ec.europa.eu:taxud:vies:services:checkVat:types">'
+    '<countryCode>DE</countryCode><vatNumber>173548186</vatNumber><valid>%s</valid>'
+    '<name>Ägypten GmbH</name>'
+    '</checkVatResponse>'
+    '</soap:Body>'
+    '</soap:Envelope>'
+)
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        self.respond(b'')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.respond(body)
+
+    def respond(self, request_body):
+        if self.path.startswith('/redirect/'):
+            self.send_response(int(self.path.split('/')[2]))
+            self.send_header('Location', '/echo')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if self.path == '/missing':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = request_body or b'hello'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if self.path == '/close':
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+
+class StaticTransport(object):
+
+    def __init__(self, body):
+        self.body = body
+        self.requests = []
+
+    def request(self, url, data=None, headers=None):
+        self.requests.append((url, data, headers))
+        return ('text/xml; charset=utf-8', self.body.encode('utf-8'))
+
+
+class IdTransportTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.lock = threading.Lock()
+        self.server.connections = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        vat_moss.id.set_transport(None)
+
+    def test_pooled_reuses_connection(self):
+        transport = vat_moss.id.PooledTransport()
+        try:
+            for _ in range(5):
+                self.assertEqual(
+                    ('text/plain; charset=utf-8', b'hello'),
+                    transport.request(self.base_url + '/echo')
+                )
+            self.assertEqual(
+                ('text/plain; charset=utf-8', b'data'),
+                transport.request(self.base_url + '/echo', b'data', {'Content-Type': 'text/plain'})
+            )
+            self.assertEqual(1, self.server.connections)
+        finally:
+            transport.close()
+
+    def test_pooled_connection_close(self):
+        transport = vat_moss.id.PooledTransport()
+        try:
+            transport.request(self.base_url + '/close')
+            transport.request(self.base_url + '/close')
+            self.assertEqual(2, self.server.connections)
+        finally:
+            transport.close()
+
+    def test_pooled_reconnects_after_close(self):
+        transport = vat_moss.id.PooledTransport()
+        try:
+            transport.request(self.base_url + '/echo')
+            # Simulate the server closing the idle connection
+            for pool in transport._pools.values():
+                for connection, _ in pool:
+                    connection.sock.close()
+            self.assertEqual(b'hello', transport.request(self.base_url + '/echo')[1])
+        finally:
+            transport.close()
+
+    def test_pooled_idle_timeout(self):
+        transport = vat_moss.id.PooledTransport(idle_timeout=0)
+        try:
+            transport.request(self.base_url + '/echo')
+            transport.request(self.base_url + '/echo')
+            self.assertEqual(2, self.server.connections)
+        finally:
+            transport.close()
+
+    def test_pooled_redirect(self):
+        transport = vat_moss.id.PooledTransport()
+        try:
+            for status in (301, 302, 303):
+                # The POST is converted to a GET without the body, as urllib does
+                self.assertEqual(b'hello', transport.request(self.base_url + '/redirect/%d' % status, b'data')[1])
+            for status in (307, 308):
+                self.assertEqual(b'data', transport.request(self.base_url + '/redirect/%d' % status, b'data')[1])
+        finally:
+            transport.close()
+
+    def test_pooled_errors(self):
+        transport = vat_moss.id.PooledTransport()
+        try:
+            with self.assertRaises(HTTPError) as context:
+                transport.request(self.base_url + '/missing')
+            self.assertEqual(404, context.exception.code)
+            with self.assertRaises(ValueError):
+                transport.request('ftp://127.0.0.1/')
+            with self.assertRaises(ValueError):
+                vat_moss.id.PooledTransport(pool_size=0)
+        finally:
+            transport.close()
+
+        # Find a port nothing is listening on
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        port = listener.getsockname()[1]
+        listener.close()
+        with self.assertRaises(URLError):
+            vat_moss.id.PooledTransport(timeout=1).request('http://127.0.0.1:%d/' % port)
+
+    def test_pooled_threads(self):
+        transport = vat_moss.id.PooledTransport(pool_size=2)
+        results = []
+
+        def run():
+            for _ in range(10):
+                results.append(transport.request(self.base_url + '/echo')[1])
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual([b'hello'] * 40, results)
+            # Each thread only holds one connection at a time, and returned
+            # connections are reused rather than each request opening one
+            self.assertTrue(self.server.connections <= transport.pool_size * len(threads))
+            self.assertTrue(len(transport._pools[('http', '127.0.0.1', self.server.server_address[1])]) <= 2)
+        finally:
+            transport.close()
+
+    def test_validate_transport(self):
+        transport = StaticTransport(VIES_RESPONSE % 'true')
+        vat_moss.id.set_transport(transport)
+        self.assertEqual(('DE', 'DE173548186', 'Ägypten GmbH'), vat_moss.id.validate('DE 173548186'))
+        self.assertEqual(1, len(transport.requests))
+        url, data, headers = transport.requests[0]
+        self.assertEqual('http://ec.europa.eu/taxation_customs/vies/services/checkVatService', url)
+        self.assertTrue(b'<urn:vatNumber>173548186</urn:vatNumber>' in data)
+
+        vat_moss.id.set_transport(StaticTransport(VIES_RESPONSE % 'false'))
+        with self.assertRaises(vat_moss.errors.InvalidError):
+            vat_moss.id.validate('DE 173548186')
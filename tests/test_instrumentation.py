@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import unittest
+
+from vat_moss.instrumentation import Instrumentation
+
+
+class InstrumentationTests(unittest.TestCase):
+
+    def test_counters(self):
+        instrumentation = Instrumentation()
+        instrumentation.increment('lookups')
+        instrumentation.increment('lookups', key='DE')
+        instrumentation.increment('nodes_visited', 3, key='DE')
+        instrumentation.increment('nodes_visited', 2, key='AT')
+
+        stats = instrumentation.snapshot()
+        self.assertEqual({'lookups': 2, 'nodes_visited': 5}, stats['counters'])
+        self.assertEqual({'lookups': {'DE': 1}, 'nodes_visited': {'DE': 3, 'AT': 2}}, stats['breakdowns'])
+
+    def test_histogram(self):
+        instrumentation = Instrumentation([0.1, 0.001])
+        instrumentation.observe(0.0005)
+        instrumentation.observe(0.001)
+        instrumentation.observe(0.05)
+        instrumentation.observe(5)
+
+        histogram = instrumentation.snapshot()['histogram']
+        self.assertEqual([(0.001, 2), (0.1, 3), (None, 4)], histogram['buckets'])
+        self.assertEqual(4, histogram['count'])
+        self.assertAlmostEqual(5.0515, histogram['sum'])
+
+    def test_reset(self):
+        instrumentation = Instrumentation()
+        instrumentation.increment('lookups', key='DE')
+        instrumentation.observe(1)
+        instrumentation.reset()
+
+        stats = instrumentation.snapshot()
+        self.assertEqual({}, stats['counters'])
+        self.assertEqual({}, stats['breakdowns'])
+        self.assertEqual(0, stats['histogram']['count'])
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from vat_moss.mmdb import Reader, _Decoder
+from .mmdb_writer import write_mmdb
+
+
+def city_record(country_code, subdivision, city):
+    record = {
+        'continent': {'code': 'EU', 'geoname_id': 6255148, 'names': {'en': 'Europe', 'de': 'Europa'}},
+        'country': {'geoname_id': 1, 'iso_code': country_code, 'names': {'en': country_code}},
+        'location': {'latitude': 47.5, 'longitude': 10.5, 'accuracy_radius': 50},
+        'traits': {'is_anonymous_proxy': False},
+    }
+    if subdivision:
+        record['subdivisions'] = [
+            {'iso_code': 'X', 'names': {'en': subdivision}},
+            {'iso_code': 'Y', 'names': {'en': 'Second'}},
+        ]
+    if city:
+        record['city'] = {'geoname_id': 2, 'names': {'en': city, 'fr': city.upper()}}
+    return record
+
+
+NETWORKS = [
+    ('81.2.69.0/24', city_record('AT', 'Vorarlberg', 'Mittelberg')),
+    ('81.2.70.0/23', city_record('IT', 'Lombardy', 'Livigno')),
+    ('2.125.160.0/19', city_record('GB', None, None)),
+    ('2001:218::/32', city_record('DE', 'Schleswig-Holstein', 'Pinneberg')),
+]
+
+
+class MmdbTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def reader(self, record_size=28, ip_version=6, networks=NETWORKS):
+        path = os.path.join(self.temp_dir, 'test-%s-%s.mmdb' % (record_size, ip_version))
+        write_mmdb(path, networks, record_size, ip_version)
+        reader = Reader(path)
+        self.addCleanup(reader.close)
+        return reader
+
+    def test_record_sizes(self):
+        for record_size in (24, 28, 32):
+            reader = self.reader(record_size)
+            self.assertEqual(('AT', 'Vorarlberg', 'Mittelberg'), reader.location('81.2.69.160'))
+            self.assertEqual(('IT', 'Lombardy', 'Livigno'), reader.location('81.2.71.1'))
+            self.assertEqual(('GB', None, None), reader.location('2.125.160.216'))
+            self.assertEqual(('DE', 'Schleswig-Holstein', 'Pinneberg'), reader.location('2001:218:85a3::1'))
+            self.assertEqual(None, reader.location('81.2.72.1'))
+            self.assertEqual(None, reader.location('2002::1'))
+
+    def test_ipv4_database(self):
+        reader = self.reader(24, 4, NETWORKS[0:3])
+        self.assertEqual(4, reader.ip_version)
+        self.assertEqual(('AT', 'Vorarlberg', 'Mittelberg'), reader.location('81.2.69.1'))
+        with self.assertRaises(ValueError):
+            reader.location('2001:218::1')
+
+    def test_get(self):
+        reader = self.reader()
+        record = reader.get('81.2.69.160')
+        self.assertEqual(city_record('AT', 'Vorarlberg', 'Mittelberg'), record)
+        self.assertEqual(None, reader.get('10.0.0.1'))
+        self.assertEqual('GeoLite2-City', reader.metadata['database_type'])
+
+    def test_invalid_ip(self):
+        reader = self.reader()
+        for ip in ('', '81.2.69', '81.2.69.256', 'not an ip', '2001:::1', 'ü', None):
+            with self.assertRaises(ValueError):
+                reader.location(ip)
+
+    def test_not_mmdb(self):
+        path = os.path.join(self.temp_dir, 'not.mmdb')
+        with open(path, 'wb') as f:
+            f.write(b'\x00' * 100)
+        with self.assertRaises(ValueError):
+            Reader(path)
+
+    def test_decoder_pointers(self):
+        # "en" at 0, followed by a map with a pointer key and value
+        data = b'\x42en' + b'\xe1\x20\x00\x20\x00'
+        decoder = _Decoder(data, 0)
+        self.assertEqual(({'en': 'en'}, 8), decoder.decode(3))
+        self.assertEqual('en', decoder.find(3, ('en',)))
+        self.assertEqual(None, decoder.find(3, ('fr',)))
+
+    def test_decoder_types(self):
+        decoder = _Decoder(
+            b'\x01\x07' +                                 # boolean true
+            b'\x04\x01\xff\xff\xff\xff' +                 # int32 -1
+            b'\x68\x3f\xf8\x00\x00\x00\x00\x00\x00' +     # double 1.5
+            b'\x04\x08\x3f\xc0\x00\x00' +                 # float 1.5
+            b'\x5d\x01' + b'a' * 30 +                     # 30 byte string
+            b'\x01\x04\x81A',                             # array of 1 byte bytes
+            0
+        )
+        self.assertEqual((True, 2), decoder.decode(0))
+        self.assertEqual((-1, 8), decoder.decode(2))
+        self.assertEqual((1.5, 17), decoder.decode(8))
+        self.assertEqual((1.5, 23), decoder.decode(17))
+        self.assertEqual(('a' * 30, 55), decoder.decode(23))
+        self.assertEqual(([b'A'], 59), decoder.decode(55))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import vat_moss.billing_address
+import vat_moss.parallel
+import vat_moss.phone_number
+import vat_moss.streaming
+from vat_moss.__main__ import main
+
+
+class ParallelTests(unittest.TestCase):
+
+    def rows(self):
+        addresses = [
+            ('DE', '27498', 'Heligoland'),
+            ('US', '', 'Boston'),
+            ('AT', '6691', 'Jungholz'),
+            ('ES', '35001', 'Las Palmas'),
+            ('IE', '', 'Dublin'),
+        ]
+        return [
+            {'id': str(i), 'country_code': address[0], 'postal_code': address[1], 'city': address[2]}
+            for i, address in enumerate(addresses * 3)
+        ]
+
+    def test_map_rows(self):
+        rows = self.rows()
+        expected = list(vat_moss.billing_address.calculate_rate_rows(rows))
+        # Exceptions do not compare equal after pickling
+        for row in expected:
+            row['vat_error'] = repr(row['vat_error'])
+
+        results = list(vat_moss.parallel.map_rows(
+            vat_moss.billing_address.calculate_rate_rows,
+            iter(rows),
+            workers=2,
+            chunk_size=2
+        ))
+        for row in results:
+            row['vat_error'] = repr(row['vat_error'])
+        self.assertEqual(expected, results)
+
+    def test_map_rows_kwargs(self):
+        rows = [{'phone': '+43 5676 8135'}, {'phone': '+1 978 572 0330'}]
+        results = list(vat_moss.parallel.map_rows(
+            vat_moss.phone_number.calculate_rate_rows,
+            rows,
+            workers=2,
+            chunk_size=1,
+            phone_number_field='phone'
+        ))
+        self.assertEqual(['AT', 'US'], [row['vat_country_code'] for row in results])
+
+    def test_load_tables_with_mapped_table(self):
+        temp_dir = tempfile.mkdtemp()
+        trie = vat_moss.phone_number._CALLING_CODE_TRIE
+        try:
+            path = os.path.join(temp_dir, 'phone.table')
+            vat_moss.phone_number.compile_table(path)
+            vat_moss.phone_number.load_table(path)
+            vat_moss.phone_number._CALLING_CODE_TRIE = None
+            try:
+                vat_moss.parallel._load_tables()
+                self.assertEqual(None, vat_moss.phone_number._CALLING_CODE_TRIE)
+            finally:
+                vat_moss.phone_number.unload_table()
+            vat_moss.parallel._load_tables()
+            self.assertNotEqual(None, vat_moss.phone_number._CALLING_CODE_TRIE)
+        finally:
+            vat_moss.phone_number._CALLING_CODE_TRIE = trie
+            shutil.rmtree(temp_dir)
+
+    def test_map_rows_invalid_workers(self):
+        with self.assertRaises(ValueError):
+            list(vat_moss.parallel.map_rows(vat_moss.billing_address.calculate_rate_rows, [], workers=0))
+
+    def test_billing_address_command_workers(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            input_path = os.path.join(temp_dir, 'input.jsonl')
+            output_path = os.path.join(temp_dir, 'output.jsonl')
+            rejected_path = os.path.join(temp_dir, 'rejected.jsonl')
+
+            output_file = vat_moss.streaming.open_output(input_path)
+            vat_moss.streaming.write_rows(output_file, self.rows(), 'jsonl')
+            output_file.close()
+
+            args = ['billing_address', input_path, '-f', 'jsonl', '-o', output_path, '--rejected', rejected_path]
+            self.assertEqual(0, main(args + ['--workers', '2', '--chunk-size', '4']))
+
+            input_file = vat_moss.streaming.open_input(output_path)
+            rows = list(vat_moss.streaming.read_rows(input_file, 'jsonl'))
+            input_file.close()
+            self.assertEqual(['0', '2', '3', '4', '5', '7', '8', '9', '10', '12', '13', '14'], [row['id'] for row in rows])
+
+            input_file = vat_moss.streaming.open_input(rejected_path)
+            rows = list(vat_moss.streaming.read_rows(input_file, 'jsonl'))
+            input_file.close()
+            self.assertEqual(['1', '6', '11'], [row['id'] for row in rows])
+
+        finally:
+            shutil.rmtree(temp_dir)
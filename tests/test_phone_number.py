@@ -1,10 +1,17 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import os
+import re
+import shutil
+import tempfile
 import unittest
 from decimal import Decimal
 from .unittest_data import DataDecorator, data
+import vat_moss.calling_codes
+import vat_moss.errors
 import vat_moss.phone_number
+from vat_moss.__main__ import main
 
 
 @DataDecorator
@@ -319,3 +326,378 @@ class PhoneNumberTests(unittest.TestCase):
         self.assertEqual(result_rate, expected_rate)
         self.assertEqual(result_country_code, expected_country_code)
         self.assertEqual(result_exception_name, expected_exception_name)
+
+    def test_expand_regex(self):
+        self.assertEqual(['35129' + digit for digit in '256'], vat_moss.phone_number._expand_regex('35129[256]'))
+        self.assertEqual(
+            ['59059051', '59059052', '59069010', '59069022'],
+            vat_moss.phone_number._expand_regex('590(590(51|52)|690(10|22))')
+        )
+
+    def test_expand_regex_unsupported(self):
+        with self.assertRaises(ValueError):
+            vat_moss.phone_number._expand_regex('1(2|3')
+        with self.assertRaises(ValueError):
+            vat_moss.phone_number._expand_regex('1.*')
+
+    def test_lookup_country_code_matches_regexes(self):
+        for leading_digit in vat_moss.calling_codes.CALLING_CODE_MAPPING:
+            for info in vat_moss.calling_codes.CALLING_CODE_MAPPING[leading_digit]:
+                for prefix in vat_moss.phone_number._expand_regex(info['regex']):
+                    for suffix in ('', '0', '5555', '99999'):
+                        phone_number = prefix + suffix
+                        expected = None
+                        for mapping in vat_moss.calling_codes.CALLING_CODE_MAPPING[leading_digit]:
+                            if re.match(mapping['regex'], phone_number):
+                                expected = mapping['country_code']
+                                break
+                        self.assertEqual(expected, vat_moss.phone_number._lookup_country_code(phone_number))
+
+    def test_lookup_exceptions(self):
+        country_code, exceptions = vat_moss.phone_number._lookup('34922214743')
+        self.assertEqual('ES', country_code)
+        self.assertEqual(['Canary Islands'], [info['name'] for info in exceptions])
+
+        country_code, exceptions = vat_moss.phone_number._lookup('41526300060')
+        self.assertEqual('CH', country_code)
+        self.assertEqual([('DE', False)], [(info['country_code'], info['definitive']) for info in exceptions])
+
+        self.assertEqual(('ES', []), vat_moss.phone_number._lookup('34913550873'))
+        self.assertEqual((None, []), vat_moss.phone_number._lookup('0'))
+
+    def test_calculate_rates(self):
+        phone_numbers = []
+        address_country_codes = []
+        address_exceptions = []
+        expected = ([], [], [], [])
+        for phone_number, address_country_code, address_exception, rate, country_code, exception_name in self.phone_numbers():
+            phone_numbers.append(phone_number)
+            address_country_codes.append(address_country_code)
+            address_exceptions.append(address_exception)
+            result = vat_moss.phone_number.calculate_rate(phone_number, address_country_code, address_exception)
+            for column, value in zip(expected, result + (None,)):
+                column.append(value)
+
+        result = vat_moss.phone_number.calculate_rates(phone_numbers, address_country_codes, address_exceptions)
+        self.assertEqual(expected, result)
+
+    def test_calculate_rates_errors(self):
+        rates, country_codes, exception_names, errors = vat_moss.phone_number.calculate_rates(
+            ['+41 52 503 40 57', '', '+49 4725 81410']
+        )
+        self.assertEqual([None, None, Decimal('0.0')], rates)
+        self.assertEqual([None, None, 'DE'], country_codes)
+        self.assertEqual([None, None, 'Heligoland'], exception_names)
+        self.assertIsInstance(errors[0], vat_moss.errors.UndefinitiveError)
+        self.assertIsInstance(errors[1], ValueError)
+        self.assertEqual(None, errors[2])
+
+        with self.assertRaises(ValueError):
+            vat_moss.phone_number.calculate_rates(['+1 613-836-2527'], ['CA', 'US'])
+
+    def test_calculate_rates_shared_by_area(self):
+        numbers = ['+1 978 555 %04d' % (suffix * 97) for suffix in range(100)]
+        numbers.extend(['+30 697 222 2222', '+30 697 333 3333'])
+
+        vat_moss.phone_number.enable_instrumentation()
+        try:
+            rates, country_codes, exception_names, errors = vat_moss.phone_number.calculate_rates(numbers)
+            self.assertEqual(['US'] * 100 + ['GR'] * 2, country_codes)
+
+            counters = vat_moss.phone_number.instrumentation_stats()['counters']
+            self.assertEqual(100, counters['batch_prefix_hits'])
+            self.assertEqual(2, counters['batch_prefix_misses'])
+
+        finally:
+            vat_moss.phone_number.disable_instrumentation()
+
+    def test_cursor(self):
+        cursor = vat_moss.phone_number.PhoneNumberCursor()
+        self.assertEqual('ambiguous', cursor.push('+3'))
+        self.assertEqual('ambiguous', cursor.push('4 '))
+        self.assertEqual(set(['ES']), cursor.candidates)
+        self.assertEqual('ambiguous', cursor.push('92'))
+        self.assertEqual('resolved', cursor.push('2'))
+        self.assertEqual((Decimal('0.0'), 'ES', 'Canary Islands'), cursor.result())
+        self.assertEqual('resolved', cursor.push('21'))
+        cursor.pop()
+        cursor.pop()
+        cursor.pop()
+        self.assertEqual((Decimal('0.21'), 'ES', None), cursor.result())
+
+    def test_cursor_undefinitive(self):
+        cursor = vat_moss.phone_number.PhoneNumberCursor()
+        self.assertEqual('undefinitive', cursor.push('+41 52 503 40 57'))
+        with self.assertRaises(vat_moss.errors.UndefinitiveError):
+            cursor.result()
+
+        cursor = vat_moss.phone_number.PhoneNumberCursor('DE', 'Büsingen am Hochrhein')
+        self.assertEqual('resolved', cursor.push('+41 52 503 40 57'))
+        self.assertEqual((Decimal('0.0'), 'DE', 'Büsingen am Hochrhein'), cursor.result())
+
+    def test_cursor_invalid(self):
+        cursor = vat_moss.phone_number.PhoneNumberCursor()
+        self.assertEqual('invalid', cursor.push('1'))
+        self.assertEqual(set(), cursor.candidates)
+        with self.assertRaises(ValueError):
+            cursor.result()
+        self.assertEqual('ambiguous', cursor.pop())
+
+    @data('phone_numbers')
+    def cursor_result(self, phone_number, address_country_code, address_exception, expected_rate, expected_country_code, expected_exception_name):
+        cursor = vat_moss.phone_number.PhoneNumberCursor(address_country_code, address_exception)
+        for char in phone_number:
+            cursor.push(char)
+        self.assertEqual(vat_moss.phone_number.calculate_rate(phone_number, address_country_code, address_exception), cursor.result())
+
+    @staticmethod
+    def normalize_info():
+        return (
+            ('+43 5676 8135',       '4356768135',  None),
+            ('0043 (5676) 8135',    '4356768135',  None),
+            ('‎+49 173-2050004', '491732050004', None),
+            ('+٤٩ ١٧٣', '49173', None),
+            ('+４９ 173',   '49173',       None),
+            ('',                    None,          'No phone number provided'),
+            (b'+4356768135',        None,          'Phone number is not a string'),
+            ('043 5676 8135',       None,          'Phone number is not in international format with a leading +'),
+            ('+ ()',                None,          'Phone number does not appear to contain any digits'),
+        )
+
+    @data('normalize_info')
+    def normalize(self, phone_number, expected_digits, expected_error):
+        self.assertEqual((expected_digits, expected_error), vat_moss.phone_number.normalize(phone_number))
+
+    def test_calculate_rate_00_prefix(self):
+        self.assertEqual(
+            vat_moss.phone_number.calculate_rate('+34 922 21 47 43'),
+            vat_moss.phone_number.calculate_rate('0034 922 21 47 43')
+        )
+
+    def test_cursor_00_prefix(self):
+        cursor = vat_moss.phone_number.PhoneNumberCursor()
+        self.assertEqual('ambiguous', cursor.push('0'))
+        self.assertEqual('ambiguous', cursor.push('0'))
+        self.assertEqual('resolved', cursor.push('34922'))
+        self.assertEqual((Decimal('0.0'), 'ES', 'Canary Islands'), cursor.result())
+
+    def test_calculate_rate_rows(self):
+        rows = [
+            {'id': '1', 'phone': '+41 52 503 40 57', 'country': 'DE', 'exception': 'Büsingen am Hochrhein'},
+            {'id': '2', 'phone': '+41 52 503 40 57', 'country': '', 'exception': ''},
+            {'id': '3', 'phone': '+1 613-836-2527', 'country': 'CA', 'exception': ''},
+        ]
+        results = list(vat_moss.phone_number.calculate_rate_rows(iter(rows), 'phone', 'country', 'exception', chunk_size=2))
+        self.assertEqual(['1', '2', '3'], [row['id'] for row in results])
+        self.assertEqual(
+            [Decimal('0.0'), None, Decimal('0.0')],
+            [row['vat_rate'] for row in results]
+        )
+        self.assertEqual('Büsingen am Hochrhein', results[0]['vat_exception_name'])
+        self.assertIsInstance(results[1]['vat_error'], vat_moss.errors.UndefinitiveError)
+        self.assertEqual('CA', results[2]['vat_country_code'])
+        self.assertNotIn('vat_rate', rows[0])
+
+    def test_load_table(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'calling_codes.bin')
+            self.assertEqual(0, main(['compile_phone_table', path]))
+
+            expected = [vat_moss.phone_number.calculate_rate(*params[0:3]) for params in self.phone_numbers()]
+            vat_moss.phone_number.load_table(path)
+            try:
+                self.assertEqual(expected, [vat_moss.phone_number.calculate_rate(*params[0:3]) for params in self.phone_numbers()])
+                self.assertEqual(('CH', []), vat_moss.phone_number._lookup('41'))
+                self.assertEqual((None, []), vat_moss.phone_number._lookup('0'))
+            finally:
+                vat_moss.phone_number.unload_table()
+
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_load_table_invalid(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'calling_codes.bin')
+            vat_moss.phone_number.compile_table(path)
+            with open(path, 'rb') as f:
+                contents = f.read()
+
+            with open(path, 'wb') as f:
+                f.write(contents[0:-1])
+            with self.assertRaises(ValueError):
+                vat_moss.phone_number.load_table(path)
+
+            with open(path, 'wb') as f:
+                f.write(b'XXXX' + contents[4:])
+            with self.assertRaises(ValueError):
+                vat_moss.phone_number.load_table(path)
+
+            original = vat_moss.phone_number._data_fingerprint()
+            vat_moss.phone_number._DATA_FINGERPRINT = b'\x00' * 20
+            try:
+                with open(path, 'wb') as f:
+                    f.write(contents)
+                with self.assertRaises(ValueError):
+                    vat_moss.phone_number.load_table(path)
+            finally:
+                vat_moss.phone_number._DATA_FINGERPRINT = original
+
+            self.assertEqual(None, vat_moss.phone_number._table)
+
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_load_default_table(self):
+        original_path = vat_moss.phone_number._DEFAULT_TABLE_PATH
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'calling_codes.table')
+            vat_moss.phone_number._DEFAULT_TABLE_PATH = path
+
+            vat_moss.phone_number._load_default_table()
+            self.assertEqual(None, vat_moss.phone_number._table)
+
+            vat_moss.phone_number.compile_table(path)
+            vat_moss.phone_number._load_default_table()
+            try:
+                self.assertNotEqual(None, vat_moss.phone_number._table)
+                self.assertEqual(
+                    (Decimal('0.0'), 'ES', 'Canary Islands'),
+                    vat_moss.phone_number.calculate_rate('+34 922 21 47 43')
+                )
+            finally:
+                vat_moss.phone_number.unload_table()
+
+            # A stale table is ignored rather than raising on import
+            with open(path, 'r+b') as f:
+                f.write(b'XXXX')
+            vat_moss.phone_number._load_default_table()
+            self.assertEqual(None, vat_moss.phone_number._table)
+
+        finally:
+            vat_moss.phone_number._DEFAULT_TABLE_PATH = original_path
+            shutil.rmtree(temp_dir)
+
+    def test_instrumentation(self):
+        self.assertEqual(None, vat_moss.phone_number.instrumentation_stats())
+
+        vat_moss.phone_number.enable_instrumentation()
+        try:
+            vat_moss.phone_number.calculate_rate('+34 922 21 47 43')
+            with self.assertRaises(ValueError):
+                vat_moss.phone_number.calculate_rate('+0')
+            vat_moss.phone_number.calculate_rates(['+1 613-836-2527', '+1 (613) 836-2527'])
+
+            stats = vat_moss.phone_number.instrumentation_stats()
+            self.assertEqual(2, stats['counters']['calls'])
+            self.assertEqual(4, stats['counters']['lookups'])
+            self.assertEqual(1, stats['counters']['invalid'])
+            self.assertEqual(1, stats['counters']['batch_prefix_hits'])
+            self.assertEqual(1, stats['counters']['batch_prefix_misses'])
+            self.assertNotIn('cache_hits', stats['counters'])
+            self.assertNotIn('cache_misses', stats['counters'])
+            self.assertEqual({'ES': 1, 'CA': 2}, stats['breakdowns']['lookups'])
+            self.assertEqual(5, stats['breakdowns']['nodes_visited']['ES'])
+            self.assertEqual({'ES': 1, 'CA': 0}, stats['breakdowns']['exceptions_checked'])
+            self.assertEqual(4, stats['histogram']['count'])
+
+        finally:
+            vat_moss.phone_number.disable_instrumentation()
+
+        self.assertEqual(None, vat_moss.phone_number.instrumentation_stats())
+
+    def test_instrumentation_with_cache(self):
+        numbers = ['+1 613-836-2527', '+1 (613) 836-2527', '+34 922 21 47 43', '+0']
+
+        vat_moss.phone_number.enable_instrumentation()
+        try:
+            vat_moss.phone_number.calculate_rates(numbers)
+            vat_moss.phone_number.calculate_rates(numbers)
+            uncached = vat_moss.phone_number.instrumentation_stats()
+        finally:
+            vat_moss.phone_number.disable_instrumentation()
+
+        vat_moss.phone_number.enable_cache()
+        vat_moss.phone_number.enable_instrumentation()
+        try:
+            vat_moss.phone_number.calculate_rates(numbers)
+            counters = vat_moss.phone_number.instrumentation_stats()['counters']
+            self.assertEqual(1, counters['batch_prefix_hits'])
+            self.assertEqual(3, counters['batch_prefix_misses'])
+            self.assertEqual(0, counters.get('cache_hits', 0))
+            self.assertEqual(3, counters['cache_misses'])
+
+            vat_moss.phone_number.calculate_rates(numbers)
+            stats = vat_moss.phone_number.instrumentation_stats()
+            self.assertEqual(uncached['counters']['lookups'], stats['counters']['lookups'])
+            self.assertEqual(uncached['counters']['invalid'], stats['counters']['invalid'])
+            self.assertEqual(uncached['breakdowns']['lookups'], stats['breakdowns']['lookups'])
+            self.assertEqual(uncached['histogram']['count'], stats['histogram']['count'])
+
+            vat_moss.phone_number.calculate_rate('+34 922 21 47 43')
+            counters = vat_moss.phone_number.instrumentation_stats()['counters']
+            self.assertEqual(2, counters['batch_prefix_hits'])
+            self.assertEqual(6, counters['batch_prefix_misses'])
+            self.assertEqual(4, counters['cache_hits'])
+            self.assertEqual(3, counters['cache_misses'])
+            self.assertEqual(
+                {'hits': 4, 'misses': 3},
+                dict((key, vat_moss.phone_number.cache_stats()[key]) for key in ('hits', 'misses'))
+            )
+
+        finally:
+            vat_moss.phone_number.disable_instrumentation()
+            vat_moss.phone_number.disable_cache()
+
+    def test_cache(self):
+        self.assertEqual(None, vat_moss.phone_number.cache_stats())
+
+        vat_moss.phone_number.enable_cache(2)
+        try:
+            self.assertEqual(
+                (Decimal('0.0'), 'ES', 'Canary Islands'),
+                vat_moss.phone_number.calculate_rate('+34 922 21 47 43 12')
+            )
+            self.assertEqual(
+                (Decimal('0.0'), 'ES', 'Canary Islands'),
+                vat_moss.phone_number.calculate_rate('+34 922 21 47 43 13')
+            )
+            with self.assertRaises(vat_moss.errors.UndefinitiveError):
+                vat_moss.phone_number.calculate_rate('+41 52 503 40 57')
+            self.assertEqual(
+                (Decimal('0.0'), 'DE', 'Büsingen am Hochrhein'),
+                vat_moss.phone_number.calculate_rate('+41 52 503 40 57', 'DE', 'Büsingen am Hochrhein')
+            )
+            with self.assertRaises(ValueError):
+                vat_moss.phone_number.calculate_rate('+0')
+
+            stats = vat_moss.phone_number.cache_stats()
+            self.assertEqual(2, stats['hits'])
+            self.assertEqual(3, stats['misses'])
+            self.assertEqual(1, stats['evictions'])
+            self.assertEqual(2, stats['size'])
+
+        finally:
+            vat_moss.phone_number.disable_cache()
+
+        self.assertEqual(None, vat_moss.phone_number.cache_stats())
+
+    def test_cache_shared_by_area(self):
+        vat_moss.phone_number.enable_cache()
+        try:
+            for suffix in range(100):
+                self.assertEqual(
+                    (Decimal('0.0'), 'US', None),
+                    vat_moss.phone_number.calculate_rate('+1 978 555 %04d' % (suffix * 97))
+                )
+            vat_moss.phone_number.calculate_rate('+30 697 222 2222')
+            vat_moss.phone_number.calculate_rate('+30 697 333 3333')
+
+            stats = vat_moss.phone_number.cache_stats()
+            self.assertEqual(100, stats['hits'])
+            self.assertEqual(2, stats['misses'])
+
+        finally:
+            vat_moss.phone_number.disable_cache()
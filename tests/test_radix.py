@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import unittest
+
+from vat_moss.radix import MappedRadixTree, RadixTree
+
+
+def ipv6(prefix):
+    return int(prefix, 16) << (128 - len(prefix) * 4)
+
+
+class RadixTests(unittest.TestCase):
+
+    def test_longest_prefix_match(self):
+        tree = RadixTree(128)
+        tree.insert(ipv6('20010218'), 32, 1)
+        tree.insert(ipv6('2001021800ff'), 48, 2)
+        tree.insert(ipv6('2a0202f0'), 29, 3)
+        # Diverges from 2001:218::/32 below the root, adding a split node
+        tree.insert(ipv6('20010db8'), 32, 4)
+        self.assertEqual(6, len(tree))
+
+        for lookup in (tree.lookup, MappedRadixTree(tree.serialize(), 0, len(tree), 128).lookup):
+            self.assertEqual(1, lookup(ipv6('20010218') + 1))
+            self.assertEqual(2, lookup(ipv6('2001021800ff') + 1))
+            self.assertEqual(1, lookup(ipv6('2001021800fe') + 1))
+            self.assertEqual(3, lookup(ipv6('2a0202f7')))
+            self.assertEqual(None, lookup(ipv6('2a0202f8')))
+            self.assertEqual(4, lookup(ipv6('20010db8')))
+            self.assertEqual(None, lookup(ipv6('20010000')))
+            self.assertEqual(None, lookup(0))
+
+    def test_insert_contained_first(self):
+        tree = RadixTree(32)
+        tree.insert(0x0A010000, 16, 1)
+        tree.insert(0x0A000000, 8, 2)
+        tree.insert(0x0A010000, 16, 3)
+        self.assertEqual(2, len(tree))
+        self.assertEqual(3, tree.lookup(0x0A0100FF))
+        self.assertEqual(2, tree.lookup(0x0A0200FF))
+        self.assertEqual(None, tree.lookup(0x0B000000))
+
+    def test_default_route(self):
+        tree = RadixTree(32)
+        tree.insert(0, 0, 7)
+        tree.insert(0xFFFFFFFF, 32, 8)
+        mapped = MappedRadixTree(tree.serialize(), 0, len(tree), 32)
+        for lookup in (tree.lookup, mapped.lookup):
+            self.assertEqual(7, lookup(0))
+            self.assertEqual(7, lookup(0xFFFFFFFE))
+            self.assertEqual(8, lookup(0xFFFFFFFF))
+
+    def test_insert_range(self):
+        tree = RadixTree(32)
+        tree.insert_range(5, 1000, 1)
+        tree.insert_range(1001, 1001, 2)
+        for address in (4, 5, 6, 512, 1000, 1001, 1002):
+            expected = None
+            if 5 <= address <= 1000:
+                expected = 1
+            elif address == 1001:
+                expected = 2
+            self.assertEqual(expected, tree.lookup(address))
+
+    def test_empty(self):
+        tree = RadixTree(128)
+        self.assertEqual(None, tree.lookup(1))
+        self.assertEqual(b'', tree.serialize())
+        self.assertEqual(None, MappedRadixTree(b'', 0, 0, 128).lookup(1))
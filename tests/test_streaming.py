@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import gc
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from decimal import Decimal
+
+import vat_moss.streaming
+from vat_moss.__main__ import main
+
+
+class StreamingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_file(self, name, contents):
+        path = os.path.join(self.temp_dir, name)
+        with io.open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(contents)
+        return path
+
+    def read_file(self, path):
+        with io.open(path, 'r', encoding='utf-8', newline='') as f:
+            return f.read()
+
+    def test_csv_round_trip(self):
+        path = self.write_file('input.csv', 'name,city\r\nä,Büsingen\r\nb,\r\n')
+        input_file = vat_moss.streaming.open_input(path)
+        rows = list(vat_moss.streaming.read_rows(input_file, 'csv'))
+        input_file.close()
+        self.assertEqual([{'name': 'ä', 'city': 'Büsingen'}, {'name': 'b', 'city': ''}], [dict(row) for row in rows])
+
+        output_path = os.path.join(self.temp_dir, 'output.csv')
+        output_file = vat_moss.streaming.open_output(output_path)
+        rows = ({'name': row['name'], 'rate': Decimal('0.19')} for row in rows)
+        count = vat_moss.streaming.write_rows(output_file, rows, 'csv', ['name', 'rate'], chunk_size=1)
+        output_file.close()
+        self.assertEqual(2, count)
+        self.assertEqual('name,rate\r\nä,0.19\r\nb,0.19\r\n', self.read_file(output_path))
+
+    def test_jsonl_round_trip(self):
+        path = self.write_file('input.jsonl', '{"name": "ä"}\n\n{"name": "b"}\n')
+        input_file = vat_moss.streaming.open_input(path)
+        rows = list(vat_moss.streaming.read_rows(input_file, 'jsonl'))
+        input_file.close()
+        self.assertEqual([{'name': 'ä'}, {'name': 'b'}], rows)
+
+        output_path = os.path.join(self.temp_dir, 'output.jsonl')
+        output_file = vat_moss.streaming.open_output(output_path)
+        vat_moss.streaming.write_rows(output_file, [{'error': ValueError('Bad')}], 'jsonl')
+        output_file.close()
+        self.assertEqual({'error': 'Bad'}, json.loads(self.read_file(output_path)))
+
+    def test_row_writer(self):
+        output_path = os.path.join(self.temp_dir, 'output.csv')
+        output_file = vat_moss.streaming.open_output(output_path)
+        writer = vat_moss.streaming.RowWriter(output_file, 'csv', chunk_size=2)
+        for name in ('a', 'b', 'c'):
+            writer.write({'name': name})
+        self.assertEqual('name\r\na\r\nb\r\n', self.read_file(output_path))
+        writer.flush()
+        output_file.close()
+        self.assertEqual(3, writer.count)
+        self.assertEqual('name\r\na\r\nb\r\nc\r\n', self.read_file(output_path))
+
+    def test_read_rows_unknown_format(self):
+        with self.assertRaises(ValueError):
+            list(vat_moss.streaming.read_rows(io.StringIO(''), 'xml'))
+
+    def test_chunks(self):
+        self.assertEqual([[1, 2], [3, 4], [5]], list(vat_moss.streaming.chunks(range(1, 6), 2)))
+
+    def test_zip_columns(self):
+        self.assertEqual(
+            [(1, 'a', None), (2, 'b', None)],
+            list(vat_moss.streaming.zip_columns([('numbers', [1, 2]), ('letters', iter('ab')), ('none', None)]))
+        )
+        for numbers, letters in (([1, 2], 'abc'), ([1, 2, 3], 'ab')):
+            with self.assertRaises(ValueError) as context:
+                list(vat_moss.streaming.zip_columns([('numbers', numbers), ('letters', letters)]))
+            self.assertEqual('letters is not the same length as numbers', str(context.exception))
+
+    def test_phone_number_command(self):
+        path = self.write_file('input.csv', 'id,phone_number\n1,+43 5676 8135\n2,bad\n')
+        output_path = os.path.join(self.temp_dir, 'output.csv')
+        self.assertEqual(0, main(['phone_number', path, '-o', output_path]))
+
+        output_file = vat_moss.streaming.open_input(output_path)
+        rows = list(vat_moss.streaming.read_rows(output_file, 'csv'))
+        output_file.close()
+        self.assertEqual('0.19', rows[0]['vat_rate'])
+        self.assertEqual('Jungholz', rows[0]['vat_exception_name'])
+        self.assertEqual('', rows[0]['vat_error'])
+        self.assertEqual('', rows[1]['vat_rate'])
+        self.assertEqual('Phone number is not in international format with a leading +', rows[1]['vat_error'])
+
+    @unittest.skipIf(sys.version_info < (3,), 'Python 2 uses stdin and stdout directly')
+    def test_standard_streams_left_open(self):
+        path = self.write_file('input.csv', 'id,phone_number\n1,+43 5676 8135\n')
+        stdin = sys.stdin
+        stdout = sys.stdout
+        output = io.BytesIO()
+        sys.stdin = io.TextIOWrapper(io.BytesIO(b'id,phone_number\n1,+1 978 572 0330\n'), encoding='utf-8')
+        # Kept referenced so it does not close output once stdout is restored
+        output_wrapper = io.TextIOWrapper(output, encoding='utf-8', newline='')
+        sys.stdout = output_wrapper
+        try:
+            self.assertEqual(0, main(['phone_number', path]))
+            self.assertEqual(0, main(['phone_number', '-', '-o', '-']))
+            gc.collect()
+            print('done')
+            sys.stdout.flush()
+            self.assertFalse(sys.stdin.closed)
+        finally:
+            sys.stdin = stdin
+            sys.stdout = stdout
+
+        lines = output.getvalue().decode('utf-8').splitlines()
+        self.assertEqual('done', lines[-1])
+        self.assertTrue(lines[1].startswith('1,+43 5676 8135,0.19,'))
+        self.assertTrue(lines[3].startswith('1,+1 978 572 0330,0.0,'))
+
+    def test_billing_address_command(self):
+        path = self.write_file('input.csv', 'id,country_code,postal_code,city\n1,DE,27498,Heligoland\n2,US,,Boston\n3,AT,1010,Wien\n')
+        output_path = os.path.join(self.temp_dir, 'output.csv')
+        rejected_path = os.path.join(self.temp_dir, 'rejected.csv')
+        self.assertEqual(0, main(['billing_address', path, '-o', output_path, '--rejected', rejected_path]))
+
+        output_file = vat_moss.streaming.open_input(output_path)
+        rows = list(vat_moss.streaming.read_rows(output_file, 'csv'))
+        output_file.close()
+        self.assertEqual(['1', '3'], [row['id'] for row in rows])
+        self.assertEqual('0.0', rows[0]['vat_rate'])
+        self.assertEqual('Heligoland', rows[0]['vat_exception_name'])
+        self.assertEqual('AT', rows[1]['vat_country_code'])
+
+        rejected_file = vat_moss.streaming.open_input(rejected_path)
+        rows = list(vat_moss.streaming.read_rows(rejected_file, 'csv'))
+        rejected_file.close()
+        self.assertEqual(['2'], [row['id'] for row in rows])
+        self.assertEqual('Postal code is not a string', rows[0]['vat_error'])
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import argparse
+import sys
+
+from . import access_log, billing_address, geoip2, parallel, phone_number, streaming
+
+
+def main(argv=None):
+    """
+    Runs the command line interface, e.g. "python -m vat_moss phone_number"
+
+    :param argv:
+        A list of unicode string arguments, or None to use sys.argv
+
+    :return:
+        An integer exit code
+    """
+
+    parser = argparse.ArgumentParser(prog='python -m vat_moss')
+    subparsers = parser.add_subparsers(dest='command')
+
+    phone_number_parser = subparsers.add_parser(
+        'phone_number',
+        help='Calculate the VAT rate for each phone number in a CSV or JSON lines file'
+    )
+    _add_stream_arguments(phone_number_parser)
+    phone_number_parser.add_argument('--column', default='phone_number', help='The phone number column')
+    phone_number_parser.add_argument('--address-country-code-column', help='The address country code column')
+    phone_number_parser.add_argument('--address-exception-column', help='The address exception name column')
+    phone_number_parser.set_defaults(func=_phone_number)
+
+    billing_address_parser = subparsers.add_parser(
+        'billing_address',
+        help='Calculate the VAT rate for each billing address in a CSV or JSON lines file'
+    )
+    _add_stream_arguments(billing_address_parser)
+    billing_address_parser.add_argument('--country-code-column', default='country_code', help='The country code column')
+    billing_address_parser.add_argument('--postal-code-column', default='postal_code', help='The postal code column')
+    billing_address_parser.add_argument('--city-column', default='city', help='The city column')
+    billing_address_parser.add_argument(
+        '--rejected',
+        help='A file to write rows that could not be processed to, instead of the output'
+    )
+    billing_address_parser.set_defaults(func=_billing_address)
+
+    access_log_parser = subparsers.add_parser(
+        'access_log',
+        help='Count the requests in access logs from each VAT jurisdiction'
+    )
+    access_log_parser.add_argument('logs', nargs='*', default=['-'], help='The log files, defaults to stdin')
+    access_log_parser.add_argument(
+        '--database',
+        required=True,
+        help='A GeoLite2 City .mmdb file or table from compile_geoip2_database'
+    )
+    access_log_parser.add_argument('-o', '--output', default='-', help='The report file, defaults to stdout')
+    access_log_parser.add_argument(
+        '-f',
+        '--format',
+        choices=access_log.FORMATS,
+        default='combined',
+        help='The log format, combined also reads the common log format'
+    )
+    access_log_parser.add_argument('--ip-field', default='ip', help='The IP address key of JSON lines logs')
+    access_log_parser.add_argument(
+        '--report-format',
+        choices=streaming.FORMATS,
+        default='csv',
+        help='The report file format'
+    )
+    access_log_parser.add_argument('--chunk-size', type=int, default=1000, help='The number of requests to process at a time')
+    access_log_parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='The number of log files to process at once, 0 for one per file'
+    )
+    access_log_parser.set_defaults(func=_access_log)
+
+    compile_phone_table_parser = subparsers.add_parser(
+        'compile_phone_table',
+        help='Compile the calling code tables into a binary file for vat_moss.phone_number.load_table()'
+    )
+    compile_phone_table_parser.add_argument('output', help='The path to write the table to')
+    compile_phone_table_parser.set_defaults(func=_compile_phone_table)
+
+    compile_geoip2_database_parser = subparsers.add_parser(
+        'compile_geoip2_database',
+        help='Compile the GeoLite2 City CSV files into a table for vat_moss.geoip2.load_database()'
+    )
+    compile_geoip2_database_parser.add_argument('output', help='The path to write the table to')
+    compile_geoip2_database_parser.add_argument('locations', help='The path of GeoLite2-City-Locations-en.csv')
+    compile_geoip2_database_parser.add_argument(
+        'blocks',
+        nargs='+',
+        help='The paths of GeoLite2-City-Blocks-IPv4.csv and GeoLite2-City-Blocks-IPv6.csv'
+    )
+    compile_geoip2_database_parser.set_defaults(func=_compile_geoip2_database)
+
+    args = parser.parse_args(argv)
+    if not getattr(args, 'func', None):
+        parser.print_help()
+        return 2
+
+    return args.func(args)
+
+
+def _add_stream_arguments(parser):
+    """
+    Adds the input, output, format and chunk size arguments shared by the
+    commands that process files of rows
+
+    :param parser:
+        An argparse.ArgumentParser
+    """
+
+    parser.add_argument('input', nargs='?', default='-', help='The input file, defaults to stdin')
+    parser.add_argument('-o', '--output', default='-', help='The output file, defaults to stdout')
+    parser.add_argument('-f', '--format', choices=streaming.FORMATS, default='csv', help='The file format')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='The number of rows to process at a time')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='The number of processes to use, 0 for one per CPU'
+    )
+
+
+def _map_rows(args, func, rows, **kwargs):
+    """
+    Runs a row processing function in the current process, or over a process
+    pool if more than one worker was requested
+
+    :param args:
+        The argparse.Namespace of parsed arguments
+
+    :param func:
+        A function such as vat_moss.billing_address.calculate_rate_rows()
+
+    :param rows:
+        An iterable of dicts
+
+    :param kwargs:
+        Keyword arguments to pass to func
+
+    :return:
+        An iterable of dicts
+    """
+
+    if args.workers == 1:
+        return func(rows, chunk_size=args.chunk_size, **kwargs)
+    return parallel.map_rows(func, rows, args.workers or None, args.chunk_size, **kwargs)
+
+
+def _phone_number(args):
+    """
+    Implements the phone_number command
+
+    :param args:
+        The argparse.Namespace of parsed arguments
+
+    :return:
+        An integer exit code
+    """
+
+    input_file = streaming.open_input(args.input)
+    output_file = streaming.open_output(args.output)
+
+    try:
+        rows = streaming.read_rows(input_file, args.format)
+        results = _map_rows(
+            args,
+            phone_number.calculate_rate_rows,
+            rows,
+            phone_number_field=args.column,
+            address_country_code_field=args.address_country_code_column,
+            address_exception_field=args.address_exception_column
+        )
+        streaming.write_rows(output_file, results, args.format, chunk_size=args.chunk_size)
+
+    finally:
+        output_file.flush()
+        if args.input not in (None, '-'):
+            input_file.close()
+        if args.output not in (None, '-'):
+            output_file.close()
+
+    return 0
+
+
+def _billing_address(args):
+    """
+    Implements the billing_address command
+
+    :param args:
+        The argparse.Namespace of parsed arguments
+
+    :return:
+        An integer exit code
+    """
+
+    input_file = streaming.open_input(args.input)
+    output_file = streaming.open_output(args.output)
+    rejected_file = None
+    rejected_writer = None
+    if args.rejected:
+        rejected_file = streaming.open_output(args.rejected)
+        rejected_writer = streaming.RowWriter(rejected_file, args.format, chunk_size=args.chunk_size)
+
+    try:
+        rows = streaming.read_rows(input_file, args.format)
+        results = _map_rows(
+            args,
+            billing_address.calculate_rate_rows,
+            rows,
+            country_code_field=args.country_code_column,
+            postal_code_field=args.postal_code_column,
+            city_field=args.city_column
+        )
+        if rejected_writer is not None:
+            results = _divert_rejected(results, rejected_writer)
+        streaming.write_rows(output_file, results, args.format, chunk_size=args.chunk_size)
+        if rejected_writer is not None:
+            rejected_writer.flush()
+
+    finally:
+        output_file.flush()
+        if args.input not in (None, '-'):
+            input_file.close()
+        if args.output not in (None, '-'):
+            output_file.close()
+        if rejected_file is not None:
+            rejected_file.close()
+
+    return 0
+
+
+def _divert_rejected(rows, rejected_writer):
+    """
+    Writes rows that could not be processed to a separate file. This is done
+    in the parent process so it also works with a process pool.
+
+    :param rows:
+        An iterable of dicts with the key "vat_error"
+
+    :param rejected_writer:
+        A vat_moss.streaming.RowWriter
+
+    :return:
+        A generator of the rows without an error
+    """
+
+    for row in rows:
+        if row['vat_error'] is not None:
+            rejected_writer.write(row)
+            continue
+        yield row
+
+
+def _access_log(args):
+    """
+    Implements the access_log command
+
+    :param args:
+        The argparse.Namespace of parsed arguments
+
+    :return:
+        An integer exit code
+    """
+
+    geoip2.load_database(args.database)
+    try:
+        summary = access_log.summarize_files(
+            args.logs,
+            args.format,
+            args.ip_field,
+            args.workers or None,
+            args.chunk_size
+        )
+    finally:
+        geoip2.unload_database()
+
+    output_file = streaming.open_output(args.output)
+    try:
+        streaming.write_rows(
+            output_file,
+            access_log.report_rows(summary),
+            args.report_format,
+            ['country_code', 'exception_name', 'vat_rate', 'vat_error', 'requests']
+        )
+
+    finally:
+        output_file.flush()
+        if args.output not in (None, '-'):
+            output_file.close()
+
+    return 0
+
+
+def _compile_phone_table(args):
+    """
+    Implements the compile_phone_table command
+
+    :param args:
+        The argparse.Namespace of parsed arguments
+
+    :return:
+        An integer exit code
+    """
+
+    phone_number.compile_table(args.output)
+    return 0
+
+
+def _compile_geoip2_database(args):
+    """
+    Implements the compile_geoip2_database command
+
+    :param args:
+        The argparse.Namespace of parsed arguments
+
+    :return:
+        An integer exit code
+    """
+
+    geoip2.compile_database(args.output, args.locations, args.blocks)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
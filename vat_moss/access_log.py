@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import gzip
+import io
+import json
+from collections import Counter
+
+try:
+    # Python 2
+    str_cls = unicode
+    from itertools import izip as zip
+except (NameError):
+    # Python 3
+    str_cls = str
+
+from . import geoip2, parallel, streaming
+from .errors import UndefinitiveError
+
+
+FORMATS = ('combined', 'jsonl')
+
+
+def open_log(path):
+    """
+    Opens an access log for reading with read_ips(). Rotated logs compressed
+    with gzip are detected by a .gz extension. Invalid UTF-8 is replaced
+    rather than raising, since logs contain whatever clients send.
+
+    :param path:
+        A unicode string filesystem path, or None or "-" for stdin
+
+    :return:
+        A file-like object
+    """
+
+    if path is None or path == '-':
+        return streaming.open_input(path)
+
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8', errors='replace')
+    return io.open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def read_ips(log_file, format='combined', ip_field='ip'):
+    """
+    Lazily reads the client IP address of each request in an access log
+
+    :param log_file:
+        A file-like object from open_log()
+
+    :param format:
+        A unicode string of "combined", for the Common and Combined Log
+        Formats, or "jsonl" for a file of JSON objects, one per line
+
+    :param ip_field:
+        For JSON lines, the unicode string key of the IP address
+
+    :raises:
+        ValueError - when the format is unknown, or a JSON line is not an object
+
+    :return:
+        A generator of unicode strings, or None for a JSON object without
+        the IP address
+    """
+
+    if format not in FORMATS:
+        raise ValueError('Unknown format %s' % format)
+
+    for line in log_file:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        if not line.strip():
+            continue
+
+        if format == 'combined':
+            # The remote host is the first field of both formats
+            yield line.split(None, 1)[0]
+            continue
+
+        row = json.loads(line)
+        if not isinstance(row, dict):
+            raise ValueError('JSON line is not an object')
+        yield row.get(ip_field)
+
+
+def summarize(ips, chunk_size=1000):
+    """
+    Counts the requests from each VAT jurisdiction for an iterable of IP
+    addresses, using vat_moss.geoip2.calculate_rates_for_ips() on one chunk
+    at a time. Memory use depends on the number of jurisdictions, not the
+    number of requests, so this may be used on logs of any size.
+
+    :param ips:
+        An iterable of unicode string IP addresses, such as from read_ips()
+
+    :param chunk_size:
+        The integer number of IP addresses to process at a time
+
+    :raises:
+        ValueError - if no database is loaded
+
+    :return:
+        A dict with the keys "jurisdictions", a dict of (country code,
+        exception name or None, Decimal rate) tuples to the integer number of
+        requests, "undefinitive", the integer number of requests from
+        locations where the rate depends on the user's address, and
+        "unresolved", the integer number of requests from invalid IP
+        addresses or ones not in the database
+    """
+
+    summary = _empty_summary()
+    for chunk in streaming.chunks(ips, chunk_size):
+        rates, country_codes, exception_names, errors = geoip2.calculate_rates_for_ips(chunk)
+        for rate, country_code, exception_name, error in zip(rates, country_codes, exception_names, errors):
+            if error is None:
+                summary['jurisdictions'][(country_code, exception_name, rate)] += 1
+            elif isinstance(error, UndefinitiveError):
+                summary['undefinitive'] += 1
+            else:
+                summary['unresolved'] += 1
+    return summary
+
+
+def summarize_files(paths, format='combined', ip_field='ip', workers=None, chunk_size=1000):
+    """
+    Summarizes a set of access logs, such as the rotated files for a period,
+    using a process per file. The database loaded with
+    vat_moss.geoip2.load_database() is shared with the worker processes.
+
+    :param paths:
+        A list of unicode string filesystem paths for open_log()
+
+    :param format:
+        A unicode string of "combined" or "jsonl"
+
+    :param ip_field:
+        For JSON lines, the unicode string key of the IP address
+
+    :param workers:
+        The integer number of worker processes, defaults to the number of
+        files. With 1, the files are processed in the current process.
+
+    :param chunk_size:
+        The integer number of IP addresses to process at a time
+
+    :raises:
+        ValueError - when workers is less than 1, or no database is loaded
+
+    :return:
+        A dict of the combined counts, as returned by summarize()
+    """
+
+    if workers is None:
+        workers = len(paths)
+    if workers < 1:
+        raise ValueError('The number of workers must be at least 1')
+
+    database_path = geoip2.database_path()
+    if database_path is None:
+        raise ValueError('No GeoLite2 database has been loaded with load_database()')
+
+    tasks = [(path, format, ip_field, chunk_size, database_path) for path in paths]
+
+    summary = _empty_summary()
+    if workers == 1 or len(paths) < 2:
+        for task in tasks:
+            merge(summary, _summarize_file(task))
+        return summary
+
+    pool = parallel.context().Pool(min(workers, len(paths)))
+    try:
+        for file_summary in pool.imap_unordered(_summarize_file, tasks):
+            merge(summary, file_summary)
+        pool.close()
+
+    except (BaseException):
+        pool.terminate()
+        raise
+
+    finally:
+        pool.join()
+
+    return summary
+
+
+def merge(summary, other):
+    """
+    Adds the counts from one summary to another
+
+    :param summary:
+        A dict from summarize(), which is modified
+
+    :param other:
+        A dict from summarize()
+    """
+
+    summary['jurisdictions'].update(other['jurisdictions'])
+    summary['undefinitive'] += other['undefinitive']
+    summary['unresolved'] += other['unresolved']
+
+
+def report_rows(summary):
+    """
+    Converts a summary into rows for vat_moss.streaming.write_rows(), with
+    the jurisdictions with the most requests first, followed by a row for
+    each of the undefinitive and unresolved requests
+
+    :param summary:
+        A dict from summarize()
+
+    :return:
+        A list of dicts with the keys "country_code", "exception_name",
+        "vat_rate", "vat_error" and "requests". vat_error is None for
+        jurisdictions, otherwise "UndefinitiveError" or "ValueError".
+    """
+
+    jurisdictions = sorted(
+        summary['jurisdictions'].items(),
+        key=lambda item: (-item[1], item[0][0], item[0][1] or '')
+    )
+
+    rows = []
+    for (country_code, exception_name, rate), requests in jurisdictions:
+        rows.append({
+            'country_code': country_code,
+            'exception_name': exception_name,
+            'vat_rate': rate,
+            'vat_error': None,
+            'requests': requests,
+        })
+    for error, key in (('UndefinitiveError', 'undefinitive'), ('ValueError', 'unresolved')):
+        rows.append({
+            'country_code': None,
+            'exception_name': None,
+            'vat_rate': None,
+            'vat_error': error,
+            'requests': summary[key],
+        })
+    return rows
+
+
+def _summarize_file(task):
+    """
+    Runs in a worker process to summarize one access log
+
+    :param task:
+        A tuple of (path, format, ip_field, chunk_size, database_path)
+
+    :return:
+        A dict, as returned by summarize()
+    """
+
+    path, format, ip_field, chunk_size, database_path = task
+
+    # Forked workers inherit the parent's database, others must load it
+    if geoip2.database_path() != database_path:
+        geoip2.load_database(database_path)
+
+    log_file = open_log(path)
+    try:
+        return summarize(read_ips(log_file, format, ip_field), chunk_size)
+    finally:
+        if path not in (None, '-'):
+            log_file.close()
+
+
+def _empty_summary():
+    """
+    :return:
+        A dict with no counts, in the format returned by summarize()
+    """
+
+    return {
+        'jurisdictions': Counter(),
+        'undefinitive': 0,
+        'unresolved': 0,
+    }
@@ -7,11 +7,16 @@ from decimal import Decimal
 try:
     # Python 2
     str_cls = unicode
+    from itertools import izip as zip
+    _casefold = unicode.lower
 except (NameError):
     # Python 3
     str_cls = str
+    unichr = chr
+    _casefold = str.casefold
 
-from . import rates
+from . import rates, streaming
+from .cache import LRUCache
 
 
 def calculate_rate(country_code, postal_code, city):
@@ -35,6 +40,158 @@ def calculate_rate(country_code, postal_code, city):
         A tuple of (Decimal percentage rate, country code, exception name [or None])
     """
 
+    country_code, postal_code, city = normalize(country_code, postal_code, city)
+    return _calculate_rate(country_code, postal_code, city)
+
+
+def calculate_rates(country_codes, postal_codes, cities):
+    """
+    Calculates the VAT rates for a batch of addresses, such as the columns of
+    a table of invoices. Rows are grouped by country, so that countries
+    without any postal code exceptions are resolved once per group and only
+    the rows for the rest are matched against POSTAL_CODE_EXCEPTIONS.
+
+    :param country_codes:
+        An iterable of two-character country codes
+
+    :param postal_codes:
+        An iterable parallel to country_codes of the users' postal codes
+
+    :param cities:
+        An iterable parallel to country_codes of the users' city names
+
+    :raises:
+        ValueError - if postal_codes or cities is not the same length as country_codes
+
+    :return:
+        A tuple of four lists parallel to country_codes: (Decimal percentage
+        rates, country codes, exception names, errors). For each address that
+        calculate_rate() would raise a ValueError for, the rate, country code
+        and exception name are None and the exception object is placed in
+        errors. Otherwise the error is None.
+    """
+
+    result_rates = []
+    result_country_codes = []
+    result_exception_names = []
+    result_errors = []
+
+    # A dict of country code to list of (row number, postal code, city)
+    groups = {}
+    columns = streaming.zip_columns([
+        ('country_codes', country_codes),
+        ('postal_codes', postal_codes),
+        ('cities', cities),
+    ])
+    for row, (country_code, postal_code, city) in enumerate(columns):
+        try:
+            country_code, postal_code, city = normalize(country_code, postal_code, city)
+            error = None
+            groups.setdefault(country_code, []).append((row, postal_code, city))
+        except (ValueError) as e:
+            error = e
+
+        result_rates.append(None)
+        result_country_codes.append(None)
+        result_exception_names.append(None)
+        result_errors.append(error)
+
+    for country_code in groups:
+        if country_code not in POSTAL_CODE_EXCEPTIONS:
+            rate, country_code, exception_name = _calculate_rate(country_code, None, None)
+            for row, _, _ in groups[country_code]:
+                result_rates[row] = rate
+                result_country_codes[row] = country_code
+                result_exception_names[row] = exception_name
+            continue
+
+        for row, postal_code, city in groups[country_code]:
+            result_rates[row], result_country_codes[row], result_exception_names[row] = _calculate_rate(
+                country_code,
+                postal_code,
+                city
+            )
+
+    return (result_rates, result_country_codes, result_exception_names, result_errors)
+
+
+def calculate_rate_rows(rows, country_code_field='country_code', postal_code_field='postal_code',
+                        city_field='city', chunk_size=1000, rejected=None):
+    """
+    Lazily calculates the VAT rate for each row from an iterable of dicts,
+    such as from vat_moss.streaming.read_rows(). Rows are processed in chunks
+    with calculate_rates(), so only one chunk is held in memory at a time.
+
+    :param rows:
+        An iterable of dicts
+
+    :param country_code_field:
+        The unicode string key of the country code in each row
+
+    :param postal_code_field:
+        The unicode string key of the postal code in each row
+
+    :param city_field:
+        The unicode string key of the city name in each row
+
+    :param chunk_size:
+        The integer number of rows to process at a time
+
+    :param rejected:
+        None, or a callable that is passed each row that could not be
+        processed, such as vat_moss.streaming.RowWriter().write. Rejected rows
+        are then not yielded.
+
+    :return:
+        A generator of copies of the rows, with the added keys "vat_rate",
+        "vat_country_code", "vat_exception_name" and "vat_error", the values of
+        which are the columns returned by calculate_rates()
+    """
+
+    for chunk in streaming.chunks(rows, chunk_size):
+        columns = calculate_rates(
+            [row.get(country_code_field) for row in chunk],
+            [row.get(postal_code_field) or None for row in chunk],
+            [row.get(city_field) for row in chunk]
+        )
+
+        for row, result in zip(chunk, zip(*columns)):
+            row = dict(row)
+            row['vat_rate'], row['vat_country_code'], row['vat_exception_name'], row['vat_error'] = result
+            if rejected is not None and row['vat_error'] is not None:
+                rejected(row)
+                continue
+            yield row
+
+
+def normalize(country_code, postal_code, city):
+    """
+    Validates and normalizes address information in the way calculate_rate()
+    does, so that it can be done once per address and the result reused for
+    calculate_normalized_rate(), as a cache key or for audit logs.
+
+    The country code is upper cased, all whitespace is removed from the postal
+    code and it is upper cased in a single pass, a leading country prefix
+    such as "DE-" or "D-" is removed, along with any other dashes, and the city
+    is case-folded with surrounding whitespace removed.
+
+    :param country_code:
+        The two-character country code
+
+    :param postal_code:
+        The postal code for the user
+
+    :param city:
+        The city name for the user
+
+    :raises:
+        ValueError - If country code is not two characers, or postal_code or city are not strings. postal_code may be None or blank string for countries without postal codes.
+
+    :return:
+        A tuple of (upper case country code, normalized postal code or None,
+        case-folded city)
+    """
+
     if not country_code or not isinstance(country_code, str_cls):
         raise ValueError('Invalidly formatted country code')
 
@@ -52,17 +209,156 @@ def calculate_rate(country_code, postal_code, city):
         raise ValueError('City is not a string')
 
     if isinstance(postal_code, str_cls):
-        postal_code = re.sub('\\s+', '', postal_code)
-        postal_code = postal_code.upper()
+        postal_code = postal_code.translate(_POSTAL_CODE_TABLE)
 
-        # Remove the common european practice of adding the country code
-        # to the beginning of a postal code, followed by a dash
-        if len(postal_code) > 3 and postal_code[0:3] == country_code + '-':
-            postal_code = postal_code[3:]
+        if '-' in postal_code:
+            # Remove the common european practice of adding the country code
+            # to the beginning of a postal code, followed by a dash
+            for prefix in _POSTAL_CODE_PREFIXES.get(country_code, (country_code + '-',)):
+                if len(postal_code) > len(prefix) and postal_code.startswith(prefix):
+                    postal_code = postal_code[len(prefix):]
+                    break
 
-        postal_code = postal_code.replace('-', '')
+            postal_code = postal_code.replace('-', '')
+    else:
+        postal_code = None
 
-    city = city.lower().strip()
+    city = _casefold(city).strip()
+
+    return (country_code, postal_code, city)
+
+
+def calculate_normalized_rate(country_code, postal_code, city):
+    """
+    Calculates the VAT rate for an address that has already been processed
+    by normalize()
+
+    :param country_code:
+        The upper case two-character country code
+
+    :param postal_code:
+        The normalized postal code, or None
+
+    :param city:
+        The case-folded city name
+
+    :return:
+        A tuple of (Decimal percentage rate, country code, exception name [or None])
+    """
+
+    return _calculate_rate(country_code, postal_code, city)
+
+
+class _PostalCodeTable(dict):
+
+    """
+    A translation table for unicode.translate() that removes whitespace and
+    upper cases everything else. Entries are computed on first use; only
+    ASCII is stored so the table stays small when fed arbitrary text.
+    """
+
+    def __missing__(self, ordinal):
+        char = unichr(ordinal)
+        value = None if char.isspace() else char.upper()
+        if ordinal < 128:
+            self[ordinal] = value
+        return value
+
+
+def enable_cache(maxsize=10000):
+    """
+    Starts caching the results for addresses in countries with postal code
+    exceptions in a least-recently-used cache. The cache is keyed on the
+    normalized country code and postal code, and only includes the city for
+    countries where an exception depends on the city, so that differently
+    written city names share an entry. Other countries are not cached since
+    their rate is found with a single dict lookup.
+
+    Any existing cache is discarded.
+
+    :param maxsize:
+        The integer maximum number of addresses to cache
+
+    :raises:
+        ValueError - when maxsize is less than 1
+    """
+
+    global _cache
+
+    _cache = LRUCache(maxsize)
+
+
+def disable_cache():
+    """
+    Stops caching results and discards the cache
+    """
+
+    global _cache
+
+    _cache = None
+
+
+def cache_stats():
+    """
+    :return:
+        None if the cache is not enabled, otherwise a dict in the format
+        returned by vat_moss.cache.LRUCache.stats()
+    """
+
+    cache = _cache
+    if cache is None:
+        return None
+    return cache.stats()
+
+
+def _calculate_rate(country_code, postal_code, city):
+    """
+    Determines the VAT rate for a normalized address, using the cache once
+    enable_cache() has been called
+
+    :param country_code:
+        The upper case two-character country code
+
+    :param postal_code:
+        The normalized postal code, or None
+
+    :param city:
+        The case-folded city name
+
+    :return:
+        A tuple of (Decimal percentage rate, country code, exception name [or None])
+    """
+
+    cache = _cache
+    if cache is None or country_code not in _POSTAL_CODE_INDEX:
+        return _uncached_calculate_rate(country_code, postal_code, city)
+
+    if not _POSTAL_CODE_INDEX[country_code]['uses_city']:
+        city = None
+    key = (country_code, postal_code, city)
+    result = cache.get(key)
+    if result is None:
+        result = _uncached_calculate_rate(country_code, postal_code, city)
+        cache.set(key, result)
+    return result
+
+
+def _uncached_calculate_rate(country_code, postal_code, city):
+    """
+    Performs the work of _calculate_rate() without consulting the cache
+
+    :param country_code:
+        The upper case two-character country code
+
+    :param postal_code:
+        The normalized postal code, or None
+
+    :param city:
+        The case-folded city name
+
+    :return:
+        A tuple of (Decimal percentage rate, country code, exception name [or None])
+    """
 
     if country_code not in rates.BY_COUNTRY and country_code not in POSTAL_CODE_EXCEPTIONS:
         return (Decimal('0.0'), country_code, None)
@@ -72,31 +368,17 @@ def calculate_rate(country_code, postal_code, city):
     if country_code not in POSTAL_CODE_EXCEPTIONS:
         return (country_default, country_code, None)
 
-    exceptions = POSTAL_CODE_EXCEPTIONS[country_code]
-    for matcher in exceptions:
-        # Postal code-only match
-        if isinstance(matcher, str_cls):
-            postal_regex = matcher
-            city_regex = None
-        else:
-            postal_regex, city_regex = matcher
-
-        if not re.match(postal_regex, postal_code):
-            continue
-
-        if city_regex and not re.search(city_regex, city):
-            continue
-
-        mapped_country = exceptions[matcher]['country_code']
+    for rule in _matching_rules(country_code, postal_code, city):
+        mapped_country = rule['country_code']
 
         # There is at least one entry where we map to a different country,
         # but are not mapping to an exception
-        if 'name' not in exceptions[matcher]:
+        if rule['name'] is None:
             country_code = mapped_country
             country_default = rates.BY_COUNTRY[country_code]['rate']
             break
 
-        mapped_name = exceptions[matcher]['name']
+        mapped_name = rule['name']
 
         rate = rates.BY_COUNTRY[mapped_country]['exceptions'][mapped_name]
         return (rate, mapped_country, mapped_name)
@@ -104,6 +386,368 @@ def calculate_rate(country_code, postal_code, city):
     return (country_default, country_code, None)
 
 
+def _matching_rules(country_code, postal_code, city):
+    """
+    Finds the entries of POSTAL_CODE_EXCEPTIONS for a country that match a
+    normalized postal code and city, using the precompiled index
+
+    :param country_code:
+        The two-character country code
+
+    :param postal_code:
+        The normalized postal code, or None
+
+    :param city:
+        The case-folded city name
+
+    :return:
+        A list of rule dicts, in the order they are listed in
+        POSTAL_CODE_EXCEPTIONS
+    """
+
+    index = _POSTAL_CODE_INDEX[country_code]
+
+    matches = []
+    if postal_code is not None:
+        for length in index['lengths']:
+            entries = index['prefixes'].get(postal_code[0:length])
+            if not entries:
+                continue
+            suffix = postal_code[length:]
+            for min_digits, max_digits, anchored, rule_index in entries:
+                if _suffix_matches(suffix, min_digits, max_digits, anchored):
+                    matches.append(rule_index)
+
+        for regex, rule_index in index['fallback']:
+            if regex.match(postal_code):
+                matches.append(rule_index)
+
+    if not matches:
+        return []
+
+    tokens = None
+    rules = []
+    for rule_index in sorted(set(matches)):
+        rule = index['rules'][rule_index]
+        if rule['city_token'] is not None:
+            if tokens is None:
+                tokens = set(_WORD_REGEX.findall(city))
+            if rule['city_token'] not in tokens:
+                continue
+        elif rule['city_regex'] is not None:
+            if not rule['city_regex'].search(city):
+                continue
+        rules.append(rule)
+    return rules
+
+
+def _suffix_matches(suffix, min_digits, max_digits, anchored):
+    """
+    Checks the part of a postal code after an indexed prefix against the
+    digits that must follow the prefix
+
+    :param suffix:
+        The unicode string remainder of the postal code
+
+    :param min_digits:
+        The integer minimum number of digits
+
+    :param max_digits:
+        The integer maximum number of digits, or None for no limit
+
+    :param anchored:
+        If nothing else may follow the digits
+
+    :return:
+        A boolean
+    """
+
+    if not anchored:
+        suffix = suffix[0:min_digits]
+        return len(suffix) == min_digits and (not suffix or suffix.isdecimal())
+
+    if len(suffix) < min_digits or (max_digits is not None and len(suffix) > max_digits):
+        return False
+    return not suffix or suffix.isdecimal()
+
+
+def _build_index(exceptions):
+    """
+    Compiles POSTAL_CODE_EXCEPTIONS into an index per country so the rules
+    matching a postal code can be found with a few dict lookups, rather than
+    trying every regex.
+
+    Each postal code regex is expanded into literal prefixes, each followed by
+    a number of digits, which are stored in a dict by prefix. Regexes that
+    can not be expanded are compiled once and tried in order instead. City
+    regexes of the form \\bword\\b become a single word to look for in
+    the words of the city.
+
+    :param exceptions:
+        A dict in the format of POSTAL_CODE_EXCEPTIONS
+
+    :return:
+        A dict of country code to a dict with the keys "rules", "prefixes",
+        "lengths", "fallback" and "uses_city"
+    """
+
+    index = {}
+    for country_code in exceptions:
+        country_index = {
+            'rules': [],
+            'prefixes': {},
+            'lengths': [],
+            'fallback': [],
+            'uses_city': False
+        }
+
+        for rule_index, matcher in enumerate(exceptions[country_code]):
+            info = exceptions[country_code][matcher]
+
+            # Postal code-only match
+            if isinstance(matcher, str_cls):
+                postal_regex = matcher
+                city_regex = None
+            else:
+                postal_regex, city_regex = matcher
+
+            rule = {
+                'country_code': info['country_code'],
+                'name': info.get('name'),
+                'city_token': None,
+                'city_regex': None
+            }
+            if city_regex:
+                country_index['uses_city'] = True
+                token_match = _CITY_TOKEN_REGEX.match(city_regex)
+                if token_match:
+                    rule['city_token'] = token_match.group(1)
+                else:
+                    rule['city_regex'] = re.compile(city_regex, re.UNICODE)
+            country_index['rules'].append(rule)
+
+            try:
+                branches = _expand_postal_regex(postal_regex)
+            except (ValueError):
+                country_index['fallback'].append((re.compile(postal_regex, re.UNICODE), rule_index))
+                continue
+
+            for prefix, min_digits, max_digits, anchored in branches:
+                entry = (min_digits, max_digits, anchored, rule_index)
+                country_index['prefixes'].setdefault(prefix, []).append(entry)
+
+        country_index['lengths'] = sorted(set(len(prefix) for prefix in country_index['prefixes']))
+        index[country_code] = country_index
+
+    return index
+
+
+def _expand_postal_regex(regex):
+    """
+    Expands a postal code regex into the literal prefixes it matches. Literal
+    characters, character classes, groups of alternatives and a trailing
+    \\d with an optional quantifier are supported.
+
+    :param regex:
+        A unicode string regex, as used with re.match()
+
+    :raises:
+        ValueError - when the regex uses unsupported syntax
+
+    :return:
+        A list of 4-element tuples of (unicode string prefix, integer minimum
+        number of digits following the prefix, integer maximum number of
+        digits or None for no limit, boolean if the digits must end the
+        postal code)
+    """
+
+    branches, offset = _expand_postal_alternatives(regex, 0, True)
+    if offset != len(regex):
+        raise ValueError('Unsupported postal code regex %s' % regex)
+    return branches
+
+
+def _expand_postal_alternatives(regex, offset, top_level):
+    """
+    Expands a |-separated list of sequences, stopping at the end of the
+    string or at a ) closing the enclosing group
+
+    :param regex:
+        A unicode string regex
+
+    :param offset:
+        An integer offset to start parsing from
+
+    :param top_level:
+        If the alternatives are not within a group, and thus may contain ^
+        and $
+
+    :return:
+        A 2-element tuple of (list of branch tuples as returned by
+        _expand_postal_regex(), integer offset of the first unconsumed
+        character)
+    """
+
+    branches = []
+    while True:
+        sequence, offset = _expand_postal_sequence(regex, offset, top_level)
+        branches.extend(sequence)
+        if offset < len(regex) and regex[offset] == '|':
+            offset += 1
+            continue
+        return (branches, offset)
+
+
+def _expand_postal_sequence(regex, offset, top_level):
+    """
+    Expands a sequence of literals, character classes, groups and digits
+
+    :param regex:
+        A unicode string regex
+
+    :param offset:
+        An integer offset to start parsing from
+
+    :param top_level:
+        If the sequence is not within a group, and thus may contain ^ and $
+
+    :return:
+        A 2-element tuple of (list of branch tuples as returned by
+        _expand_postal_regex(), integer offset of the first unconsumed
+        character)
+    """
+
+    if top_level and regex[offset:offset + 1] == '^':
+        offset += 1
+
+    # Until the sequence ends, branches have None as the anchored value
+    branches = [('', 0, 0, None)]
+    while offset < len(regex):
+        char = regex[offset]
+
+        if char in '|)':
+            break
+
+        if char == '$':
+            if not top_level or offset + 1 < len(regex) and regex[offset + 1] not in '|':
+                raise ValueError('Unsupported postal code regex %s' % regex)
+            offset += 1
+            return ([(prefix, min_digits, max_digits, True) for prefix, min_digits, max_digits, _ in branches], offset)
+
+        if char == '(':
+            options, offset = _expand_postal_alternatives(regex, offset + 1, False)
+            if offset >= len(regex) or regex[offset] != ')':
+                raise ValueError('Unsupported postal code regex %s' % regex)
+            offset += 1
+
+        elif char == '[':
+            end = regex.find(']', offset)
+            if end == -1:
+                raise ValueError('Unsupported postal code regex %s' % regex)
+            options = [(option, 0, 0, None) for option in _expand_character_class(regex[offset + 1:end], regex)]
+            offset = end + 1
+
+        elif char == '\\' and regex[offset + 1:offset + 2] == 'd':
+            offset += 2
+            min_digits, max_digits, offset = _parse_digit_quantifier(regex, offset)
+            options = [('', min_digits, max_digits, None)]
+
+        elif char.isalnum() and ord(char) < 128:
+            options = [(char, 0, 0, None)]
+            offset += 1
+
+        else:
+            raise ValueError('Unsupported postal code regex %s' % regex)
+
+        combined = []
+        for prefix, min_digits, max_digits, _ in branches:
+            for option_prefix, option_min, option_max, option_anchored in options:
+                # Literals may not follow digits
+                if max_digits != 0 and option_prefix:
+                    raise ValueError('Unsupported postal code regex %s' % regex)
+                combined.append((
+                    prefix + option_prefix,
+                    min_digits + option_min,
+                    None if max_digits is None or option_max is None else max_digits + option_max,
+                    None
+                ))
+        branches = combined
+
+    return ([(prefix, min_digits, max_digits, False) for prefix, min_digits, max_digits, _ in branches], offset)
+
+
+def _expand_character_class(contents, regex):
+    """
+    :param contents:
+        The unicode string between the [ and ] of a character class
+
+    :param regex:
+        The whole unicode string regex, for error messages
+
+    :raises:
+        ValueError - when the class is negated or contains non-alphanumeric characters
+
+    :return:
+        A list of the unicode string characters matched
+    """
+
+    chars = []
+    position = 0
+    while position < len(contents):
+        char = contents[position]
+        if position + 2 < len(contents) and contents[position + 1] == '-':
+            end = contents[position + 2]
+            chars.extend(unichr(ordinal) for ordinal in range(ord(char), ord(end) + 1))
+            position += 3
+        else:
+            chars.append(char)
+            position += 1
+
+    if not chars or not all(char.isalnum() and ord(char) < 128 for char in chars):
+        raise ValueError('Unsupported postal code regex %s' % regex)
+    return chars
+
+
+def _parse_digit_quantifier(regex, offset):
+    """
+    Parses the optional quantifier following a \\d
+
+    :param regex:
+        A unicode string regex
+
+    :param offset:
+        The integer offset after the \\d
+
+    :return:
+        A 3-element tuple of (integer minimum number of digits, integer
+        maximum number of digits or None, integer offset after the quantifier)
+    """
+
+    char = regex[offset:offset + 1]
+    if char == '+':
+        return (1, None, offset + 1)
+    if char == '*':
+        return (0, None, offset + 1)
+    if char == '?':
+        return (0, 1, offset + 1)
+    if char != '{':
+        return (1, 1, offset)
+
+    end = regex.find('}', offset)
+    match = _QUANTIFIER_REGEX.match(regex[offset + 1:end]) if end != -1 else None
+    if not match:
+        raise ValueError('Unsupported postal code regex %s' % regex)
+
+    min_digits = int(match.group(1))
+    if match.group(2) is None:
+        max_digits = min_digits
+    elif match.group(3):
+        max_digits = int(match.group(3))
+    else:
+        max_digits = None
+    return (min_digits, max_digits, end + 1)
+
+
 # A dictionary of countries, each being dictionary with keys that are either
 # a string postal code regex, or a tuple of postal code regex and city name
 # regex.
@@ -278,3 +922,34 @@ COUNTRIES_WITHOUT_POSTAL_CODES = {
     'ZA': True,
     'ZW': True
 }
+
+
+_POSTAL_CODE_TABLE = _PostalCodeTable()
+
+# The prefixes that may precede a postal code, followed by a dash. In addition
+# to the ISO code, the older international vehicle registration codes were
+# commonly used for this.
+_POSTAL_CODE_PREFIXES = {
+    'AT': ('AT-', 'A-'),
+    'BE': ('BE-', 'B-'),
+    'DE': ('DE-', 'D-'),
+    'ES': ('ES-', 'E-'),
+    'FI': ('FI-', 'FIN-'),
+    'FR': ('FR-', 'F-'),
+    'HU': ('HU-', 'H-'),
+    'IT': ('IT-', 'I-'),
+    'LI': ('LI-', 'FL-'),
+    'LU': ('LU-', 'L-'),
+    'NO': ('NO-', 'N-'),
+    'PT': ('PT-', 'P-'),
+    'SE': ('SE-', 'S-'),
+    'SI': ('SI-', 'SLO-'),
+}
+
+_WORD_REGEX = re.compile('\\w+', re.UNICODE)
+_CITY_TOKEN_REGEX = re.compile('^\\\\b(\\w+)\\\\b$', re.UNICODE)
+_QUANTIFIER_REGEX = re.compile('^(\\d+)(,(\\d*))?$')
+
+_POSTAL_CODE_INDEX = _build_index(POSTAL_CODE_EXCEPTIONS)
+
+_cache = None
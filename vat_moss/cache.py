@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+
+    """
+    A thread-safe, size-bounded mapping that discards the least recently used
+    entry once full. Hits, misses and evictions are counted for stats().
+    """
+
+    def __init__(self, maxsize):
+        """
+        :param maxsize:
+            The integer maximum number of entries to hold
+
+        :raises:
+            ValueError - when maxsize is less than 1
+        """
+
+        if maxsize < 1:
+            raise ValueError('The cache size must be at least 1')
+
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key, default=None):
+        """
+        Returns the value for a key, marking it as the most recently used
+
+        :param key:
+            The hashable key
+
+        :param default:
+            The value to return if the key is not present
+
+        :return:
+            The cached value, or default
+        """
+
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except (KeyError):
+                self._misses += 1
+                return default
+            self._entries[key] = value
+            self._hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Stores a value, discarding the least recently used entry if the cache
+        is full
+
+        :param key:
+            The hashable key
+
+        :param value:
+            The value to store
+        """
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        """
+        Removes all entries and resets the statistics
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+
+    def stats(self):
+        """
+        :return:
+            A dict with the integer keys "hits", "misses", "evictions", "size"
+            and "maxsize"
+        """
+
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,17 +1,28 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import binascii
+import hashlib
+import json
+import mmap
+import struct
+import threading
+from bisect import bisect_right
 from decimal import Decimal
 
 try:
     # Python 2
     str_cls = unicode
+    from itertools import izip as zip
 except (NameError):
     # Python 3
     str_cls = str
 
-from . import rates
+from . import rates, streaming
+from .cache import LRUCache
 from .errors import UndefinitiveError
+from .mmdb import Reader, pack_ip
+from .radix import NODE_SIZE, MappedRadixTree, RadixTree
 
 
 def calculate_rate(country_code, subdivision, city, address_country_code=None, address_exception=None):
@@ -66,26 +77,734 @@ def calculate_rate(country_code, subdivision, city, address_country_code=None, a
     if country_code not in GEOIP2_EXCEPTIONS:
         return (country_default, country_code, None)
 
-    exceptions = GEOIP2_EXCEPTIONS[country_code]
-    for matcher in exceptions:
-        # Subdivision-only match
-        if isinstance(matcher, str_cls):
-            sub_match = matcher
-            city_match = None
+    cache = _cache
+    if cache is None:
+        return _calculate_exception_rate(country_code, subdivision, city, address_country_code, address_exception)
+
+    key = (country_code, subdivision, city)
+    result = cache.get(key)
+    if result is None:
+        if _depends_on_address(country_code, subdivision, city):
+            result = _ADDRESS_DEPENDENT
         else:
-            sub_match, city_match = matcher
+            result = _calculate_exception_rate(country_code, subdivision, city, None, None)
+        cache.set(key, result)
+
+    if result is _ADDRESS_DEPENDENT:
+        key = (country_code, subdivision, city, address_country_code, address_exception)
+        result = cache.get(key)
+        if result is None:
+            try:
+                result = _calculate_exception_rate(
+                    country_code,
+                    subdivision,
+                    city,
+                    address_country_code,
+                    address_exception
+                )
+            except (UndefinitiveError):
+                result = _UNDEFINITIVE
+            cache.set(key, result)
+
+    if result is _UNDEFINITIVE:
+        raise UndefinitiveError(_UNDEFINITIVE_MESSAGE)
+    return result
+
+
+def calculate_rate_for_ip(ip, address_country_code=None, address_exception=None):
+    """
+    Calculates the VAT rate for an IP address using the database loaded with
+    load_database()
+
+    :param ip:
+        A unicode string IPv4 or IPv6 address, or an integer, which is
+        treated as IPv4 if less than 2 ** 32
+
+    :param address_country_code:
+        The user's country_code, as detected from billing_address or
+        declared_residence. This prevents an UndefinitiveError from being
+        raised.
+
+    :param address_exception:
+        The user's exception name, as detected from billing_address or
+        declared_residence. This prevents an UndefinitiveError from being
+        raised.
+
+    :raises:
+        ValueError - if no database is loaded, the IP address is invalid or the database has no country for it
+        UndefinitiveError - when no address_country_code and address_exception are provided and the geoip2 information is not specific enough
+
+    :return:
+        A tuple of (Decimal percentage rate, country code, exception name [or None])
+    """
+
+    database = _database
+    if database is None:
+        raise ValueError('No GeoLite2 database has been loaded with load_database()')
+
+    location = database.location(ip)
+    if location is None or location[0] is None:
+        raise ValueError('The GeoLite2 database does not contain a country for %s' % ip)
+
+    country_code, subdivision, city = location
+    return calculate_rate(country_code, subdivision or '', city or '', address_country_code, address_exception)
+
+
+def calculate_rates_for_ips(ips, address_country_codes=None, address_exceptions=None):
+    """
+    Calculates the VAT rates for a batch of IP addresses, such as from an
+    access log, using the database loaded with load_database(). With a table
+    from compile_database(), the addresses are sorted and merged with the IP
+    address ranges. Each distinct location and address combination is only
+    passed to calculate_rate() once.
+
+    :param ips:
+        An iterable of unicode string IPv4 or IPv6 addresses, or integers,
+        which are treated as IPv4 if less than 2 ** 32
+
+    :param address_country_codes:
+        None, or an iterable parallel to ips of the users' address country
+        codes, or None for each unknown one
+
+    :param address_exceptions:
+        None, or an iterable parallel to ips of the users' address exception
+        names, or None
+
+    :raises:
+        ValueError - if no database is loaded, or address_country_codes or address_exceptions is not the same length as ips
+
+    :return:
+        A tuple of four lists parallel to ips: (Decimal percentage rates,
+        country codes, exception names, errors). For each IP address that
+        calculate_rate_for_ip() would raise a ValueError or UndefinitiveError
+        for, the rate, country code and exception name are None and the
+        exception object is placed in errors. Otherwise the error is None.
+    """
+
+    database = _database
+    if database is None:
+        raise ValueError('No GeoLite2 database has been loaded with load_database()')
+
+    ips = list(ips)
+    locations, errors = database.locations(ips)
+
+    result_rates = []
+    result_country_codes = []
+    result_exception_names = []
+    result_errors = []
+
+    # A dict of (location, address country code, address exception) to the
+    # result of calculate_rate() or the exception it raised
+    outcomes = {}
+    columns = streaming.zip_columns([
+        ('ips', ips),
+        ('address_country_codes', address_country_codes),
+        ('address_exceptions', address_exceptions),
+    ])
+    for (ip, address_country_code, address_exception), location, error in zip(columns, locations, errors):
+        result = (None, None, None)
+        if error is None:
+            if location is None or location[0] is None:
+                error = ValueError('The GeoLite2 database does not contain a country for %s' % ip)
+            else:
+                key = (location, address_country_code, address_exception)
+                if key not in outcomes:
+                    country_code, subdivision, city = location
+                    try:
+                        outcomes[key] = calculate_rate(
+                            country_code,
+                            subdivision or '',
+                            city or '',
+                            address_country_code,
+                            address_exception
+                        )
+                    except (ValueError, UndefinitiveError) as e:
+                        outcomes[key] = e
+                outcome = outcomes[key]
+                if isinstance(outcome, Exception):
+                    error = outcome
+                else:
+                    result = outcome
+
+        result_rates.append(result[0])
+        result_country_codes.append(result[1])
+        result_exception_names.append(result[2])
+        result_errors.append(error)
+
+    return (result_rates, result_country_codes, result_exception_names, result_errors)
+
+
+def load_database(path):
+    """
+    Memory-maps a GeoLite2 or GeoIP2 City database in the MaxMind DB format,
+    or a table written by compile_database(), for calculate_rate_for_ip().
+    Since the file is mapped read-only, all processes that load the same file
+    share one physical copy of it.
+
+    :param path:
+        A unicode string filesystem path of the .mmdb file or table
+
+    :raises:
+        ValueError - when the file is not a MaxMind DB file or table, or the table was compiled from a different version of GEOIP2_EXCEPTIONS
+    """
+
+    with _reload_lock:
+        _swap_database(_open_database(path), path)
+
+
+def reload_database(path=None, background=False, callback=None):
+    """
+    Memory-maps a new version of the database and then swaps it in place of
+    the current one. Lookups never wait on a lock: those already in progress
+    finish using the old database, which is unmapped once they no longer
+    reference it, and later ones use the new database. Since the new file is
+    fully mapped and validated before the swap, lookups do not pay for
+    opening it. If the new file can not be loaded, the current database stays
+    in use.
+
+    Each process has its own database, so worker processes must each call
+    this, e.g. on a timer.
+
+    :param path:
+        A unicode string filesystem path of the .mmdb file or table. None
+        to reload from the path last loaded, after it has been replaced.
+
+    :param background:
+        If True, the reload happens in a daemon thread and this returns
+        immediately
+
+    :param callback:
+        With background, None or a callable that is passed None once the
+        new database is in use, or the exception if it could not be loaded
+
+    :raises:
+        ValueError - when no path is given and no database is loaded; without background, the errors load_database() raises
+
+    :return:
+        None, or with background, the threading.Thread doing the reload
+    """
+
+    if path is None:
+        path = _database_path
+        if path is None:
+            raise ValueError('No GeoLite2 database has been loaded with load_database()')
+
+    if not background:
+        load_database(path)
+        return None
+
+    def reload():
+        try:
+            load_database(path)
+        except (Exception) as e:
+            if callback is not None:
+                callback(e)
+            return
+        if callback is not None:
+            callback(None)
+
+    thread = threading.Thread(target=reload, name='vat_moss.geoip2.reload_database')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def compile_database(path, locations_path, blocks_paths):
+    """
+    Compiles the GeoLite2 City CSV files into a compact table of IP address
+    ranges that can be loaded with load_database(). Only the parts of each
+    location that can affect the result of calculate_rate() are kept, so
+    adjacent networks with the same outcome are merged into a single range.
+    IPv4 ranges are stored sorted for binary search, while IPv6 ranges are
+    stored as a radix tree of networks, so that lookups compare short
+    prefixes rather than bisecting over 128 bit addresses. The table for the
+    whole GeoLite2 City database is a few megabytes.
+
+    :param path:
+        A unicode string filesystem path to write the table to
+
+    :param locations_path:
+        A unicode string filesystem path of GeoLite2-City-Locations-en.csv
+
+    :param blocks_paths:
+        A list of unicode string filesystem paths, normally of
+        GeoLite2-City-Blocks-IPv4.csv and GeoLite2-City-Blocks-IPv6.csv
+
+    :raises:
+        ValueError - when a network is invalid or the blocks overlap
+    """
+
+    outcomes = []
+    outcome_ids = {}
+
+    # A dict of unicode string geoname id to integer outcome id
+    locations = {}
+    with streaming.open_input(locations_path) as f:
+        for row in streaming.read_rows(f):
+            if not row['country_iso_code']:
+                continue
+            outcome = _vat_location(row['country_iso_code'], row['subdivision_1_name'], row['city_name'])
+            if outcome not in outcome_ids:
+                if len(outcomes) == _NONE_ID:
+                    raise ValueError('The GeoLite2 locations have too many distinct outcomes')
+                outcome_ids[outcome] = len(outcomes)
+                outcomes.append(outcome)
+            locations[row['geoname_id']] = outcome_ids[outcome]
+
+    # A dict of address length in bytes to a list of (start, end, outcome id)
+    ranges = {4: [], 16: []}
+    for blocks_path in blocks_paths:
+        with streaming.open_input(blocks_path) as f:
+            for row in streaming.read_rows(f):
+                outcome_id = locations.get(row['geoname_id'])
+                if outcome_id is None:
+                    continue
+                length, start, end = _network_range(row['network'])
+                ranges[length].append((start, end, outcome_id))
+
+    string_blob = b''.join(
+        _STRING_LENGTH.pack(len(value.encode('utf-8'))) + value.encode('utf-8')
+        for outcome in outcomes
+        for value in outcome
+    )
+
+    starts, ids = _range_columns(ranges[4], 4)
+
+    tree = RadixTree(128)
+    ipv6_starts, ipv6_ids = _range_columns(ranges[16], 16)
+    ipv6_ends = [start - 1 for start in ipv6_starts[1:]] + [(1 << 128) - 1]
+    for start, end, outcome_id in zip(ipv6_starts, ipv6_ends, ipv6_ids):
+        if outcome_id != _NONE_ID:
+            tree.insert_range(start, end, outcome_id)
+
+    header = _TABLE_HEADER.pack(
+        _TABLE_MAGIC,
+        _TABLE_VERSION,
+        len(outcomes),
+        len(string_blob),
+        len(ids),
+        len(tree),
+        _exceptions_fingerprint()
+    )
+
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.write(string_blob)
+        f.write(b''.join(binascii.unhexlify('%08x' % start) for start in starts))
+        f.write(struct.pack(str('<%dH' % len(ids)), *ids))
+        f.write(tree.serialize())
+
+
+def unload_database():
+    """
+    Stops using the database loaded with load_database()
+    """
+
+    with _reload_lock:
+        _swap_database(None, None)
+
+
+def database_path():
+    """
+    :return:
+        The unicode string filesystem path of the database loaded with
+        load_database(), or None if none is loaded
+    """
+
+    return _database_path
+
+
+def _open_database(path):
+    """
+    :param path:
+        A unicode string filesystem path of the .mmdb file or table
+
+    :raises:
+        ValueError - when the file is not a MaxMind DB file or table, or the table was compiled from a different version of GEOIP2_EXCEPTIONS
+
+    :return:
+        A vat_moss.mmdb.Reader or _MappedTable
+    """
+
+    with open(path, 'rb') as f:
+        magic = f.read(len(_TABLE_MAGIC))
+
+    if magic == _TABLE_MAGIC:
+        return _MappedTable(path)
+    return Reader(path)
+
+
+def _swap_database(database, path):
+    """
+    Replaces the database used for lookups. Lookups read the module global
+    once, so assigning it is atomic with respect to them.
+
+    :param database:
+        The new vat_moss.mmdb.Reader or _MappedTable, or None
+
+    :param path:
+        The unicode string filesystem path it was loaded from, or None
+    """
+
+    global _database, _database_path
+
+    _database = database
+    _database_path = path
+
+
+def _vat_location(country_code, subdivision, city):
+    """
+    Reduces a location to the parts that can affect calculate_rate(), so
+    that locations with the same outcome compare equal
+
+    :param country_code:
+        The two-character country code
+
+    :param subdivision:
+        The first subdivision name
+
+    :param city:
+        The city name
+
+    :return:
+        A tuple of (upper case country code, lower case subdivision name or
+        empty string, lower case city name or empty string)
+    """
+
+    country_code = country_code.upper()
+    subdivision = subdivision.lower()
+    city = city.lower()
+
+    subdivision_index = _GEOIP2_INDEX.get(country_code, {}).get(subdivision)
+    if subdivision_index is None:
+        return (country_code, '', '')
+    if city not in subdivision_index['cities']:
+        city = ''
+    return (country_code, subdivision, city)
+
+
+def _network_range(network):
+    """
+    :param network:
+        A unicode string CIDR network, e.g. "81.2.69.0/24"
+
+    :raises:
+        ValueError - when the network is invalid
+
+    :return:
+        A tuple of (integer address length in bytes, integer first address,
+        integer last address)
+    """
+
+    address, _, prefix_length = network.partition('/')
+    packed = pack_ip(address)
+    bits = len(packed) * 8
+    try:
+        prefix_length = int(prefix_length)
+    except (ValueError):
+        raise ValueError('%s is not a valid network' % network)
+    if not 0 <= prefix_length <= bits:
+        raise ValueError('%s is not a valid network' % network)
+
+    start = int(binascii.hexlify(packed), 16)
+    return (len(packed), start, start | ((1 << (bits - prefix_length)) - 1))
+
+
+def _range_columns(ranges, length):
+    """
+    Converts ranges into a sorted list of start addresses, each of which
+    applies until the next, merging adjacent ranges with the same outcome
+
+    :param ranges:
+        A list of (integer first address, integer last address, integer
+        outcome id) tuples
 
-        if sub_match != subdivision:
-            continue
+    :param length:
+        The integer address length in bytes
 
-        if city_match and city_match != city:
-            continue
+    :raises:
+        ValueError - when ranges overlap
+
+    :return:
+        A 2-element tuple of (list of integer start addresses, list of
+        integer outcome ids, where gaps are _NONE_ID)
+    """
+
+    starts = []
+    ids = []
+    previous_end = None
+    for start, end, outcome_id in sorted(ranges):
+        if previous_end is not None:
+            if start <= previous_end:
+                raise ValueError('The networks in the GeoLite2 blocks overlap')
+            if start == previous_end + 1 and outcome_id == ids[-1]:
+                previous_end = end
+                continue
+            if start > previous_end + 1:
+                starts.append(previous_end + 1)
+                ids.append(_NONE_ID)
+        starts.append(start)
+        ids.append(outcome_id)
+        previous_end = end
+
+    if previous_end is not None and previous_end + 1 < 1 << (length * 8):
+        starts.append(previous_end + 1)
+        ids.append(_NONE_ID)
+
+    return (starts, ids)
+
+
+def _pack_address(ip):
+    """
+    :param ip:
+        A unicode string IPv4 or IPv6 address, or an integer
+
+    :raises:
+        ValueError - when the IP address is invalid
+
+    :return:
+        A byte string of 4 bytes for IPv4 and IPv4-mapped IPv6 addresses,
+        otherwise 16 bytes
+    """
+
+    packed = pack_ip(ip)
+    if len(packed) == 16 and packed[0:12] == _IPV4_MAPPED_PREFIX:
+        return packed[12:]
+    return packed
+
+
+def _exceptions_fingerprint():
+    """
+    :return:
+        A 20-byte byte string hash of the locations in GEOIP2_EXCEPTIONS,
+        used to detect stale compiled tables
+    """
+
+    matchers = []
+    for country_code in GEOIP2_EXCEPTIONS:
+        for matcher in GEOIP2_EXCEPTIONS[country_code]:
+            if isinstance(matcher, str_cls):
+                matcher = (matcher,)
+            matchers.append([country_code] + list(matcher))
+    data = json.dumps(sorted(matchers))
+    return hashlib.sha1(data.encode('utf-8')).digest()
+
+
+class _MappedTable(object):
+
+    """
+    A read-only memory-mapped table of IP address ranges from
+    compile_database(). The file consists of a header, a block of
+    length-prefixed UTF-8 strings with three per location, the sorted
+    big-endian start address of each IPv4 range followed by the location id
+    of each range, then the nodes of a vat_moss.radix.RadixTree of the IPv6
+    networks, with location ids as values.
+    """
+
+    def __init__(self, path):
+        """
+        :param path:
+            A unicode string filesystem path of the table
+
+        :raises:
+            ValueError - when the file is not a valid table for the current data
+        """
+
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._map) < _TABLE_HEADER.size:
+            raise ValueError('GeoLite2 table %s is truncated' % path)
+
+        magic, version, location_count, strings_length, ipv4_count, ipv6_node_count, fingerprint = \
+            _TABLE_HEADER.unpack_from(self._map, 0)
+
+        if magic != _TABLE_MAGIC or version != _TABLE_VERSION:
+            raise ValueError('%s is not a GeoLite2 table' % path)
+
+        if fingerprint != _exceptions_fingerprint():
+            raise ValueError('GeoLite2 table %s was compiled from different data, please recompile it' % path)
+
+        expected_length = _TABLE_HEADER.size + strings_length + ipv4_count * 6 + ipv6_node_count * NODE_SIZE
+        if len(self._map) != expected_length:
+            raise ValueError('GeoLite2 table %s is truncated' % path)
+
+        offset = _TABLE_HEADER.size
+        strings = []
+        for _ in range(location_count * 3):
+            length = _STRING_LENGTH.unpack_from(self._map, offset)[0]
+            offset += _STRING_LENGTH.size
+            strings.append(self._map[offset:offset + length].decode('utf-8') or None)
+            offset += length
+        self._locations = [tuple(strings[i:i + 3]) for i in range(0, len(strings), 3)]
+
+        self._ipv4 = _StartColumn(self._map, offset, ipv4_count, 4)
+        offset += ipv4_count * 6
+        self._ipv6 = MappedRadixTree(self._map, offset, ipv6_node_count, 128)
+
+    def location(self, ip):
+        """
+        :param ip:
+            A unicode string IPv4 or IPv6 address, or an integer
+
+        :raises:
+            ValueError - when the IP address is invalid
+
+        :return:
+            None if the address is not in the table, otherwise a tuple of
+            (country code, lower case subdivision name or None, lower case city
+            name or None)
+        """
+
+        packed = _pack_address(ip)
+        if len(packed) == 16:
+            return self._ipv6_location(packed)
+        return self._location(self._ipv4, bisect_right(self._ipv4, packed) - 1)
+
+    def locations(self, ips):
+        """
+        Looks up the location of many IP addresses. The IPv4 addresses are
+        sorted and then merged with the sorted ranges by galloping forward
+        from the range of the previous address, so the cost of each search
+        depends on the distance between neighboring addresses rather than the
+        size of the table. IPv6 addresses are looked up in the radix tree.
+
+        :param ips:
+            An iterable of unicode string IP addresses or integers
+
+        :return:
+            A 2-element tuple of lists parallel to ips: (the tuples that
+            location() returns, or None; the ValueError for each invalid IP
+            address, or None)
+        """
+
+        results = []
+        errors = []
+        # A list of (packed address, position) for IPv4 addresses
+        addresses = []
+        for position, ip in enumerate(ips):
+            results.append(None)
+            try:
+                packed = _pack_address(ip)
+            except (ValueError) as e:
+                errors.append(e)
+                continue
+            errors.append(None)
+            if len(packed) == 16:
+                results[position] = self._ipv6_location(packed)
+            else:
+                addresses.append((packed, position))
+
+        column = self._ipv4
+        count = len(column)
+        low = 0
+        for packed, position in sorted(addresses):
+            # Gallop forward from the previous range to bound the search
+            step = 1
+            high = low + 1
+            while high < count and column[high] <= packed:
+                low = high
+                high = low + step
+                step *= 2
+            index = bisect_right(column, packed, low, min(high, count)) - 1
+            if index > low:
+                low = index
+            results[position] = self._location(column, index)
+
+        return (results, errors)
+
+    def _ipv6_location(self, packed):
+        """
+        :param packed:
+            A 16-byte byte string IPv6 address
+
+        :return:
+            None or a tuple, as returned by location()
+        """
+
+        location_id = self._ipv6.lookup(int(binascii.hexlify(packed), 16))
+        if location_id is None:
+            return None
+        return self._locations[location_id]
+
+    def _location(self, column, index):
+        """
+        :param column:
+            The _StartColumn of IPv4 ranges
+
+        :param index:
+            The integer index of the range, or -1
+
+        :return:
+            None or a tuple, as returned by location()
+        """
+
+        if index < 0:
+            return None
+        location_id = column.location_id(index)
+        if location_id == _NONE_ID:
+            return None
+        return self._locations[location_id]
+
+
+class _StartColumn(object):
+
+    """
+    A sequence of the big-endian start addresses of the ranges in a
+    _MappedTable, which compare in numeric order, for use with bisect. The
+    location ids of the ranges follow the start addresses.
+    """
+
+    def __init__(self, buffer, offset, count, width):
+        self._buffer = buffer
+        self._offset = offset
+        self._count = count
+        self._width = width
+        self._ids_offset = offset + count * width
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        offset = self._offset + index * self._width
+        return self._buffer[offset:offset + self._width]
+
+    def location_id(self, index):
+        return _LOCATION_ID.unpack_from(self._buffer, self._ids_offset + index * _LOCATION_ID.size)[0]
+
+
+def _calculate_exception_rate(country_code, subdivision, city, address_country_code, address_exception):
+    """
+    Determines the VAT rate for a location in a country with entries in
+    GEOIP2_EXCEPTIONS
+
+    :param country_code:
+        The upper case two-character country code
+
+    :param subdivision:
+        The lower case subdivision name
+
+    :param city:
+        The lower case city name
 
-        info = exceptions[matcher]
+    :param address_country_code:
+        The user's country_code, or None
+
+    :param address_exception:
+        The user's exception name, or None
+
+    :raises:
+        UndefinitiveError - when no address_country_code is provided and the location is not specific enough
+
+    :return:
+        A tuple of (Decimal percentage rate, country code, exception name [or None])
+    """
+
+    for info in _matching_rules(country_code, subdivision, city):
         exception_name = info['name']
         if not info['definitive']:
             if address_country_code is None:
-                raise UndefinitiveError('It is not possible to determine the users VAT rates based on the information provided')
+                raise UndefinitiveError(_UNDEFINITIVE_MESSAGE)
 
             if address_country_code != country_code:
                 continue
@@ -96,7 +815,144 @@ def calculate_rate(country_code, subdivision, city, address_country_code=None, a
         rate = rates.BY_COUNTRY[country_code]['exceptions'][exception_name]
         return (rate, country_code, exception_name)
 
-    return (country_default, country_code, None)
+    return (rates.BY_COUNTRY[country_code]['rate'], country_code, None)
+
+
+def _depends_on_address(country_code, subdivision, city):
+    """
+    :param country_code:
+        The upper case two-character country code
+
+    :param subdivision:
+        The lower case subdivision name
+
+    :param city:
+        The lower case city name
+
+    :return:
+        A bool, if a rule that is not definitive is reached before any
+        definitive one, so the address information affects the result
+    """
+
+    for info in _matching_rules(country_code, subdivision, city):
+        return not info['definitive']
+    return False
+
+
+def enable_cache(maxsize=10000):
+    """
+    Starts caching the results of calculate_rate() for locations in
+    countries with entries in GEOIP2_EXCEPTIONS in a least-recently-used
+    cache. The cache is keyed on the normalized location, and only includes
+    the address_country_code and address_exception for locations that match
+    a rule that is not definitive. An UndefinitiveError outcome is cached too,
+    and raised again for repeat lookups. Other countries are not cached since
+    their rate is found with a single dict lookup.
+
+    Any existing cache is discarded.
+
+    :param maxsize:
+        The integer maximum number of entries to cache
+
+    :raises:
+        ValueError - when maxsize is less than 1
+    """
+
+    global _cache
+
+    _cache = LRUCache(maxsize)
+
+
+def disable_cache():
+    """
+    Stops caching results and discards the cache
+    """
+
+    global _cache
+
+    _cache = None
+
+
+def cache_stats():
+    """
+    :return:
+        None if the cache is not enabled, otherwise a dict in the format
+        returned by vat_moss.cache.LRUCache.stats()
+    """
+
+    cache = _cache
+    if cache is None:
+        return None
+    return cache.stats()
+
+
+def _matching_rules(country_code, subdivision, city):
+    """
+    Finds the entries of GEOIP2_EXCEPTIONS for a country that match a
+    subdivision and city, using the precompiled index
+
+    :param country_code:
+        The upper case two-character country code
+
+    :param subdivision:
+        The lower case subdivision name
+
+    :param city:
+        The lower case city name
+
+    :return:
+        A list of info dicts, with the one matching the subdivision and city
+        before the one matching just the subdivision
+    """
+
+    subdivision_index = _GEOIP2_INDEX.get(country_code, {}).get(subdivision)
+    if subdivision_index is None:
+        return []
+
+    rules = []
+    city_info = subdivision_index['cities'].get(city)
+    if city_info is not None:
+        rules.append(city_info)
+    if subdivision_index['default'] is not None:
+        rules.append(subdivision_index['default'])
+    return rules
+
+
+def _build_index(exceptions):
+    """
+    Compiles GEOIP2_EXCEPTIONS into a two-level index so that finding the
+    rules for a location does not depend on the number of exceptions or the
+    order they are listed in
+
+    :param exceptions:
+        A dict in the format of GEOIP2_EXCEPTIONS
+
+    :return:
+        A dict of country code to a dict of subdivision name to a dict with
+        the keys "cities", a dict of city name to info dict, and "default",
+        the info dict for the subdivision as a whole, or None
+    """
+
+    index = {}
+    for country_code in exceptions:
+        country_index = {}
+        for matcher, info in exceptions[country_code].items():
+            # Subdivision-only match
+            if isinstance(matcher, str_cls):
+                subdivision = matcher
+                city = None
+            else:
+                subdivision, city = matcher
+
+            subdivision_index = country_index.setdefault(subdivision, {'cities': {}, 'default': None})
+            if city is None:
+                subdivision_index['default'] = info
+            else:
+                subdivision_index['cities'][city] = info
+
+        index[country_code] = country_index
+
+    return index
 
 
 # A dictionary that maps information from the GeoLite2 databases to VAT
@@ -173,3 +1029,27 @@ GEOIP2_EXCEPTIONS = {
         }
     }
 }
+
+_GEOIP2_INDEX = _build_index(GEOIP2_EXCEPTIONS)
+
+_cache = None
+
+# Cached in place of results that depend on the address information, or that
+# raise an UndefinitiveError
+_ADDRESS_DEPENDENT = object()
+_UNDEFINITIVE = object()
+_UNDEFINITIVE_MESSAGE = 'It is not possible to determine the users VAT rates based on the information provided'
+
+_database = None
+_database_path = None
+# Serializes loads so concurrent reloads are applied in order. Lookups do not
+# use it.
+_reload_lock = threading.Lock()
+
+_TABLE_MAGIC = b'VMGT'
+_TABLE_VERSION = 2
+_TABLE_HEADER = struct.Struct(str('<4sHIIII20s'))
+_STRING_LENGTH = struct.Struct(str('<H'))
+_LOCATION_ID = struct.Struct(str('<H'))
+_NONE_ID = 0xFFFF
+_IPV4_MAPPED_PREFIX = b'\x00' * 10 + b'\xff\xff'
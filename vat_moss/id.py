@@ -1,21 +1,35 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-import re
+import cgi
+import io
 import json
+import re
+import socket
+import threading
 from xml.etree import ElementTree
-import cgi
 
 try:
     # Python 3
     from urllib.request import Request, urlopen
-    from urllib.error import HTTPError
+    from urllib.error import HTTPError, URLError
+    from urllib.parse import urljoin, urlsplit
+    import http.client as http_client
     str_cls = str
 except (ImportError):
     # Python 2
-    from urllib2 import Request, urlopen, HTTPError
+    from urllib2 import Request, urlopen, HTTPError, URLError
+    from urlparse import urljoin, urlsplit
+    import httplib as http_client
     str_cls = unicode
 
+try:
+    # Python 3.3+
+    from time import monotonic
+except (ImportError):
+    # Python 2
+    from time import time as monotonic
+
 from .errors import InvalidError, WebServiceError, WebServiceUnavailableError
 
 
@@ -103,14 +117,8 @@ def validate(vat_id):
         validation_url = 'http://data.brreg.no/enhetsregisteret/enhet/%s.json' % organization_number
 
         try:
-            response = urlopen(validation_url)
-            _, params = cgi.parse_header(response.headers['Content-Type'])
-            if 'charset' in params:
-                encoding = params['charset']
-            else:
-                encoding = 'utf-8'
-
-            return_json = response.read().decode(encoding)
+            content_type, body = _transport.request(validation_url)
+            return_json = _decode_body(content_type, body)
 
             # Example response:
             #
@@ -197,11 +205,12 @@ def validate(vat_id):
             </soapenv:Envelope>
         ''' % (country_prefix, number)
 
-        request = Request('http://ec.europa.eu/taxation_customs/vies/services/checkVatService')
-        request.add_header('Content-Type', 'application/x-www-form-urlencoded; charset=utf-8')
-
         try:
-            response = urlopen(request, post_data.encode('utf-8'))
+            content_type, body = _transport.request(
+                'http://ec.europa.eu/taxation_customs/vies/services/checkVatService',
+                post_data.encode('utf-8'),
+                {'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'}
+            )
         except (HTTPError) as e:
             # If one of the country VAT ID services is down, we get a 500
             if e.code == 500:
@@ -210,13 +219,7 @@ def validate(vat_id):
             # If we get anything but a 500 we want the exception to be recorded
             raise
 
-        _, params = cgi.parse_header(response.headers['Content-Type'])
-        if 'charset' in params:
-            encoding = params['charset']
-        else:
-            encoding = 'utf-8'
-
-        return_xml = response.read().decode(encoding)
+        return_xml = _decode_body(content_type, body)
 
         # Example response:
         #
@@ -267,6 +270,293 @@ def validate(vat_id):
     return (ID_PATTERNS[country_prefix]['country_code'], vat_id, company_name)
 
 
+def set_transport(transport):
+    """
+    Changes how validate() makes HTTP requests, e.g. to reuse connections
+    with a PooledTransport. The transport is shared by all threads.
+
+    :param transport:
+        An object with a request() method like UrllibTransport, or None to
+        restore the default of a new connection per request
+    """
+
+    global _transport
+
+    if transport is None:
+        transport = UrllibTransport()
+    _transport = transport
+
+
+class UrllibTransport(object):
+
+    """
+    Makes each request over a new connection using urlopen(). This is the
+    default transport.
+    """
+
+    def request(self, url, data=None, headers=None):
+        """
+        Makes an HTTP request, following redirects
+
+        :param url:
+            The unicode string URL
+
+        :param data:
+            None for a GET request, or a byte string body to POST
+
+        :param headers:
+            None, or a dict of unicode string request headers
+
+        :raises:
+            urllib.error.HTTPError/urllib2.HTTPError - for an error response
+            urllib.error.URLError/urllib2.URLError - if the server can not be reached
+
+        :return:
+            A tuple of (unicode string Content-Type header or None, byte
+            string response body)
+        """
+
+        request = Request(url)
+        for name, value in (headers or {}).items():
+            request.add_header(name, value)
+
+        response = urlopen(request, data)
+        try:
+            return (response.headers.get('Content-Type'), response.read())
+        finally:
+            response.close()
+
+
+class PooledTransport(object):
+
+    """
+    Makes requests over persistent HTTP/1.1 connections, keeping up to
+    pool_size idle connections per host for reuse, so that repeated requests
+    to VIES or data.brreg.no do not each pay for DNS resolution and a new
+    connection. It is safe to use from multiple threads: each request has a
+    connection to itself, and a new one is opened when none are idle.
+    """
+
+    def __init__(self, pool_size=4, timeout=10, connect_timeout=None, idle_timeout=30):
+        """
+        :param pool_size:
+            The integer maximum number of idle connections to keep per host
+
+        :param timeout:
+            The number of seconds to wait for the server to respond
+
+        :param connect_timeout:
+            The number of seconds to wait for a connection, defaults to
+            timeout
+
+        :param idle_timeout:
+            The number of seconds an idle connection is reused for. Servers
+            close idle connections, so this should be below their limit.
+
+        :raises:
+            ValueError - when pool_size is less than 1
+        """
+
+        if pool_size < 1:
+            raise ValueError('The pool size must be at least 1')
+
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.connect_timeout = timeout if connect_timeout is None else connect_timeout
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        # A dict of (scheme, host, port) to a list of (connection, time it
+        # became idle), with the most recently used last
+        self._pools = {}
+
+    def request(self, url, data=None, headers=None):
+        """
+        Makes an HTTP request, following redirects
+
+        :param url:
+            The unicode string URL
+
+        :param data:
+            None for a GET request, or a byte string body to POST
+
+        :param headers:
+            None, or a dict of unicode string request headers
+
+        :raises:
+            ValueError - when the URL is not http or https
+            urllib.error.HTTPError/urllib2.HTTPError - for an error response
+            urllib.error.URLError/urllib2.URLError - if the server can not be reached or the connection fails
+
+        :return:
+            A tuple of (unicode string Content-Type header or None, byte
+            string response body)
+        """
+
+        for _ in range(_MAX_REDIRECTS + 1):
+            status, reason, response_headers, body = self._send(url, data, headers)
+            location = response_headers.get('Location')
+            if status in _REDIRECT_STATUSES and location:
+                # As with urllib, 301, 302 and 303 switch to a GET without the
+                # body, while 307 and 308 resend the request unchanged
+                if status not in _PRESERVING_REDIRECT_STATUSES and data is not None:
+                    data = None
+                    headers = dict(
+                        (name, value) for name, value in (headers or {}).items()
+                        if name.lower() not in ('content-length', 'content-type')
+                    )
+                url = urljoin(url, location)
+                continue
+            if not 200 <= status < 300:
+                raise HTTPError(url, status, reason, response_headers, io.BytesIO(body))
+            return (response_headers.get('Content-Type'), body)
+
+        raise HTTPError(url, status, 'Too many redirects', response_headers, io.BytesIO(body))
+
+    def close(self):
+        """
+        Closes the idle connections. Connections in use are closed when their
+        request finishes if the transport is not used again.
+        """
+
+        with self._lock:
+            pools = self._pools
+            self._pools = {}
+
+        for pool in pools.values():
+            for connection, _ in pool:
+                connection.close()
+
+    def _send(self, url, data, headers):
+        """
+        Makes a single HTTP request, retrying once on a new connection if a
+        reused one was closed by the server
+
+        :return:
+            A tuple of (integer status, unicode string reason, response
+            headers, byte string body)
+        """
+
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError('%s is not an http or https URL' % url)
+        key = (parts.scheme, parts.hostname, parts.port)
+
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        method = 'GET' if data is None else 'POST'
+
+        connection = self._checkout(key)
+        reused = connection is not None
+        while True:
+            if connection is None:
+                connection = self._connect(parts)
+            try:
+                connection.request(method, path, data, headers or {})
+                response = connection.getresponse()
+                body = response.read()
+                break
+            except (socket.timeout) as e:
+                connection.close()
+                raise URLError(e)
+            except (socket.error, http_client.HTTPException) as e:
+                connection.close()
+                if not reused:
+                    raise URLError(e)
+                connection = None
+                reused = False
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._checkin(key, connection)
+
+        return (response.status, response.reason, response.msg, body)
+
+    def _connect(self, parts):
+        """
+        :param parts:
+            The urlsplit() result of the URL
+
+        :raises:
+            urllib.error.URLError/urllib2.URLError - if the server can not be reached
+
+        :return:
+            A connected http.client/httplib HTTPConnection or HTTPSConnection
+        """
+
+        if parts.scheme == 'https':
+            connection_class = http_client.HTTPSConnection
+        else:
+            connection_class = http_client.HTTPConnection
+
+        connection = connection_class(parts.hostname, parts.port, timeout=self.connect_timeout)
+        try:
+            connection.connect()
+        except (socket.error) as e:
+            connection.close()
+            raise URLError(e)
+        connection.sock.settimeout(self.timeout)
+        return connection
+
+    def _checkout(self, key):
+        """
+        :return:
+            The most recently used idle connection for the host, or None
+        """
+
+        expired = []
+        connection = None
+        with self._lock:
+            pool = self._pools.get(key)
+            now = monotonic()
+            while pool:
+                candidate, idle_since = pool.pop()
+                if now - idle_since < self.idle_timeout:
+                    connection = candidate
+                    break
+                expired.append(candidate)
+
+        for candidate in expired:
+            candidate.close()
+        return connection
+
+    def _checkin(self, key, connection):
+        """
+        Makes a connection available for reuse, or closes it if the pool for
+        the host is full
+        """
+
+        with self._lock:
+            pool = self._pools.setdefault(key, [])
+            if len(pool) < self.pool_size:
+                pool.append((connection, monotonic()))
+                return
+
+        connection.close()
+
+
+def _decode_body(content_type, body):
+    """
+    :param content_type:
+        The unicode string Content-Type header, or None
+
+    :param body:
+        A byte string response body
+
+    :return:
+        A unicode string of the body, decoded using the charset from the
+        Content-Type, or UTF-8
+    """
+
+    encoding = 'utf-8'
+    if content_type:
+        _, params = cgi.parse_header(content_type)
+        if 'charset' in params:
+            encoding = params['charset']
+    return body.decode(encoding)
+
+
 # Patterns generated by consulting the following URLs:
 #
 #  - http://en.wikipedia.org/wiki/VAT_identification_number
@@ -390,3 +680,9 @@ ID_PATTERNS = {
         'country_code': 'SK'
     },
 }
+
+_transport = UrllibTransport()
+
+_MAX_REDIRECTS = 5
+_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+_PRESERVING_REDIRECT_STATUSES = (307, 308)
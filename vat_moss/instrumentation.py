@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+
+try:
+    # Python 3.3+
+    from time import perf_counter as timer
+except (ImportError):
+    # Python 2
+    from time import time as timer
+
+
+# The upper bounds, in seconds, of the default histogram buckets
+DEFAULT_BUCKETS = (
+    0.000001,
+    0.000002,
+    0.000005,
+    0.00001,
+    0.00002,
+    0.00005,
+    0.0001,
+    0.0002,
+    0.0005,
+    0.001,
+    0.01,
+    0.1,
+)
+
+
+class Instrumentation(object):
+
+    """
+    Thread-safe aggregate counters, counters broken down by a key, and a
+    histogram of elapsed times. The snapshot() format is suitable for
+    exporting to a metrics system, with cumulative histogram buckets in the
+    style of Prometheus.
+    """
+
+    def __init__(self, buckets=None):
+        """
+        :param buckets:
+            An iterable of the float upper bounds, in seconds, of the histogram
+            buckets. Defaults to DEFAULT_BUCKETS.
+        """
+
+        if buckets is None:
+            buckets = DEFAULT_BUCKETS
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def increment(self, name, amount=1, key=None):
+        """
+        Adds to a counter
+
+        :param name:
+            A unicode string name of the counter
+
+        :param amount:
+            The integer amount to add
+
+        :param key:
+            None, or a unicode string to also add the amount to the counter
+            under the name in the breakdown
+        """
+
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+            if key is not None:
+                breakdown = self._breakdowns.setdefault(name, {})
+                breakdown[key] = breakdown.get(key, 0) + amount
+
+    def observe(self, seconds):
+        """
+        Records an elapsed time in the histogram
+
+        :param seconds:
+            A float number of seconds
+        """
+
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                index = i
+                break
+
+        with self._lock:
+            self._bucket_counts[index] += 1
+            self._count += 1
+            self._sum += seconds
+
+    def snapshot(self):
+        """
+        :return:
+            A dict with the keys:
+             - "counters": a dict of counter name to integer
+             - "breakdowns": a dict of counter name to a dict of key to integer
+             - "histogram": a dict with the keys "buckets" (a list of
+               (float upper bound or None for infinity, cumulative integer
+               count) tuples), "count" and "sum"
+        """
+
+        with self._lock:
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(self.buckets + (None,), self._bucket_counts):
+                cumulative += count
+                buckets.append((bound, cumulative))
+
+            return {
+                'counters': dict(self._counters),
+                'breakdowns': dict((name, dict(breakdown)) for name, breakdown in self._breakdowns.items()),
+                'histogram': {
+                    'buckets': buckets,
+                    'count': self._count,
+                    'sum': self._sum,
+                }
+            }
+
+    def reset(self):
+        """
+        Sets all counters and the histogram back to zero
+        """
+
+        with self._lock:
+            self._counters = {}
+            self._breakdowns = {}
+            self._bucket_counts = [0] * (len(self.buckets) + 1)
+            self._count = 0
+            self._sum = 0.0
@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import binascii
+import mmap
+import socket
+import struct
+
+try:
+    # Python 2
+    str_cls = unicode
+    int_types = (int, long)
+    range = xrange
+except (NameError):
+    # Python 3
+    str_cls = str
+    int_types = (int,)
+
+
+class Reader(object):
+
+    """
+    A pure-Python reader for MaxMind DB files, such as the GeoLite2 City
+    database. The file is memory-mapped and only the parts of a record that
+    are asked for are decoded, so looking up the location of an IP address
+    does not build objects for the rest of the record.
+
+    See http://maxmind.github.io/MaxMind-DB/ for the format.
+    """
+
+    def __init__(self, path):
+        """
+        :param path:
+            A unicode string filesystem path of the database
+
+        :raises:
+            ValueError - when the file is not a MaxMind DB file
+        """
+
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        metadata_start = self._map.rfind(_METADATA_MARKER)
+        if metadata_start == -1:
+            raise ValueError('%s is not a MaxMind DB file' % path)
+        metadata_start += len(_METADATA_MARKER)
+
+        self.metadata = _Decoder(self._map, metadata_start).decode(metadata_start)[0]
+        if not isinstance(self.metadata, dict):
+            raise ValueError('%s is not a MaxMind DB file' % path)
+
+        try:
+            self.node_count = self.metadata['node_count']
+            self.record_size = self.metadata['record_size']
+            self.ip_version = self.metadata['ip_version']
+        except (KeyError):
+            raise ValueError('%s is not a MaxMind DB file' % path)
+
+        if self.record_size not in (24, 28, 32):
+            raise ValueError('%s has an unsupported record size of %s' % (path, self.record_size))
+
+        self._node_size = self.record_size // 4
+        self._tree_size = self.node_count * self._node_size
+        self._decoder = _Decoder(self._map, self._tree_size + _DATA_SECTION_SEPARATOR_SIZE)
+
+        # IPv4 addresses are stored in IPv6 databases under ::/96
+        self._ipv4_start = 0
+        if self.ip_version == 6:
+            node = 0
+            for _ in range(96):
+                if node >= self.node_count:
+                    break
+                node = self._read_node(node, 0)
+            self._ipv4_start = node
+
+    def get(self, ip):
+        """
+        Decodes the whole record for an IP address
+
+        :param ip:
+            A unicode string IPv4 or IPv6 address
+
+        :raises:
+            ValueError - when the IP address is invalid, or is IPv6 and the database only contains IPv4
+
+        :return:
+            None if the address is not in the database, otherwise the decoded
+            record, normally a dict
+        """
+
+        offset = self._record_offset(ip)
+        if offset is None:
+            return None
+        return self._decoder.decode(offset)[0]
+
+    def location(self, ip):
+        """
+        Decodes just the fields of a GeoIP2/GeoLite2 City record needed by
+        vat_moss.geoip2.calculate_rate()
+
+        :param ip:
+            A unicode string IPv4 or IPv6 address, or an integer
+
+        :raises:
+            ValueError - when the IP address is invalid, or is IPv6 and the database only contains IPv4
+
+        :return:
+            None if the address is not in the database, otherwise a tuple of
+            (country code or None, English name of the first subdivision or
+            None, English name of the city or None)
+        """
+
+        offset = self._record_offset(ip)
+        if offset is None:
+            return None
+        return self._location(offset)
+
+    def _location(self, offset):
+        """
+        :param offset:
+            The integer offset of a record
+
+        :return:
+            A tuple of (country code or None, English name of the first
+            subdivision or None, English name of the city or None)
+        """
+
+        return (
+            self._decoder.find(offset, ('country', 'iso_code')),
+            self._decoder.find(offset, ('subdivisions', 0, 'names', 'en')),
+            self._decoder.find(offset, ('city', 'names', 'en')),
+        )
+
+    def locations(self, ips):
+        """
+        Looks up the location of many IP addresses, decoding the fields for
+        each distinct record once
+
+        :param ips:
+            An iterable of unicode string IP addresses or integers
+
+        :return:
+            A 2-element tuple of lists parallel to ips: (the tuples that
+            location() returns, or None; the ValueError for each invalid IP
+            address, or None)
+        """
+
+        results = []
+        errors = []
+        decoded = {}
+        for ip in ips:
+            try:
+                offset = self._record_offset(ip)
+            except (ValueError) as e:
+                results.append(None)
+                errors.append(e)
+                continue
+
+            if offset is not None and offset not in decoded:
+                decoded[offset] = self._location(offset)
+            results.append(decoded.get(offset))
+            errors.append(None)
+
+        return (results, errors)
+
+    def close(self):
+        """
+        Unmaps the file. The reader may not be used afterwards.
+        """
+
+        self._map.close()
+
+    def _record_offset(self, ip):
+        """
+        Walks the search tree for an IP address
+
+        :param ip:
+            A unicode string IPv4 or IPv6 address
+
+        :raises:
+            ValueError - when the IP address is invalid, or is IPv6 and the database only contains IPv4
+
+        :return:
+            None if the address is not in the database, otherwise the integer
+            offset of the record in the file
+        """
+
+        packed = bytearray(pack_ip(ip))
+        if len(packed) == 16 and self.ip_version == 4:
+            raise ValueError('%s is an IPv6 address, but the database only contains IPv4' % ip)
+
+        node = self._ipv4_start if len(packed) == 4 else 0
+        for i in range(len(packed) * 8):
+            if node >= self.node_count:
+                break
+            node = self._read_node(node, (packed[i >> 3] >> (7 - (i & 7))) & 1)
+
+        if node == self.node_count:
+            return None
+        if node > self.node_count:
+            # Record values count from the start of the 16 byte separator
+            # between the tree and the data section
+            return self._tree_size + node - self.node_count
+        raise ValueError('The MaxMind DB search tree is invalid')
+
+    def _read_node(self, node, bit):
+        """
+        :param node:
+            The integer node number
+
+        :param bit:
+            0 for the left record, 1 for the right record
+
+        :return:
+            The integer value of the record
+        """
+
+        offset = node * self._node_size
+        if self.record_size == 24:
+            if bit:
+                return _UINT32_STRUCT.unpack_from(self._map, offset + 2)[0] & 0xFFFFFF
+            return _UINT32_STRUCT.unpack_from(self._map, offset)[0] >> 8
+
+        if self.record_size == 28:
+            if bit:
+                return _UINT32_STRUCT.unpack_from(self._map, offset + 3)[0] & 0x0FFFFFFF
+            value = _UINT32_STRUCT.unpack_from(self._map, offset)[0]
+            return ((value & 0xF0) << 20) | (value >> 8)
+
+        return _UINT32_STRUCT.unpack_from(self._map, offset + bit * 4)[0]
+
+
+class _Decoder(object):
+
+    """
+    Decodes values from the data section or metadata of a MaxMind DB file
+    """
+
+    def __init__(self, buffer, pointer_base):
+        """
+        :param buffer:
+            A byte string or mmap of the file
+
+        :param pointer_base:
+            The integer offset that pointers are relative to
+        """
+
+        self._buffer = buffer
+        self._pointer_base = pointer_base
+
+    def decode(self, offset):
+        """
+        :param offset:
+            The integer offset of the value
+
+        :raises:
+            ValueError - when the data is invalid
+
+        :return:
+            A 2-element tuple of (decoded value, integer offset after the value)
+        """
+
+        buffer = self._buffer
+        type_, size, offset = self._read_control(offset)
+
+        if type_ == _POINTER:
+            return (self.decode(size)[0], offset)
+
+        if type_ == _MAP:
+            value = {}
+            for _ in range(size):
+                key, offset = self.decode(offset)
+                value[key], offset = self.decode(offset)
+            return (value, offset)
+
+        if type_ == _ARRAY:
+            value = []
+            for _ in range(size):
+                element, offset = self.decode(offset)
+                value.append(element)
+            return (value, offset)
+
+        end = offset + size
+        if type_ == _UTF8_STRING:
+            return (buffer[offset:end].decode('utf-8'), end)
+        if type_ in _UINT_TYPES:
+            return (_uint(buffer[offset:end]), end)
+        if type_ == _INT32:
+            value = _uint(buffer[offset:end])
+            if size == 4 and value & 0x80000000:
+                value -= 0x100000000
+            return (value, end)
+        if type_ == _DOUBLE:
+            return (_DOUBLE_STRUCT.unpack(buffer[offset:end])[0], end)
+        if type_ == _FLOAT:
+            return (_FLOAT_STRUCT.unpack(buffer[offset:end])[0], end)
+        if type_ == _BYTES:
+            return (bytes(buffer[offset:end]), end)
+        if type_ == _BOOLEAN:
+            return (size != 0, offset)
+
+        raise ValueError('Unsupported MaxMind DB data type %s' % type_)
+
+    def find(self, offset, path):
+        """
+        Decodes a single value nested inside maps and arrays, skipping over
+        everything else without decoding it
+
+        :param offset:
+            The integer offset of the outermost value
+
+        :param path:
+            A tuple of unicode string map keys and integer array indexes
+
+        :raises:
+            ValueError - when the data is invalid
+
+        :return:
+            None if the path does not exist, otherwise the decoded value
+        """
+
+        for key in path:
+            type_, size, offset = self._read_control(offset)
+            if type_ == _POINTER:
+                type_, size, offset = self._read_control(size)
+
+            if isinstance(key, int):
+                if type_ != _ARRAY or key >= size:
+                    return None
+                for _ in range(key):
+                    offset = self._skip(offset)
+                continue
+
+            if type_ != _MAP:
+                return None
+            key = key.encode('utf-8')
+            for _ in range(size):
+                map_key, offset = self._read_key(offset)
+                if map_key == key:
+                    break
+                offset = self._skip(offset)
+            else:
+                return None
+
+        return self.decode(offset)[0]
+
+    def _read_key(self, offset):
+        """
+        :param offset:
+            The integer offset of a map key
+
+        :return:
+            A 2-element tuple of (byte string of the UTF-8 key, integer offset
+            after the key)
+        """
+
+        type_, size, offset = self._read_control(offset)
+        if type_ == _POINTER:
+            type_, key_size, key_offset = self._read_control(size)
+            return (self._buffer[key_offset:key_offset + key_size], offset)
+        return (self._buffer[offset:offset + size], offset + size)
+
+    def _skip(self, offset):
+        """
+        :param offset:
+            The integer offset of a value
+
+        :return:
+            The integer offset after the value
+        """
+
+        type_, size, offset = self._read_control(offset)
+        if type_ == _POINTER or type_ == _BOOLEAN:
+            return offset
+        if type_ == _MAP:
+            size *= 2
+        if type_ == _MAP or type_ == _ARRAY:
+            for _ in range(size):
+                offset = self._skip(offset)
+            return offset
+        return offset + size
+
+    def _read_control(self, offset):
+        """
+        Reads the control byte and any extended type and size bytes
+
+        :param offset:
+            The integer offset of the value
+
+        :return:
+            A 3-element tuple of (integer type, integer size, integer offset
+            of the payload). For pointers, the size is the absolute offset
+            pointed to and the offset is after the pointer.
+        """
+
+        buffer = self._buffer
+        control = ord(buffer[offset:offset + 1])
+        offset += 1
+        type_ = control >> 5
+
+        if type_ == _POINTER:
+            length = ((control >> 3) & 0x3) + 1
+            value = _uint(buffer[offset:offset + length])
+            offset += length
+            if length < 4:
+                value = ((control & 0x7) << (8 * length)) | value
+            return (type_, self._pointer_base + value + _POINTER_BIAS[length], offset)
+
+        if type_ == _EXTENDED:
+            type_ = 7 + ord(buffer[offset:offset + 1])
+            offset += 1
+
+        size = control & 0x1F
+        if size >= 29:
+            length = size - 28
+            size = _SIZE_BIAS[length] + _uint(buffer[offset:offset + length])
+            offset += length
+
+        return (type_, size, offset)
+
+
+def pack_ip(ip):
+    """
+    :param ip:
+        A unicode string IPv4 or IPv6 address, or an integer, which is
+        treated as IPv4 if less than 2 ** 32
+
+    :raises:
+        ValueError - when the IP address is invalid
+
+    :return:
+        A byte string of 4 or 16 bytes
+    """
+
+    if isinstance(ip, int_types) and not isinstance(ip, bool):
+        if 0 <= ip < 0x100000000:
+            return binascii.unhexlify('%08x' % ip)
+        if 0 <= ip < 1 << 128:
+            return binascii.unhexlify('%032x' % ip)
+        raise ValueError('%s is not a valid IP address' % ip)
+
+    if not isinstance(ip, str_cls):
+        raise ValueError('IP address is not a string or integer')
+
+    try:
+        native_ip = str(ip)
+    except (UnicodeEncodeError):
+        raise ValueError('%s is not a valid IP address' % ip)
+
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            return socket.inet_pton(family, native_ip)
+        except (socket.error, ValueError):
+            pass
+    raise ValueError('%s is not a valid IP address' % ip)
+
+
+def _uint(data):
+    """
+    :param data:
+        A big-endian byte string
+
+    :return:
+        An integer
+    """
+
+    if not data:
+        return 0
+    return int(binascii.hexlify(data), 16)
+
+
+_METADATA_MARKER = b'\xab\xcd\xefMaxMind.com'
+_DATA_SECTION_SEPARATOR_SIZE = 16
+
+_EXTENDED = 0
+_POINTER = 1
+_UTF8_STRING = 2
+_DOUBLE = 3
+_BYTES = 4
+_UINT16 = 5
+_UINT32 = 6
+_MAP = 7
+_INT32 = 8
+_UINT64 = 9
+_UINT128 = 10
+_ARRAY = 11
+_BOOLEAN = 14
+_FLOAT = 15
+
+_UINT_TYPES = frozenset([_UINT16, _UINT32, _UINT64, _UINT128])
+
+# Indexed by the number of bytes following the control byte
+_POINTER_BIAS = (None, 0, 2048, 526336, 0)
+_SIZE_BIAS = (None, 29, 285, 65821)
+
+_UINT32_STRUCT = struct.Struct(str('>I'))
+_DOUBLE_STRUCT = struct.Struct(str('>d'))
+_FLOAT_STRUCT = struct.Struct(str('>f'))
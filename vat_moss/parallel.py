@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import multiprocessing
+from collections import deque
+
+from . import phone_number, streaming
+# Only imported for their side effect of building their indexes at import,
+# so the parent process builds them once before forking the workers
+from . import billing_address, geoip2  # noqa: F401
+
+
+def map_rows(func, rows, workers=None, chunk_size=1000, **kwargs):
+    """
+    Runs a row processing function, such as
+    vat_moss.billing_address.calculate_rate_rows() or
+    vat_moss.phone_number.calculate_rate_rows(), over a process pool. The
+    input is split into chunks that are processed concurrently and the
+    results are yielded in the same order as the input.
+
+    The lookup tables are built in the parent process before the pool is
+    started so that on platforms that fork, workers inherit them rather than
+    each building their own or having them pickled with every chunk. Only
+    a bounded number of chunks are in flight at once, so memory use does not
+    depend on the number of rows.
+
+    :param func:
+        A module-level function that accepts an iterable of dicts as its first
+        argument and returns an iterable of dicts
+
+    :param rows:
+        An iterable of dicts
+
+    :param workers:
+        The integer number of worker processes, defaults to the number of CPUs
+
+    :param chunk_size:
+        The integer number of rows to send to a worker at a time
+
+    :param kwargs:
+        Keyword arguments to pass to func, which must be picklable
+
+    :raises:
+        ValueError - when workers is less than 1
+
+    :return:
+        A generator of the dicts returned by func
+    """
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers < 1:
+        raise ValueError('The number of workers must be at least 1')
+
+    _load_tables()
+
+    pool = context().Pool(workers)
+    try:
+        pending = deque()
+        for chunk in streaming.chunks(rows, chunk_size):
+            pending.append(pool.apply_async(_map_chunk, (func, chunk, kwargs)))
+            if len(pending) >= workers * 2:
+                for row in pending.popleft().get():
+                    yield row
+
+        while pending:
+            for row in pending.popleft().get():
+                yield row
+
+        pool.close()
+
+    except (BaseException):
+        pool.terminate()
+        raise
+
+    finally:
+        pool.join()
+
+
+def _map_chunk(func, chunk, kwargs):
+    """
+    Runs in a worker process to apply a row processing function to a chunk
+
+    :param func:
+        The function passed to map_rows()
+
+    :param chunk:
+        A list of dicts
+
+    :param kwargs:
+        A dict of keyword arguments for func
+
+    :return:
+        A list of dicts
+    """
+
+    return list(func(chunk, **kwargs))
+
+
+def _load_tables():
+    """
+    Builds the lazily-constructed lookup tables so they are shared with
+    forked worker processes. The billing_address and geoip2 tables are built
+    when those modules are imported. The phone number trie is not built when
+    a table from vat_moss.phone_number.load_table() is in use.
+    """
+
+    if phone_number._table is None:
+        phone_number._trie()
+    phone_number._key_lengths()
+
+
+def context():
+    """
+    Returns the multiprocessing context used for worker processes. Forking
+    lets workers share the lookup tables and databases loaded by the parent.
+
+    :return:
+        The multiprocessing fork context where available, otherwise the
+        multiprocessing module, which forks on Python 2 on posix platforms
+    """
+
+    get_context = getattr(multiprocessing, 'get_context', None)
+    if get_context is None:
+        return multiprocessing
+    try:
+        return get_context('fork')
+    except (ValueError):
+        # Windows does not support fork, so workers build their own tables
+        return get_context()
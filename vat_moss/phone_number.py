@@ -1,18 +1,27 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-import re
+import hashlib
+import json
+import mmap
+import os
+import struct
+import unicodedata
 from decimal import Decimal
 
 try:
     # Python 2
     str_cls = unicode
+    from itertools import izip as zip
 except (NameError):
     # Python 3
     str_cls = str
+    unichr = chr
 
-from . import rates
+from . import rates, streaming
+from .cache import LRUCache
 from .errors import UndefinitiveError
+from .instrumentation import Instrumentation, timer
 
 
 def calculate_rate(phone_number, address_country_code=None, address_exception=None):
@@ -20,7 +29,7 @@ def calculate_rate(phone_number, address_country_code=None, address_exception=No
     Calculates the VAT rate based on a telephone number
 
     :param phone_number:
-        The string phone number, in international format with leading +
+        The string phone number, in international format with leading + or 00
 
     :param address_country_code:
         The user's country_code, as detected from billing_address or
@@ -40,47 +49,671 @@ def calculate_rate(phone_number, address_country_code=None, address_exception=No
         A tuple of (Decimal percentage rate, country code, exception name [or None])
     """
 
+    instrumentation = _instrumentation
+    if instrumentation is not None:
+        start = timer()
+
+    try:
+        phone_number = _normalize(phone_number)
+
+        country_code, exceptions = _lookup(phone_number)
+        if instrumentation is not None:
+            _count_lookup(instrumentation, country_code)
+        if not country_code:
+            raise ValueError('Phone number does not appear to be a valid international phone number')
+
+        return _calculate_rate(country_code, exceptions, address_country_code, address_exception)
+
+    finally:
+        if instrumentation is not None:
+            instrumentation.increment('calls')
+            instrumentation.observe(timer() - start)
+
+
+def calculate_rates(phone_numbers, address_country_codes=None, address_exceptions=None):
+    """
+    Calculates the VAT rates for a batch of telephone numbers. Numbers whose
+    lookups depend on the same leading digits, such as those from the same
+    area code in most countries, are only looked up once.
+
+    :param phone_numbers:
+        An iterable of string phone numbers, in international format with
+        leading + or 00
+
+    :param address_country_codes:
+        None, or an iterable parallel to phone_numbers of the users'
+        country_codes, as detected from billing_address or declared_residence
+
+    :param address_exceptions:
+        None, or an iterable parallel to phone_numbers of the users'
+        exception names, as detected from billing_address or
+        declared_residence
+
+    :raises:
+        ValueError - if address_country_codes or address_exceptions is not the same length as phone_numbers
+
+    :return:
+        A tuple of four lists parallel to phone_numbers: (Decimal percentage
+        rates, country codes, exception names, errors). For each number that
+        calculate_rate() would raise a ValueError or UndefinitiveError for,
+        the rate, country code and exception name are None and the exception
+        object is placed in errors. Otherwise the error is None.
+    """
+
+    result_rates = []
+    result_country_codes = []
+    result_exception_names = []
+    result_errors = []
+
+    columns = streaming.zip_columns([
+        ('phone_numbers', phone_numbers),
+        ('address_country_codes', address_country_codes),
+        ('address_exceptions', address_exceptions),
+    ])
+
+    instrumentation = _instrumentation
+    lookups = {}
+    for phone_number, address_country_code, address_exception in columns:
+        if instrumentation is not None:
+            start = timer()
+
+        phone_number, error = normalize(phone_number)
+        if error:
+            rate, country_code, exception_name = (None, None, None)
+            error = ValueError(error)
+
+        else:
+            try:
+                prefix = _cache_key(phone_number)
+                lookup = lookups.get(prefix)
+                if lookup is None:
+                    lookup = _lookup(prefix)
+                    if len(lookups) < _BATCH_LOOKUPS_MAXSIZE:
+                        lookups[prefix] = lookup
+                    if instrumentation is not None:
+                        instrumentation.increment('batch_prefix_misses')
+                elif instrumentation is not None:
+                    instrumentation.increment('batch_prefix_hits')
+                country_code, exceptions = lookup
+                if instrumentation is not None:
+                    _count_lookup(instrumentation, country_code)
+
+                if not country_code:
+                    raise ValueError('Phone number does not appear to be a valid international phone number')
+
+                rate, country_code, exception_name = _calculate_rate(
+                    country_code,
+                    exceptions,
+                    address_country_code,
+                    address_exception
+                )
+
+            except (ValueError) as e:
+                rate, country_code, exception_name = (None, None, None)
+                error = e
+
+        result_rates.append(rate)
+        result_country_codes.append(country_code)
+        result_exception_names.append(exception_name)
+        result_errors.append(error)
+
+        if instrumentation is not None:
+            instrumentation.observe(timer() - start)
+
+    return (result_rates, result_country_codes, result_exception_names, result_errors)
+
+
+def calculate_rate_rows(rows, phone_number_field='phone_number', address_country_code_field=None,
+                        address_exception_field=None, chunk_size=1000):
+    """
+    Lazily calculates the VAT rate for each row from an iterable of dicts,
+    such as from vat_moss.streaming.read_rows(). Rows are processed in chunks
+    with calculate_rates(), so only one chunk is held in memory at a time.
+
+    :param rows:
+        An iterable of dicts
+
+    :param phone_number_field:
+        The unicode string key of the phone number in each row
+
+    :param address_country_code_field:
+        None, or the unicode string key of the user's address country code
+
+    :param address_exception_field:
+        None, or the unicode string key of the user's address exception name
+
+    :param chunk_size:
+        The integer number of rows to process at a time
+
+    :return:
+        A generator of copies of the rows, with the added keys "vat_rate",
+        "vat_country_code", "vat_exception_name" and "vat_error", the values of
+        which are the columns returned by calculate_rates()
+    """
+
+    for chunk in streaming.chunks(rows, chunk_size):
+        address_country_codes = None
+        if address_country_code_field is not None:
+            address_country_codes = [row.get(address_country_code_field) or None for row in chunk]
+
+        address_exceptions = None
+        if address_exception_field is not None:
+            address_exceptions = [row.get(address_exception_field) or None for row in chunk]
+
+        columns = calculate_rates(
+            [row.get(phone_number_field) for row in chunk],
+            address_country_codes,
+            address_exceptions
+        )
+
+        for row, result in zip(chunk, zip(*columns)):
+            row = dict(row)
+            row['vat_rate'], row['vat_country_code'], row['vat_exception_name'], row['vat_error'] = result
+            yield row
+
+
+def compile_table(path):
+    """
+    Compiles CALLING_CODE_MAPPING and CALLING_CODE_EXCEPTIONS from
+    vat_moss.calling_codes into a compact binary prefix table that can be
+    loaded with load_table(). setup.py runs this when the package is built,
+    and it may also be run as a deployment step, e.g. via
+    "python -m vat_moss compile_phone_table".
+
+    :param path:
+        A unicode string filesystem path to write the table to
+    """
+
+    strings = []
+    string_ids = {}
+
+    def string_id(value):
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    # Nodes are numbered breadth-first so the root is always 0, which allows
+    # 0 to represent a missing child
+    nodes = [_trie()]
+    position = 0
+    while position < len(nodes):
+        node = nodes[position]
+        for digit in sorted(node['children']):
+            nodes.append(node['children'][digit])
+        position += 1
+    node_ids = dict((id(node), index) for index, node in enumerate(nodes))
+
+    exception_records = []
+    node_records = []
+    for node in nodes:
+        children = [0] * 10
+        for digit, child in node['children'].items():
+            children[int(digit)] = node_ids[id(child)]
+
+        country_id = _NONE_ID
+        if node['country_code'] is not None:
+            country_id = string_id(node['country_code'])
+
+        exceptions_start = len(exception_records)
+        for owner, index, info in node['exceptions']:
+            exception_records.append(_EXCEPTION_RECORD.pack(
+                string_id(owner),
+                index,
+                string_id(info['regex']),
+                string_id(info['country_code']),
+                string_id(info['name']),
+                1 if info['definitive'] else 0
+            ))
+
+        node_records.append(_NODE_RECORD.pack(*(
+            children + [country_id, exceptions_start, len(exception_records) - exceptions_start]
+        )))
+
+    string_blob = b''.join(
+        _STRING_LENGTH.pack(len(value.encode('utf-8'))) + value.encode('utf-8') for value in strings
+    )
+
+    key_lengths = _build_key_lengths(nodes[0])
+    key_lengths_blob = bytes(bytearray(
+        key_lengths['%0*d' % (_KEY_PREFIX_LENGTH, number)] for number in range(10 ** _KEY_PREFIX_LENGTH)
+    ))
+
+    header = _TABLE_HEADER.pack(
+        _TABLE_MAGIC,
+        _TABLE_VERSION,
+        _KEY_PREFIX_LENGTH,
+        len(strings),
+        len(string_blob),
+        len(exception_records),
+        len(node_records),
+        _data_fingerprint()
+    )
+
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.write(key_lengths_blob)
+        f.write(string_blob)
+        f.write(b''.join(exception_records))
+        f.write(b''.join(node_records))
+
+
+def load_table(path):
+    """
+    Memory-maps a table written by compile_table() and uses it for all
+    subsequent lookups instead of the in-memory trie, or the table generated
+    when the package was built. Since the file is mapped read-only, all
+    processes that load the same file share one physical copy of it.
+
+    :param path:
+        A unicode string filesystem path of the table
+
+    :raises:
+        ValueError - when the file is not a table, or was compiled from a different version of vat_moss.calling_codes
+    """
+
+    global _table
+
+    _table = _MappedTable(path)
+
+
+def unload_table():
+    """
+    Stops using a table loaded with load_table(), or the one generated when
+    the package was built, reverting to the in-memory trie
+    """
+
+    global _table
+
+    _table = None
+
+
+def enable_cache(maxsize=10000):
+    """
+    Starts caching lookups in a least-recently-used cache. Since only the
+    first few digits of a phone number determine the result, the cache is
+    keyed on the digits the lookup can depend on rather than the whole
+    number, so that numbers from the same area share an entry. The address
+    arguments are not part of the key since they are applied after the
+    cached lookup.
+
+    Any existing cache is discarded.
+
+    :param maxsize:
+        The integer maximum number of prefixes to cache
+
+    :raises:
+        ValueError - when maxsize is less than 1
+    """
+
+    global _cache
+
+    _cache = LRUCache(maxsize)
+
+
+def disable_cache():
+    """
+    Stops caching lookups and discards the cache
+    """
+
+    global _cache
+
+    _cache = None
+
+
+def cache_stats():
+    """
+    :return:
+        None if the cache is not enabled, otherwise a dict in the format
+        returned by vat_moss.cache.LRUCache.stats()
+    """
+
+    cache = _cache
+    if cache is None:
+        return None
+    return cache.stats()
+
+
+def enable_instrumentation(buckets=None):
+    """
+    Starts recording statistics about lookups, which can be retrieved with
+    instrumentation_stats(). Any statistics already recorded are discarded.
+
+    The counters recorded are:
+
+     - "calls": calls to calculate_rate()
+     - "lookups": phone numbers looked up by calculate_rate() and
+       calculate_rates(), whether or not the result came from a cache
+     - "invalid": lookups that did not match any calling code
+     - "nodes_visited": the number of prefix table nodes walked by lookups
+       that were not served from a cache
+     - "exceptions_checked": CALLING_CODE_EXCEPTIONS entries found along
+       those walks that were tested against the matched country code
+     - "cache_hits" and "cache_misses": lookups served from the cache from
+       enable_cache(), or not
+     - "batch_prefix_hits" and "batch_prefix_misses": numbers in a call to
+       calculate_rates() that shared the lookup of an earlier number with
+       the same leading digits, or not
+
+    "lookups", "nodes_visited" and "exceptions_checked" are also broken down
+    by the country code that was matched. The histogram records the elapsed
+    time of each call to calculate_rate(), and of each phone number processed
+    by calculate_rates().
+
+    :param buckets:
+        An iterable of float upper bounds, in seconds, for the histogram, or
+        None for vat_moss.instrumentation.DEFAULT_BUCKETS
+    """
+
+    global _instrumentation
+
+    _instrumentation = Instrumentation(buckets)
+
+
+def disable_instrumentation():
+    """
+    Stops recording statistics about lookups
+    """
+
+    global _instrumentation
+
+    _instrumentation = None
+
+
+def instrumentation_stats():
+    """
+    :return:
+        None if instrumentation is not enabled, otherwise a dict in the format
+        returned by vat_moss.instrumentation.Instrumentation.snapshot()
+    """
+
+    instrumentation = _instrumentation
+    if instrumentation is None:
+        return None
+    return instrumentation.snapshot()
+
+
+class PhoneNumberCursor(object):
+
+    """
+    Incrementally resolves a phone number as it is typed, one character at a
+    time. Each call to push() or pop() only does a constant amount of work,
+    and result() returns the same value calculate_rate() would for all of
+    the characters pushed so far.
+
+    After each change, status is one of:
+
+     - "ambiguous": more digits may still change the result, see candidates
+     - "resolved": the result is known, see result()
+     - "undefinitive": more address information is necessary, as with the
+       UndefinitiveError from calculate_rate()
+     - "invalid": no further input will produce a valid phone number
+    """
+
+    def __init__(self, address_country_code=None, address_exception=None):
+        """
+        :param address_country_code:
+            The user's country_code, as detected from billing_address or
+            declared_residence
+
+        :param address_exception:
+            The user's exception name, as detected from billing_address or
+            declared_residence
+        """
+
+        self.address_country_code = address_country_code
+        self.address_exception = address_exception
+
+        # Each state is a tuple of (number of characters pushed, the
+        # international prefix characters kept by normalization, number of
+        # digits after the prefix, current trie node or None, deepest matched
+        # country code, tuple of exception candidates)
+        self._states = [(0, '', 0, _trie(), None, ())]
+
+    def push(self, chars):
+        """
+        Adds one or more characters to the end of the phone number
+
+        :param chars:
+            A unicode string of the characters typed
+
+        :return:
+            The new status
+        """
+
+        for char in chars:
+            pushed, prefix, digits, node, country_code, candidates = self._states[-1]
+            pushed += 1
+
+            char = char.translate(_NORMALIZATION_TABLE)
+            if char:
+                if prefix in _PARTIAL_PREFIXES:
+                    prefix += char
+                else:
+                    digits += 1
+                    # Any + after the prefix means the number can not match
+                    # the trie
+                    if node is not None:
+                        node = node['children'].get(char)
+                        if node is not None:
+                            if node['country_code'] is not None:
+                                country_code = node['country_code']
+                            if node['exceptions']:
+                                candidates = candidates + tuple(node['exceptions'])
+
+            self._states.append((pushed, prefix, digits, node, country_code, candidates))
+
+        return self.status
+
+    def pop(self):
+        """
+        Removes the last character pushed, such as when the user presses
+        backspace
+
+        :return:
+            The new status
+        """
+
+        if len(self._states) > 1:
+            self._states.pop()
+        return self.status
+
+    @property
+    def status(self):
+        """
+        :return:
+            A unicode string of "ambiguous", "resolved", "undefinitive" or
+            "invalid"
+        """
+
+        pushed, prefix, digits, node, country_code, candidates = self._states[-1]
+
+        if prefix in _PARTIAL_PREFIXES:
+            return 'ambiguous'
+
+        if prefix not in _INTERNATIONAL_PREFIXES:
+            return 'invalid'
+
+        if not digits or (node is not None and node['children']):
+            return 'ambiguous'
+
+        if country_code is None:
+            return 'invalid'
+
+        try:
+            self.result()
+        except (UndefinitiveError):
+            return 'undefinitive'
+        return 'resolved'
+
+    @property
+    def candidates(self):
+        """
+        :return:
+            A set of the two-character country codes the phone number may
+            still resolve to
+        """
+
+        node, country_code = self._states[-1][3:5]
+
+        if self.status == 'invalid':
+            return set()
+
+        codes = set()
+        if country_code is not None:
+            codes.add(country_code)
+        if node is not None:
+            codes.update(node['candidates'])
+        return codes
+
+    def result(self):
+        """
+        Calculates the VAT rate based on the characters pushed so far
+
+        :raises:
+            ValueError - error with phone number provided
+            UndefinitiveError - when no address_country_code and address_exception are provided and the phone number area code matching isn't specific enough
+
+        :return:
+            A tuple of (Decimal percentage rate, country code, exception name [or None])
+        """
+
+        pushed, prefix, digits, node, country_code, candidates = self._states[-1]
+
+        if not pushed:
+            raise ValueError('No phone number provided')
+
+        if prefix not in _INTERNATIONAL_PREFIXES:
+            raise ValueError('Phone number is not in international format with a leading +')
+
+        if not digits:
+            raise ValueError('Phone number does not appear to contain any digits')
+
+        if not country_code:
+            raise ValueError('Phone number does not appear to be a valid international phone number')
+
+        exceptions = _filter_exceptions(country_code, list(candidates))
+        return _calculate_rate(country_code, exceptions, self.address_country_code, self.address_exception)
+
+
+def normalize(phone_number):
+    """
+    Removes formatting from a phone number in a single pass, converting any
+    Unicode decimal digits to ASCII, and strips the international prefix.
+    Unlike calculate_rate(), invalid phone numbers are reported instead of
+    raising an exception.
+
+    :param phone_number:
+        The string phone number, in international format with leading + or 00
+
+    :return:
+        A 2-element tuple of (unicode string of the digits following the
+        international prefix or None, unicode string error message or None)
+    """
+
     if not phone_number:
-        raise ValueError('No phone number provided')
+        return (None, 'No phone number provided')
 
     if not isinstance(phone_number, str_cls):
-        raise ValueError('Phone number is not a string')
+        return (None, 'Phone number is not a string')
 
-    phone_number = phone_number.strip()
-    phone_number = re.sub('[^+0-9]', '', phone_number)
+    phone_number = phone_number.translate(_NORMALIZATION_TABLE)
 
-    if not phone_number or phone_number[0] != '+':
-        raise ValueError('Phone number is not in international format with a leading +')
-
-    phone_number = phone_number[1:]
+    if phone_number[0:1] == '+':
+        phone_number = phone_number[1:]
+    elif phone_number[0:2] == '00':
+        phone_number = phone_number[2:]
+    else:
+        return (None, 'Phone number is not in international format with a leading +')
 
     if not phone_number:
-        raise ValueError('Phone number does not appear to contain any digits')
+        return (None, 'Phone number does not appear to contain any digits')
 
-    country_code = _lookup_country_code(phone_number)
-    if not country_code:
-        raise ValueError('Phone number does not appear to be a valid international phone number')
+    return (phone_number, None)
 
-    if country_code in CALLING_CODE_EXCEPTIONS:
-        for info in CALLING_CODE_EXCEPTIONS[country_code]:
-            if not re.match(info['regex'], phone_number):
-                continue
 
-            mapped_country = info['country_code']
-            mapped_name = info['name']
+def _normalize(phone_number):
+    """
+    Removes formatting from a phone number and strips the international prefix
+
+    :param phone_number:
+        The string phone number, in international format with leading + or 00
+
+    :raises:
+        ValueError - error with phone number provided
+
+    :return:
+        A unicode string of the digits of the phone number
+    """
+
+    phone_number, error = normalize(phone_number)
+    if error:
+        raise ValueError(error)
+    return phone_number
+
 
-            if not info['definitive']:
-                if address_country_code is None:
-                    raise UndefinitiveError('It is not possible to determine the users VAT rates based on the information provided')
+class _NormalizationTable(dict):
 
-                if address_country_code != mapped_country:
-                    continue
+    """
+    A translation table for unicode.translate() that keeps + and converts
+    all Unicode decimal digits to ASCII, removing every other character.
+    Entries are computed on first use; only ASCII and digits are stored so
+    the table stays small when fed arbitrary text.
+    """
+
+    def __missing__(self, ordinal):
+        char = unichr(ordinal)
+        if char == '+':
+            value = '+'
+        else:
+            digit = unicodedata.decimal(char, None)
+            value = None if digit is None else str_cls(digit)
+        if ordinal < 128 or value is not None:
+            self[ordinal] = value
+        return value
+
+
+def _calculate_rate(country_code, exceptions, address_country_code, address_exception):
+    """
+    Determines the VAT rate from the result of _lookup()
+
+    :param country_code:
+        The two-character country code the calling code belongs to
+
+    :param exceptions:
+        A list of dicts from CALLING_CODE_EXCEPTIONS that matched the number
+
+    :param address_country_code:
+        The user's country_code, as detected from billing_address or
+        declared_residence
+
+    :param address_exception:
+        The user's exception name, as detected from billing_address or
+        declared_residence
+
+    :raises:
+        UndefinitiveError - when no address_country_code is provided and a non-definitive exception matched
+
+    :return:
+        A tuple of (Decimal percentage rate, country code, exception name [or None])
+    """
 
-                if address_exception != info['name']:
-                    continue
+    for info in exceptions:
+        mapped_country = info['country_code']
+        mapped_name = info['name']
 
-            rate = rates.BY_COUNTRY[mapped_country]['exceptions'][mapped_name]
-            return (rate, mapped_country, mapped_name)
+        if not info['definitive']:
+            if address_country_code is None:
+                raise UndefinitiveError('It is not possible to determine the users VAT rates based on the information provided')
+
+            if address_country_code != mapped_country:
+                continue
+
+            if address_exception != info['name']:
+                continue
+
+        rate = rates.BY_COUNTRY[mapped_country]['exceptions'][mapped_name]
+        return (rate, mapped_country, mapped_name)
 
     if country_code not in rates.BY_COUNTRY:
         return (Decimal('0.0'), country_code, None)
@@ -100,1151 +733,643 @@ def _lookup_country_code(phone_number):
         A two-character string or None if no match
     """
 
-    leading_digit = phone_number[0]
+    return _lookup(phone_number)[0]
 
-    if leading_digit not in CALLING_CODE_MAPPING:
-        return None
 
-    for mapping in CALLING_CODE_MAPPING[leading_digit]:
-        if not re.match(mapping['regex'], phone_number):
-            continue
-        return mapping['country_code']
-
-    return None
-
-
-# A list of regular expressions to map against an internation phone number that
-# has had the leading + stripped off.
-#
-# The mapping is in the form:
-#
-# {
-#     digit: [
-#         {
-#             'regex': regex,
-#             'country_code': two character country code
-#         }
-#     ]
-# }
-#
-# The values are a list so that more specific regexes will be matched first.
-# This is necessary since sometimes multiple countries use the same
-# international calling code prefix.
-CALLING_CODE_MAPPING = {
-    '1': [
-        {
-            'regex': '1(204|226|236|249|250|289|306|343|365|387|403|416|418|431|437|438|450|506|514|519|548|579|581|587|600|604|613|622|633|639|644|647|655|672|677|688|705|709|742|778|780|782|807|819|825|867|873|902|905)',
-            'country_code': 'CA'
-        },
-        {
-            'regex': '1268',
-            'country_code': 'AG'
-        },
-        {
-            'regex': '1264',
-            'country_code': 'AI'
-        },
-        {
-            'regex': '1684',
-            'country_code': 'AS'
-        },
-        {
-            'regex': '1246',
-            'country_code': 'BB'
-        },
-        {
-            'regex': '1441',
-            'country_code': 'BM'
-        },
-        {
-            'regex': '1242',
-            'country_code': 'BS'
-        },
-        {
-            'regex': '1767',
-            'country_code': 'DM'
-        },
-        {
-            'regex': '1(809|829|849)',
-            'country_code': 'DO'
-        },
-        {
-            'regex': '1473',
-            'country_code': 'GD'
-        },
-        {
-            'regex': '1671',
-            'country_code': 'GU'
-        },
-        {
-            'regex': '1876',
-            'country_code': 'JM'
-        },
-        {
-            'regex': '1869',
-            'country_code': 'KN'
-        },
-        {
-            'regex': '1345',
-            'country_code': 'KY'
-        },
-        {
-            'regex': '1758',
-            'country_code': 'LC'
-        },
-        {
-            'regex': '1670',
-            'country_code': 'MP'
-        },
-        {
-            'regex': '1664',
-            'country_code': 'MS'
-        },
-        {
-            'regex': '1(939|787)',
-            'country_code': 'PR'
-        },
-        {
-            'regex': '1721',
-            'country_code': 'SX'
-        },
-        {
-            'regex': '1649',
-            'country_code': 'TC'
-        },
-        {
-            'regex': '1868',
-            'country_code': 'TT'
-        },
-        {
-            'regex': '1784',
-            'country_code': 'VC'
-        },
-        {
-            'regex': '1284',
-            'country_code': 'VG'
-        },
-        {
-            'regex': '1340',
-            'country_code': 'VI'
-        },
-        {
-            'regex': '1',
-            'country_code': 'US'
-        }
-    ],
-    '2': [
-        {
-            'regex': '20',
-            'country_code': 'EG'
-        },
-        {
-            'regex': '211',
-            'country_code': 'SS'
-        },
-        {
-            'regex': '212(5288|5289)',
-            'country_code': 'EH'
-        },
-        {
-            'regex': '212',
-            'country_code': 'MA'
-        },
-        {
-            'regex': '213',
-            'country_code': 'DZ'
-        },
-        {
-            'regex': '216',
-            'country_code': 'TN'
-        },
-        {
-            'regex': '218',
-            'country_code': 'LY'
-        },
-        {
-            'regex': '220',
-            'country_code': 'GM'
-        },
-        {
-            'regex': '221',
-            'country_code': 'SN'
-        },
-        {
-            'regex': '222',
-            'country_code': 'MR'
-        },
-        {
-            'regex': '223',
-            'country_code': 'ML'
-        },
-        {
-            'regex': '224',
-            'country_code': 'GN'
-        },
-        {
-            'regex': '225',
-            'country_code': 'CI'
-        },
-        {
-            'regex': '226',
-            'country_code': 'BF'
-        },
-        {
-            'regex': '227',
-            'country_code': 'NE'
-        },
-        {
-            'regex': '228',
-            'country_code': 'TG'
-        },
-        {
-            'regex': '229',
-            'country_code': 'BJ'
-        },
-        {
-            'regex': '230',
-            'country_code': 'MU'
-        },
-        {
-            'regex': '231',
-            'country_code': 'LR'
-        },
-        {
-            'regex': '232',
-            'country_code': 'SL'
-        },
-        {
-            'regex': '233',
-            'country_code': 'GH'
-        },
-        {
-            'regex': '234',
-            'country_code': 'NG'
-        },
-        {
-            'regex': '235',
-            'country_code': 'TD'
-        },
-        {
-            'regex': '236',
-            'country_code': 'CF'
-        },
-        {
-            'regex': '237',
-            'country_code': 'CM'
-        },
-        {
-            'regex': '238',
-            'country_code': 'CV'
-        },
-        {
-            'regex': '239',
-            'country_code': 'ST'
-        },
-        {
-            'regex': '240',
-            'country_code': 'GQ'
-        },
-        {
-            'regex': '241',
-            'country_code': 'GA'
-        },
-        {
-            'regex': '242',
-            'country_code': 'CG'
-        },
-        {
-            'regex': '243',
-            'country_code': 'CD'
-        },
-        {
-            'regex': '244',
-            'country_code': 'AO'
-        },
-        {
-            'regex': '245',
-            'country_code': 'GW'
-        },
-        {
-            'regex': '246',
-            'country_code': 'IO'
-        },
-        {
-            'regex': '247',
-            'country_code': 'AC'
-        },
-        {
-            'regex': '248',
-            'country_code': 'SC'
-        },
-        {
-            'regex': '249',
-            'country_code': 'SD'
-        },
-        {
-            'regex': '250',
-            'country_code': 'RW'
-        },
-        {
-            'regex': '251',
-            'country_code': 'ET'
-        },
-        {
-            'regex': '252',
-            'country_code': 'SO'
-        },
-        {
-            'regex': '253',
-            'country_code': 'DJ'
-        },
-        {
-            'regex': '254',
-            'country_code': 'KE'
-        },
-        {
-            'regex': '255',
-            'country_code': 'TZ'
-        },
-        {
-            'regex': '256',
-            'country_code': 'UG'
-        },
-        {
-            'regex': '257',
-            'country_code': 'BI'
-        },
-        {
-            'regex': '258',
-            'country_code': 'MZ'
-        },
-        {
-            'regex': '260',
-            'country_code': 'ZM'
-        },
-        {
-            'regex': '261',
-            'country_code': 'MG'
-        },
-        {
-            'regex': '262269',
-            'country_code': 'YT'
-        },
-        {
-            'regex': '262',
-            'country_code': 'RE'
-        },
-        {
-            'regex': '263',
-            'country_code': 'ZW'
-        },
-        {
-            'regex': '264',
-            'country_code': 'NA'
-        },
-        {
-            'regex': '265',
-            'country_code': 'MW'
-        },
-        {
-            'regex': '266',
-            'country_code': 'LS'
-        },
-        {
-            'regex': '267',
-            'country_code': 'BW'
-        },
-        {
-            'regex': '268',
-            'country_code': 'SZ'
-        },
-        {
-            'regex': '269',
-            'country_code': 'KM'
-        },
-        {
-            'regex': '27',
-            'country_code': 'ZA'
-        },
-        {
-            'regex': '290',
-            'country_code': 'SH'
-        },
-        {
-            'regex': '291',
-            'country_code': 'ER'
-        },
-        {
-            'regex': '297',
-            'country_code': 'AW'
-        },
-        {
-            'regex': '298',
-            'country_code': 'FO'
-        },
-        {
-            'regex': '299',
-            'country_code': 'GL'
-        }
-    ],
-    '3': [
-        {
-            'regex': '30',
-            'country_code': 'GR'
-        },
-        {
-            'regex': '31',
-            'country_code': 'NL'
-        },
-        {
-            'regex': '32',
-            'country_code': 'BE'
-        },
-        {
-            'regex': '33',
-            'country_code': 'FR'
-        },
-        {
-            'regex': '34',
-            'country_code': 'ES'
-        },
-        {
-            'regex': '350',
-            'country_code': 'GI'
-        },
-        {
-            'regex': '351',
-            'country_code': 'PT'
-        },
-        {
-            'regex': '352',
-            'country_code': 'LU'
-        },
-        {
-            'regex': '353',
-            'country_code': 'IE'
-        },
-        {
-            'regex': '354',
-            'country_code': 'IS'
-        },
-        {
-            'regex': '355',
-            'country_code': 'AL'
-        },
-        {
-            'regex': '356',
-            'country_code': 'MT'
-        },
-        {
-            'regex': '357',
-            'country_code': 'CY'
-        },
-        {  # Åland Islands (to exclude from FI)
-            'regex': '35818',
-            'country_code': 'AX'
-        },
-        {
-            'regex': '358',
-            'country_code': 'FI'
-        },
-        {
-            'regex': '359',
-            'country_code': 'BG'
-        },
-        {
-            'regex': '36',
-            'country_code': 'HU'
-        },
-        {
-            'regex': '370',
-            'country_code': 'LT'
-        },
-        {
-            'regex': '371',
-            'country_code': 'LV'
-        },
-        {
-            'regex': '372',
-            'country_code': 'EE'
-        },
-        {
-            'regex': '373',
-            'country_code': 'MD'
-        },
-        {
-            'regex': '374',
-            'country_code': 'AM'
-        },
-        {
-            'regex': '375',
-            'country_code': 'BY'
-        },
-        {
-            'regex': '376',
-            'country_code': 'AD'
-        },
-        {
-            'regex': '377(44|45)',
-            'country_code': 'XK'
-        },
-        {
-            'regex': '377',
-            'country_code': 'MC'
-        },
-        {
-            'regex': '378',
-            'country_code': 'SM'
-        },
-        {
-            'regex': '379',
-            'country_code': 'VA'
-        },
-        {
-            'regex': '380',
-            'country_code': 'UA'
-        },
-        {
-            'regex': '381(28|29|38|39)',
-            'country_code': 'XK'
-        },
-        {
-            'regex': '381',
-            'country_code': 'RS'
-        },
-        {
-            'regex': '382',
-            'country_code': 'ME'
-        },
-        {
-            'regex': '383',
-            'country_code': 'XK'
-        },
-        {
-            'regex': '385',
-            'country_code': 'HR'
-        },
-        {
-            'regex': '386(43|49)',
-            'country_code': 'XK'
-        },
-        {
-            'regex': '386',
-            'country_code': 'SI'
-        },
-        {
-            'regex': '387',
-            'country_code': 'BA'
-        },
-        {
-            'regex': '389',
-            'country_code': 'MK'
-        },
-        {
-            'regex': '3906698',
-            'country_code': 'VA'
-        },
-        {
-            'regex': '39',
-            'country_code': 'IT'
-        }
-    ],
-    '4': [
-        {
-            'regex': '40',
-            'country_code': 'RO'
-        },
-        {
-            'regex': '41',
-            'country_code': 'CH'
-        },
-        {
-            'regex': '420',
-            'country_code': 'CZ'
-        },
-        {
-            'regex': '421',
-            'country_code': 'SK'
-        },
-        {
-            'regex': '423',
-            'country_code': 'LI'
-        },
-        {
-            'regex': '43',
-            'country_code': 'AT'
-        },
-        {  # Guernsey (to exclude from GB)
-            'regex': '44(148|7781|7839|7911)',
-            'country_code': 'GG'
-        },
-        {  # Jersey (to exclude from GB)
-            'regex': '44(153|7509|7797|7937|7700|7829)',
-            'country_code': 'JE'
-        },
-        {  # Isle of Man
-            'regex': '44(162|7624|7524|7924)',
-            'country_code': 'IM'
-        },
-        {
-            'regex': '44',
-            'country_code': 'GB'
-        },
-        {
-            'regex': '45',
-            'country_code': 'DK'
-        },
-        {
-            'regex': '46',
-            'country_code': 'SE'
-        },
-        {
-            'regex': '47',
-            'country_code': 'NO'
-        },
-        {
-            'regex': '48',
-            'country_code': 'PL'
-        },
-        {
-            'regex': '49',
-            'country_code': 'DE'
-        }
-    ],
-    '5': [
-        {
-            'regex': '500',
-            'country_code': 'FK'
-        },
-        {
-            'regex': '501',
-            'country_code': 'BZ'
-        },
-        {
-            'regex': '502',
-            'country_code': 'GT'
-        },
-        {
-            'regex': '503',
-            'country_code': 'SV'
-        },
-        {
-            'regex': '504',
-            'country_code': 'HN'
-        },
-        {
-            'regex': '505',
-            'country_code': 'NI'
-        },
-        {
-            'regex': '506',
-            'country_code': 'CR'
-        },
-        {
-            'regex': '507',
-            'country_code': 'PA'
-        },
-        {
-            'regex': '508',
-            'country_code': 'PM'
-        },
-        {
-            'regex': '509',
-            'country_code': 'HT'
-        },
-        {
-            'regex': '51',
-            'country_code': 'PE'
-        },
-        {
-            'regex': '52',
-            'country_code': 'MX'
-        },
-        {
-            'regex': '53',
-            'country_code': 'CU'
-        },
-        {
-            'regex': '54',
-            'country_code': 'AR'
-        },
-        {
-            'regex': '55',
-            'country_code': 'BR'
-        },
-        {
-            'regex': '56',
-            'country_code': 'CL'
-        },
-        {
-            'regex': '57',
-            'country_code': 'CO'
-        },
-        {
-            'regex': '58',
-            'country_code': 'VE'
-        },
-        {
-            'regex': '590(590(51|52|58|77|87)|690(10|22|27|66|77|87|88))',
-            'country_code': 'MF'
-        },
-        {
-            'regex': '590590(27|29)',
-            'country_code': 'BL'
-        },
-        {
-            'regex': '590',
-            'country_code': 'GP'
-        },
-        {
-            'regex': '591',
-            'country_code': 'BO'
-        },
-        {
-            'regex': '592',
-            'country_code': 'GY'
-        },
-        {
-            'regex': '593',
-            'country_code': 'EC'
-        },
-        {
-            'regex': '594',
-            'country_code': 'GF'
-        },
-        {
-            'regex': '595',
-            'country_code': 'PY'
-        },
-        {
-            'regex': '596',
-            'country_code': 'MQ'
-        },
-        {
-            'regex': '597',
-            'country_code': 'SR'
-        },
-        {
-            'regex': '598',
-            'country_code': 'UY'
-        },
-        {
-            'regex': '5999',
-            'country_code': 'CW'
-        },
-        {
-            'regex': '599',
-            'country_code': 'BQ'
-        }
-    ],
-    '6': [
-        {
-            'regex': '60',
-            'country_code': 'MY'
-        },
-        {
-            'regex': '6189164',
-            'country_code': 'CX'
-        },
-        {
-            'regex': '6189162',
-            'country_code': 'CC'
-        },
-        {
-            'regex': '61',
-            'country_code': 'AU'
-        },
-        {
-            'regex': '62',
-            'country_code': 'ID'
-        },
-        {
-            'regex': '63',
-            'country_code': 'PH'
-        },
-        {
-            'regex': '64',
-            'country_code': 'NZ'
-        },
-        {
-            'regex': '65',
-            'country_code': 'SG'
-        },
-        {
-            'regex': '66',
-            'country_code': 'TH'
-        },
-        {
-            'regex': '670',
-            'country_code': 'TL'
-        },
-        {
-            'regex': '6723',
-            'country_code': 'NF'
-        },
-        {
-            'regex': '6721',
-            'country_code': 'AQ'
-        },
-        {
-            'regex': '673',
-            'country_code': 'BN'
-        },
-        {
-            'regex': '674',
-            'country_code': 'NR'
-        },
-        {
-            'regex': '675',
-            'country_code': 'PG'
-        },
-        {
-            'regex': '676',
-            'country_code': 'TO'
-        },
-        {
-            'regex': '677',
-            'country_code': 'SB'
-        },
-        {
-            'regex': '678',
-            'country_code': 'VU'
-        },
-        {
-            'regex': '679',
-            'country_code': 'FJ'
-        },
-        {
-            'regex': '680',
-            'country_code': 'PW'
-        },
-        {
-            'regex': '681',
-            'country_code': 'WF'
-        },
-        {
-            'regex': '682',
-            'country_code': 'CK'
-        },
-        {
-            'regex': '683',
-            'country_code': 'NU'
-        },
-        {
-            'regex': '685',
-            'country_code': 'WS'
-        },
-        {
-            'regex': '686',
-            'country_code': 'KI'
-        },
-        {
-            'regex': '687',
-            'country_code': 'NC'
-        },
-        {
-            'regex': '688',
-            'country_code': 'TV'
-        },
-        {
-            'regex': '689',
-            'country_code': 'PF'
-        },
-        {
-            'regex': '690',
-            'country_code': 'TK'
-        },
-        {
-            'regex': '691',
-            'country_code': 'FM'
-        },
-        {
-            'regex': '692',
-            'country_code': 'MH'
-        }
-    ],
-    '7': [
-        {
-            'regex': '7(840|940)',
-            'country_code': 'GE'
-        },
-        {
-            'regex': '7[3489]',
-            'country_code': 'RU'
-        },
-        {
-            'regex': '7[67]',
-            'country_code': 'KZ'
-        }
-    ],
-    '8': [
-        {
-            'regex': '81',
-            'country_code': 'JP'
-        },
-        {
-            'regex': '82',
-            'country_code': 'KR'
-        },
-        {
-            'regex': '84',
-            'country_code': 'VN'
-        },
-        {
-            'regex': '850',
-            'country_code': 'KP'
-        },
-        {
-            'regex': '852',
-            'country_code': 'HK'
-        },
-        {
-            'regex': '853',
-            'country_code': 'MO'
-        },
-        {
-            'regex': '855',
-            'country_code': 'KH'
-        },
-        {
-            'regex': '856',
-            'country_code': 'LA'
-        },
-        {
-            'regex': '86',
-            'country_code': 'CN'
-        },
-        {
-            'regex': '880',
-            'country_code': 'BD'
-        },
-        {
-            'regex': '886',
-            'country_code': 'TW'
-        }
-    ],
-    '9': [
-        {
-            'regex': '90',
-            'country_code': 'TR'
-        },
-        {
-            'regex': '91',
-            'country_code': 'IN'
-        },
-        {
-            'regex': '92',
-            'country_code': 'PK'
-        },
-        {
-            'regex': '93',
-            'country_code': 'AF'
-        },
-        {
-            'regex': '94',
-            'country_code': 'LK'
-        },
-        {
-            'regex': '95',
-            'country_code': 'MM'
-        },
-        {
-            'regex': '960',
-            'country_code': 'MV'
-        },
-        {
-            'regex': '961',
-            'country_code': 'LB'
-        },
-        {
-            'regex': '962',
-            'country_code': 'JO'
-        },
-        {
-            'regex': '963',
-            'country_code': 'SY'
-        },
-        {
-            'regex': '964',
-            'country_code': 'IQ'
-        },
-        {
-            'regex': '965',
-            'country_code': 'KW'
-        },
-        {
-            'regex': '966',
-            'country_code': 'SA'
-        },
-        {
-            'regex': '967',
-            'country_code': 'YE'
-        },
-        {
-            'regex': '968',
-            'country_code': 'OM'
-        },
-        {
-            'regex': '970',
-            'country_code': 'PS'
-        },
-        {
-            'regex': '971',
-            'country_code': 'AE'
-        },
-        {
-            'regex': '972',
-            'country_code': 'IL'
-        },
-        {
-            'regex': '973',
-            'country_code': 'BH'
-        },
-        {
-            'regex': '974',
-            'country_code': 'QA'
-        },
-        {
-            'regex': '975',
-            'country_code': 'BT'
-        },
-        {
-            'regex': '976',
-            'country_code': 'MN'
-        },
-        {
-            'regex': '977',
-            'country_code': 'NP'
-        },
-        {
-            'regex': '98',
-            'country_code': 'IR'
-        },
-        {
-            'regex': '992',
-            'country_code': 'TJ'
-        },
-        {
-            'regex': '993',
-            'country_code': 'TM'
-        },
-        {
-            'regex': '994',
-            'country_code': 'AZ'
-        },
-        {
-            'regex': '995',
-            'country_code': 'GE'
-        },
-        {
-            'regex': '996',
-            'country_code': 'KG'
-        },
-        {
-            'regex': '998',
-            'country_code': 'UZ'
-        }
-    ]
-}
-
-
-# The country_code key is included with these exceptions since some cities have
-# phone service from more than one country.
-#
-# The main dict key is the country code, as matched from CALLING_CODE_MAPPING
-CALLING_CODE_EXCEPTIONS = {
-    'AT': [
-        {
-            'regex': '435676',
-            'country_code': 'AT',
-            'name': 'Jungholz',
-            'definitive': True
-        },
-        {
-            'regex': '435517',
-            'country_code': 'AT',
-            'name': 'Mittelberg',
-            'definitive': False
-        }
-    ],
-    'CH': [
-        {
-            'regex': '4152',
-            'country_code': 'DE',
-            'name': 'Büsingen am Hochrhein',
-            'definitive': False
-        },
-        {
-            'regex': '4191',
-            'country_code': 'IT',
-            'name': "Campione d'Italia",
-            'definitive': False
-        }
-    ],
-    'DE': [
-        {
-            'regex': '494725',
-            'country_code': 'DE',
-            'name': 'Heligoland',
-            'definitive': True
-        },
-        {
-            'regex': '497734',
-            'country_code': 'DE',
-            'name': 'Büsingen am Hochrhein',
-            'definitive': False
-        }
-    ],
-    'ES': [
-        {
-            'regex': '34(822|828|922|928)',
-            'country_code': 'ES',
-            'name': 'Canary Islands',
-            'definitive': True
-        },
-        {
-            'regex': '34956',
-            'country_code': 'ES',
-            'name': 'Ceuta',
-            'definitive': False
-        },
-        {
-            'regex': '34952',
-            'country_code': 'ES',
-            'name': 'Melilla',
-            'definitive': False
-        }
-    ],
-    'GR': [
-        {
-            # http://www.mountathosinfos.gr/pages/agionoros/telefonbook.en.html
-            # http://www.athosfriends.org/PilgrimsGuide/information/#telephones
-            'regex': '3023770(23|41488|41462|22586|24039|94098)',
-            'country_code': 'GR',
-            'name': 'Mount Athos',
-            'definitive': True
-        }
-    ],
-    'IT': [
-        {
-            'regex': '390342',
-            'country_code': 'IT',
-            'name': 'Livigno',
-            'definitive': False
-        }
-    ],
-    'PT': [
-        {
-            'regex': '35129[256]',
-            'country_code': 'PT',
-            'name': 'Azores',
-            'definitive': True
-        },
-        {
-            'regex': '351291',
-            'country_code': 'PT',
-            'name': 'Madeira',
-            'definitive': True
-        }
-    ]
-}
+def _lookup(phone_number):
+    """
+    Walks the digits of a phone number through the calling code trie once,
+    finding both the country the calling code belongs to and the entries from
+    CALLING_CODE_EXCEPTIONS that apply to it. Results are cached by the
+    prefix from _cache_key() once enable_cache() has been called.
+
+    :param phone_number:
+        The string phone number, in international format with the leading +
+        removed
+
+    :return:
+        A 2-element tuple of (two-character country code or None, list of
+        exception dicts in the order they are listed in
+        CALLING_CODE_EXCEPTIONS)
+    """
+
+    cache = _cache
+    if cache is not None:
+        prefix = _cache_key(phone_number)
+        result = cache.get(prefix)
+        if _instrumentation is not None:
+            _instrumentation.increment('cache_misses' if result is None else 'cache_hits')
+        if result is not None:
+            return result
+        result = _uncached_lookup(prefix)
+        cache.set(prefix, result)
+        return result
+
+    return _uncached_lookup(phone_number)
+
+
+def _uncached_lookup(phone_number):
+    """
+    Performs the work of _lookup() without consulting the cache
+
+    :param phone_number:
+        The string phone number, in international format with the leading +
+        removed
+
+    :return:
+        A 2-element tuple of (two-character country code or None, list of
+        exception dicts)
+    """
+
+    if _table is not None:
+        country_code, exceptions, nodes_visited, exceptions_checked = _table.lookup(phone_number)
+    else:
+        country_code, exceptions, nodes_visited, exceptions_checked = _walk_trie(phone_number)
+
+    instrumentation = _instrumentation
+    if instrumentation is not None:
+        instrumentation.increment('nodes_visited', nodes_visited, key=country_code)
+        instrumentation.increment('exceptions_checked', exceptions_checked, key=country_code)
+
+    return (country_code, exceptions)
+
+
+def _count_lookup(instrumentation, country_code):
+    """
+    Records the result of looking up a phone number for calculate_rate() or
+    calculate_rates(), whether or not it came from a cache
+
+    :param instrumentation:
+        The vat_moss.instrumentation.Instrumentation object to record to
+
+    :param country_code:
+        The two-character country code that was matched, or None
+    """
+
+    if country_code is None:
+        instrumentation.increment('invalid')
+    instrumentation.increment('lookups', key=country_code)
+
+
+def _walk_trie(phone_number):
+    """
+    Looks up a phone number in the in-memory calling code trie
+
+    :param phone_number:
+        The string phone number, in international format with the leading +
+        removed
+
+    :return:
+        A 4-element tuple of (two-character country code or None, list of
+        exception dicts, integer number of trie nodes visited, integer number
+        of candidate exceptions checked against the country code)
+    """
+
+    country_code = None
+    candidates = []
+    nodes_visited = 0
+
+    node = _trie()
+    for digit in phone_number:
+        node = node['children'].get(digit)
+        if node is None:
+            break
+        nodes_visited += 1
+        if node['country_code'] is not None:
+            country_code = node['country_code']
+        if node['exceptions']:
+            candidates.extend(node['exceptions'])
+
+    if country_code is None:
+        return (None, [], nodes_visited, 0)
+
+    return (country_code, _filter_exceptions(country_code, candidates), nodes_visited, len(candidates))
+
+
+def _filter_exceptions(country_code, candidates):
+    """
+    Narrows the exceptions collected while walking the trie down to those
+    belonging to the country that was matched
+
+    :param country_code:
+        The two-character country code that was matched
+
+    :param candidates:
+        A list of (country code, sort index, exception dict) tuples from
+        trie nodes
+
+    :return:
+        A list of exception dicts, in CALLING_CODE_EXCEPTIONS order
+    """
+
+    if not candidates:
+        return []
+
+    matches = [candidate for candidate in candidates if candidate[0] == country_code]
+    if len(matches) > 1:
+        matches.sort(key=lambda candidate: candidate[1])
+    return [candidate[2] for candidate in matches]
+
+
+def _expand_regex(regex):
+    """
+    Expands one of the simple regexes used in CALLING_CODE_MAPPING and
+    CALLING_CODE_EXCEPTIONS into the list of literal digit prefixes it matches.
+    Only digits, character classes such as [256] and (possibly nested) groups
+    of alternatives are supported, which is all the tables use.
+
+    :param regex:
+        A unicode string regex
+
+    :raises:
+        ValueError - when the regex uses unsupported syntax
+
+    :return:
+        A list of unicode strings, in the order the alternatives are listed
+    """
+
+    prefixes, offset = _expand_sequence(regex, 0)
+    if offset != len(regex):
+        raise ValueError('Unsupported calling code regex %s' % regex)
+    return prefixes
+
+
+def _expand_sequence(regex, offset):
+    """
+    Expands a sequence of digits, character classes and groups, stopping at
+    the end of the string, or at a | or ) belonging to an enclosing group
+
+    :param regex:
+        A unicode string regex
+
+    :param offset:
+        An integer offset to start parsing from
+
+    :return:
+        A 2-element tuple of (list of unicode string prefixes, integer offset
+        of the first unconsumed character)
+    """
+
+    prefixes = ['']
+    while offset < len(regex):
+        char = regex[offset]
+
+        if char in '|)':
+            break
+
+        if char == '(':
+            options, offset = _expand_sequence(regex, offset + 1)
+            while offset < len(regex) and regex[offset] == '|':
+                alternative, offset = _expand_sequence(regex, offset + 1)
+                options.extend(alternative)
+            if offset >= len(regex) or regex[offset] != ')':
+                raise ValueError('Unsupported calling code regex %s' % regex)
+            offset += 1
+
+        elif char == '[':
+            end = regex.find(']', offset)
+            options = list(regex[offset + 1:end])
+            if end == -1 or not options or not all(option.isdigit() for option in options):
+                raise ValueError('Unsupported calling code regex %s' % regex)
+            offset = end + 1
+
+        elif char.isdigit():
+            options = [char]
+            offset += 1
+
+        else:
+            raise ValueError('Unsupported calling code regex %s' % regex)
+
+        prefixes = [prefix + option for prefix in prefixes for option in options]
+
+    return (prefixes, offset)
+
+
+def _new_trie_node():
+    """
+    :return:
+        A dict representing an empty node in a calling code trie
+    """
+
+    return {
+        'children': {},
+        'country_code': None,
+        'exceptions': [],
+        'candidates': frozenset()
+    }
+
+
+def _trie_node(root, prefix):
+    """
+    Finds the node for a prefix in a calling code trie, creating it and any
+    missing ancestors
+
+    :param root:
+        The dict of the root trie node
+
+    :param prefix:
+        A unicode string of digits
+
+    :return:
+        A 2-element tuple of (dict trie node, boolean if an ancestor of the
+        node already has a country code)
+    """
+
+    node = root
+    shadowed = False
+    for digit in prefix:
+        if digit not in node['children']:
+            node['children'][digit] = _new_trie_node()
+        if node['country_code'] is not None:
+            shadowed = True
+        node = node['children'][digit]
+    return (node, shadowed)
+
+
+def _trie_depth(node):
+    """
+    :param node:
+        The dict of a calling code trie node
+
+    :return:
+        An integer of the number of digits in the longest prefix below the node
+    """
+
+    if not node['children']:
+        return 0
+    return 1 + max(_trie_depth(child) for child in node['children'].values())
+
+
+def _add_candidates(node):
+    """
+    Records on each node of a calling code trie the set of country codes that
+    can be matched at or below it
+
+    :param node:
+        The dict of a calling code trie node
+
+    :return:
+        The frozenset of country codes for the node
+    """
+
+    candidates = set()
+    if node['country_code'] is not None:
+        candidates.add(node['country_code'])
+    for child in node['children'].values():
+        candidates.update(_add_candidates(child))
+    node['candidates'] = frozenset(candidates)
+    return node['candidates']
+
+
+def _build_trie(mapping, exceptions):
+    """
+    Compiles CALLING_CODE_MAPPING and CALLING_CODE_EXCEPTIONS into a single
+    digit trie so that a phone number can be resolved by walking its digits
+    once, instead of trying each regex.
+
+    Since the mapping regexes are tried in order and the first match wins, a
+    country code is only added to a node if no earlier entry already claimed
+    it or one of its ancestors. Looking up a number then consists of finding
+    the deepest node along its digits that has a country code.
+
+    Exceptions are attached to the node of each of their prefixes along with
+    the country they belong to and their position in the table, so that the
+    ones for the matched country can be applied in their original order.
+
+    :param mapping:
+        A dict in the format of CALLING_CODE_MAPPING
+
+    :param exceptions:
+        A dict in the format of CALLING_CODE_EXCEPTIONS
+
+    :return:
+        A dict of the root trie node
+    """
+
+    root = _new_trie_node()
+
+    for leading_digit in sorted(mapping):
+        for info in mapping[leading_digit]:
+            for prefix in _expand_regex(info['regex']):
+                node, shadowed = _trie_node(root, prefix)
+                if not shadowed and node['country_code'] is None:
+                    node['country_code'] = info['country_code']
+
+    index = 0
+    for country_code in sorted(exceptions):
+        for info in exceptions[country_code]:
+            for prefix in _expand_regex(info['regex']):
+                node, _ = _trie_node(root, prefix)
+                node['exceptions'].append((country_code, index, info))
+            index += 1
+
+    _add_candidates(root)
+
+    return root
+
+
+def _trie():
+    """
+    Returns the calling code trie, building it the first time it is needed so
+    that processes using a mapped table never build it, or even import
+    vat_moss.calling_codes
+
+    :return:
+        A dict of the root trie node
+    """
+
+    global _CALLING_CODE_TRIE
+
+    if _CALLING_CODE_TRIE is None:
+        from . import calling_codes
+        _CALLING_CODE_TRIE = _build_trie(calling_codes.CALLING_CODE_MAPPING, calling_codes.CALLING_CODE_EXCEPTIONS)
+    return _CALLING_CODE_TRIE
+
+
+def _cache_key(phone_number):
+    """
+    Finds the leading digits of a phone number that can affect the result of
+    _lookup(). Most calling codes only have short prefixes below them, so
+    this is usually a few digits, even though a few exceptions list entire
+    phone numbers.
+
+    :param phone_number:
+        The string phone number, in international format with the leading +
+        removed
+
+    :return:
+        A unicode string of the leading digits
+    """
+
+    length = _key_lengths().get(phone_number[0:_KEY_PREFIX_LENGTH], len(phone_number))
+    return phone_number[0:length]
+
+
+def _key_lengths():
+    """
+    :return:
+        A dict of each string of _KEY_PREFIX_LENGTH digits to the integer
+        number of leading digits that can affect the result of _lookup() for
+        a phone number starting with them
+    """
+
+    global _KEY_LENGTHS
+
+    if _table is not None:
+        return _table.key_lengths
+    if _KEY_LENGTHS is None:
+        _KEY_LENGTHS = _build_key_lengths(_trie())
+    return _KEY_LENGTHS
+
+
+def _build_key_lengths(root):
+    """
+    Walks each string of _KEY_PREFIX_LENGTH digits through a calling code
+    trie. If the walk stops early, no later digit is looked at, otherwise
+    only as many more digits as the deepest path below the node reached.
+
+    :param root:
+        The dict of the root trie node
+
+    :return:
+        A dict in the format returned by _key_lengths()
+    """
+
+    key_lengths = {}
+    for number in range(10 ** _KEY_PREFIX_LENGTH):
+        prefix = '%0*d' % (_KEY_PREFIX_LENGTH, number)
+        node = root
+        length = None
+        for index, digit in enumerate(prefix):
+            node = node['children'].get(digit)
+            if node is None:
+                length = index + 1
+                break
+        if length is None:
+            length = _KEY_PREFIX_LENGTH + _trie_depth(node)
+        key_lengths[prefix] = length
+    return key_lengths
+
+
+def _data_fingerprint():
+    """
+    Hashes the source of vat_moss.calling_codes, which is stored in compiled
+    tables to detect stale ones. This is only done once per process, and
+    reads the file rather than importing it, so that checking a table does
+    not build the dicts the table replaces.
+
+    :return:
+        A 20-byte byte string
+    """
+
+    global _DATA_FINGERPRINT
+
+    if _DATA_FINGERPRINT is None:
+        try:
+            with open(_CALLING_CODES_PATH, 'rb') as f:
+                data = f.read()
+        except (IOError):
+            # Installed without source, so the data has to be imported
+            from . import calling_codes
+            data = json.dumps(
+                [calling_codes.CALLING_CODE_MAPPING, calling_codes.CALLING_CODE_EXCEPTIONS],
+                sort_keys=True
+            ).encode('utf-8')
+        _DATA_FINGERPRINT = hashlib.sha1(data).digest()
+    return _DATA_FINGERPRINT
+
+
+def _load_default_table():
+    """
+    Maps the table setup.py generates when the package is built, if it is
+    present and up to date, since it saves building the trie in every process
+    """
+
+    global _table
+
+    if not os.path.exists(_DEFAULT_TABLE_PATH):
+        return
+
+    try:
+        _table = _MappedTable(_DEFAULT_TABLE_PATH)
+    except (ValueError):
+        # A table left over from an earlier build of a source checkout
+        pass
+
+
+def __getattr__(name):
+    """
+    Provides CALLING_CODE_MAPPING and CALLING_CODE_EXCEPTIONS from
+    vat_moss.calling_codes, without importing them until they are used.
+    Module attribute hooks require Python 3.7 or newer.
+    """
+
+    if name in ('CALLING_CODE_MAPPING', 'CALLING_CODE_EXCEPTIONS'):
+        from . import calling_codes
+        return getattr(calling_codes, name)
+    raise AttributeError('module %s has no attribute %s' % (__name__, name))
+
+
+class _MappedTable(object):
+
+    """
+    A read-only memory-mapped binary calling code table from compile_table().
+    The file consists of a header, a block of length-prefixed UTF-8 strings,
+    the exception records and then one record per trie node containing the
+    index of the child node for each digit, the string index of the node's
+    country code and the range of the node's exception records.
+    """
+
+    def __init__(self, path):
+        """
+        :param path:
+            A unicode string filesystem path of the table
+
+        :raises:
+            ValueError - when the file is not a valid table for the current data
+        """
+
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._map) < _TABLE_HEADER.size:
+            raise ValueError('Calling code table %s is truncated' % path)
+
+        magic, version, key_prefix_length, string_count, strings_length, exception_count, node_count, fingerprint = \
+            _TABLE_HEADER.unpack_from(self._map, 0)
+
+        if magic != _TABLE_MAGIC or version != _TABLE_VERSION or key_prefix_length != _KEY_PREFIX_LENGTH:
+            raise ValueError('%s is not a calling code table' % path)
+
+        if fingerprint != _data_fingerprint():
+            raise ValueError('Calling code table %s was compiled from different data, please recompile it' % path)
+
+        key_count = 10 ** _KEY_PREFIX_LENGTH
+        expected_length = _TABLE_HEADER.size + key_count + strings_length + \
+            exception_count * _EXCEPTION_RECORD.size + node_count * _NODE_RECORD.size
+        if len(self._map) != expected_length:
+            raise ValueError('Calling code table %s is truncated' % path)
+
+        offset = _TABLE_HEADER.size
+        self.key_lengths = dict(
+            ('%0*d' % (_KEY_PREFIX_LENGTH, number), length)
+            for number, length in enumerate(bytearray(self._map[offset:offset + key_count]))
+        )
+        offset += key_count
+
+        self._strings = []
+        for _ in range(string_count):
+            length = _STRING_LENGTH.unpack_from(self._map, offset)[0]
+            offset += _STRING_LENGTH.size
+            self._strings.append(self._map[offset:offset + length].decode('utf-8'))
+            offset += length
+
+        # The exception records are tiny, so they are decoded once into the
+        # same form as the in-memory trie uses
+        self._exceptions = []
+        for _ in range(exception_count):
+            owner, index, regex_id, country_id, name_id, definitive = _EXCEPTION_RECORD.unpack_from(self._map, offset)
+            self._exceptions.append((
+                self._strings[owner],
+                index,
+                {
+                    'regex': self._strings[regex_id],
+                    'country_code': self._strings[country_id],
+                    'name': self._strings[name_id],
+                    'definitive': bool(definitive)
+                }
+            ))
+            offset += _EXCEPTION_RECORD.size
+
+        self._nodes_offset = offset
+
+    def lookup(self, phone_number):
+        """
+        The equivalent of _walk_trie() using the mapped table
+
+        :param phone_number:
+            The string phone number, in international format with the leading
+            + removed
+
+        :return:
+            A 4-element tuple in the format returned by _walk_trie()
+        """
+
+        country_id = _NONE_ID
+        candidates = []
+        nodes_visited = 0
+
+        node_offset = self._nodes_offset
+        for digit in phone_number:
+            if digit not in _DIGIT_OFFSETS:
+                break
+            child = _CHILD.unpack_from(self._map, node_offset + _DIGIT_OFFSETS[digit])[0]
+            if child == 0:
+                break
+            nodes_visited += 1
+            node_offset = self._nodes_offset + child * _NODE_RECORD.size
+            node_country_id, exceptions_start, exceptions_count = _NODE_DATA.unpack_from(
+                self._map,
+                node_offset + _NODE_DATA_OFFSET
+            )
+            if node_country_id != _NONE_ID:
+                country_id = node_country_id
+            if exceptions_count:
+                candidates.extend(self._exceptions[exceptions_start:exceptions_start + exceptions_count])
+
+        if country_id == _NONE_ID:
+            return (None, [], nodes_visited, 0)
+
+        country_code = self._strings[country_id]
+        return (country_code, _filter_exceptions(country_code, candidates), nodes_visited, len(candidates))
+
+
+# The trie built from vat_moss.calling_codes, see _trie()
+_CALLING_CODE_TRIE = None
+
+# The source of the calling code data and the table setup.py generates from
+# it, see _data_fingerprint() and _load_default_table()
+_CALLING_CODES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calling_codes.py')
+_DEFAULT_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calling_codes.table')
+_DATA_FINGERPRINT = None
+
+# The _MappedTable from load_table(), if any
+_table = None
+
+# The Instrumentation from enable_instrumentation(), if any
+_instrumentation = None
+
+# The LRUCache from enable_cache(), if any
+_cache = None
+
+_NORMALIZATION_TABLE = _NormalizationTable()
+
+# The ways a normalized phone number may begin before the digits of the
+# calling code, and the incomplete forms of them
+_INTERNATIONAL_PREFIXES = frozenset(['+', '00'])
+_PARTIAL_PREFIXES = frozenset(['', '0'])
+
+# The number of leading digits used to look up the length of a cache key,
+# which covers every calling code
+_KEY_PREFIX_LENGTH = 3
+
+# The cache key lengths for the in-memory trie, see _key_lengths()
+_KEY_LENGTHS = None
+
+# The most lookups calculate_rates() keeps for sharing between numbers
+_BATCH_LOOKUPS_MAXSIZE = 10000
+
+# The binary format of tables from compile_table()
+_TABLE_MAGIC = b'VMPT'
+_TABLE_VERSION = 2
+_TABLE_HEADER = struct.Struct(str('<4sHHIIII20s'))
+_STRING_LENGTH = struct.Struct(str('<H'))
+_EXCEPTION_RECORD = struct.Struct(str('<HHHHHB'))
+_NODE_RECORD = struct.Struct(str('<10IHHH'))
+_CHILD = struct.Struct(str('<I'))
+_NODE_DATA = struct.Struct(str('<HHH'))
+_NODE_DATA_OFFSET = 40
+_NONE_ID = 0xFFFF
+_DIGIT_OFFSETS = dict((str_cls(digit), digit * _CHILD.size) for digit in range(10))
+
+_load_default_table()
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import struct
+
+
+class RadixTree(object):
+
+    """
+    A compressed binary radix (Patricia) tree of network prefixes, for
+    longest-prefix matching of IPv4 or IPv6 addresses as integers. Each node
+    holds a prefix, so chains of nodes with a single child are skipped and a
+    lookup visits at most one node per distinct prefix length on the path.
+    Values are small integers, such as an index into a list of locations.
+    """
+
+    def __init__(self, bits):
+        """
+        :param bits:
+            The integer number of bits in an address, 32 or 128
+        """
+
+        self.bits = bits
+        # Each node is a list of [prefix, length, left child, right child,
+        # value], with None for missing children and values
+        self._root = None
+        self._node_count = 0
+
+    def insert(self, prefix, length, value):
+        """
+        Adds a network, replacing the value if it is already present
+
+        :param prefix:
+            The integer first address of the network
+
+        :param length:
+            The integer prefix length of the network
+
+        :param value:
+            An integer from 0 to 65534
+        """
+
+        prefix = _mask(prefix, length, self.bits)
+        new = [prefix, length, None, None, value]
+
+        parent = None
+        bit = None
+        node = self._root
+        while node is not None:
+            common = _common_length(node[0], prefix, min(node[1], length), self.bits)
+
+            if common == node[1] == length:
+                node[4] = value
+                return
+
+            if common == node[1]:
+                parent = node
+                bit = _bit(prefix, node[1], self.bits)
+                node = node[2 + bit]
+                continue
+
+            if common == length:
+                # The new network contains the existing one
+                new[2 + _bit(node[0], length, self.bits)] = node
+            else:
+                # The networks diverge, so a node is needed where they do
+                split = [_mask(prefix, common, self.bits), common, None, None, None]
+                split[2 + _bit(node[0], common, self.bits)] = node
+                split[2 + _bit(prefix, common, self.bits)] = new
+                self._node_count += 1
+                new = split
+            break
+
+        self._node_count += 1
+        if parent is None:
+            self._root = new
+        else:
+            parent[2 + bit] = new
+
+    def insert_range(self, start, end, value):
+        """
+        Adds a range of addresses as the fewest networks that cover it
+
+        :param start:
+            The integer first address
+
+        :param end:
+            The integer last address
+
+        :param value:
+            An integer from 0 to 65534
+        """
+
+        while start <= end:
+            # The largest network that starts at start and ends by end
+            size = self.bits
+            if start:
+                size = (start & -start).bit_length() - 1
+            while start + (1 << size) - 1 > end:
+                size -= 1
+            self.insert(start, self.bits - size, value)
+            start += 1 << size
+
+    def lookup(self, address):
+        """
+        :param address:
+            An integer address
+
+        :return:
+            The value of the longest network containing the address, or None
+        """
+
+        bits = self.bits
+        result = None
+        node = self._root
+        while node is not None:
+            if (address ^ node[0]) >> (bits - node[1]):
+                break
+            if node[4] is not None:
+                result = node[4]
+            if node[1] == bits:
+                break
+            node = node[2 + ((address >> (bits - 1 - node[1])) & 1)]
+        return result
+
+    def serialize(self):
+        """
+        :return:
+            A byte string of the nodes for MappedRadixTree, with the root
+            first
+        """
+
+        nodes = []
+        if self._root is not None:
+            nodes.append(self._root)
+        ids = {}
+        position = 0
+        while position < len(nodes):
+            node = nodes[position]
+            ids[id(node)] = position
+            for child in node[2:4]:
+                if child is not None:
+                    nodes.append(child)
+            position += 1
+
+        records = []
+        for prefix, length, left, right, value in nodes:
+            records.append(_NODE.pack(
+                prefix >> 64,
+                prefix & _UINT64_MASK,
+                length,
+                0 if left is None else ids[id(left)],
+                0 if right is None else ids[id(right)],
+                _NONE if value is None else value
+            ))
+        return b''.join(records)
+
+    def __len__(self):
+        return self._node_count
+
+
+class MappedRadixTree(object):
+
+    """
+    A read-only RadixTree in a byte string or mmap, as written by
+    RadixTree.serialize()
+    """
+
+    def __init__(self, buffer, offset, node_count, bits):
+        """
+        :param buffer:
+            A byte string or mmap
+
+        :param offset:
+            The integer offset of the first node
+
+        :param node_count:
+            The integer number of nodes
+
+        :param bits:
+            The integer number of bits in an address, 32 or 128
+        """
+
+        self.bits = bits
+        self._buffer = buffer
+        self._offset = offset
+        self._node_count = node_count
+
+    def lookup(self, address):
+        """
+        :param address:
+            An integer address
+
+        :return:
+            The value of the longest network containing the address, or None
+        """
+
+        if not self._node_count:
+            return None
+
+        bits = self.bits
+        result = None
+        node = 0
+        while True:
+            high, low, length, left, right, value = _NODE.unpack_from(self._buffer, self._offset + node * _NODE.size)
+            if (address ^ ((high << 64) | low)) >> (bits - length):
+                break
+            if value != _NONE:
+                result = value
+            if length == bits:
+                break
+            node = right if (address >> (bits - 1 - length)) & 1 else left
+            # The root is never a child, so 0 means there is no child
+            if not node:
+                break
+        return result
+
+    def __len__(self):
+        return self._node_count
+
+
+def _mask(prefix, length, bits):
+    """
+    :return:
+        The integer prefix with all but the first length bits cleared
+    """
+
+    return (prefix >> (bits - length)) << (bits - length)
+
+
+def _bit(prefix, index, bits):
+    """
+    :return:
+        The integer bit at index, counting from the most significant
+    """
+
+    return (prefix >> (bits - 1 - index)) & 1
+
+
+def _common_length(a, b, limit, bits):
+    """
+    :return:
+        The integer number of leading bits, up to limit, that a and b share
+    """
+
+    difference = a ^ b
+    if not difference:
+        return limit
+    return min(bits - difference.bit_length(), limit)
+
+
+# The prefix is stored as two 64 bit halves so IPv6 prefixes fit
+_NODE = struct.Struct(str('>QQBIIH'))
+
+# The number of bytes of each node written by RadixTree.serialize()
+NODE_SIZE = _NODE.size
+_NONE = 0xFFFF
+_UINT64_MASK = 0xFFFFFFFFFFFFFFFF
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv
+import io
+import json
+import sys
+from decimal import Decimal
+
+try:
+    # Python 2
+    str_cls = unicode
+    _PY2 = True
+except (NameError):
+    # Python 3
+    str_cls = str
+    _PY2 = False
+
+
+FORMATS = ('csv', 'jsonl')
+
+
+def open_input(path):
+    """
+    Opens a file, or stdin, for reading rows with read_rows()
+
+    :param path:
+        A unicode string filesystem path, or None or "-" for stdin
+
+    :return:
+        A file-like object
+    """
+
+    if path is None or path == '-':
+        if _PY2:
+            return sys.stdin
+        return _StandardStream(sys.stdin.buffer, encoding='utf-8', newline='')
+
+    if _PY2:
+        return open(path, 'rb')
+    return io.open(path, 'r', encoding='utf-8', newline='')
+
+
+def open_output(path):
+    """
+    Opens a file, or stdout, for writing rows with write_rows()
+
+    :param path:
+        A unicode string filesystem path, or None or "-" for stdout
+
+    :return:
+        A file-like object
+    """
+
+    if path is None or path == '-':
+        if _PY2:
+            return sys.stdout
+        return _StandardStream(sys.stdout.buffer, encoding='utf-8', newline='')
+
+    if _PY2:
+        return open(path, 'wb')
+    return io.open(path, 'w', encoding='utf-8', newline='')
+
+
+def read_rows(input_file, format='csv'):
+    """
+    Lazily reads rows from a CSV file with a header line, or a file of JSON
+    objects, one per line
+
+    :param input_file:
+        A file-like object from open_input()
+
+    :param format:
+        A unicode string of "csv" or "jsonl"
+
+    :raises:
+        ValueError - when the format is unknown, or a JSON line is not an object
+
+    :return:
+        A generator of dicts with unicode string keys
+    """
+
+    if format == 'csv':
+        for row in csv.DictReader(input_file):
+            if _PY2:
+                row = dict((_decode(key), _decode(value)) for key, value in row.items())
+            yield row
+
+    elif format == 'jsonl':
+        for line in input_file:
+            if _PY2:
+                line = line.decode('utf-8')
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError('JSON line is not an object')
+            yield row
+
+    else:
+        raise ValueError('Unknown format %s' % format)
+
+
+def write_rows(output_file, rows, format='csv', fieldnames=None, chunk_size=1000):
+    """
+    Writes rows to a CSV or JSON lines file as they are generated, flushing
+    the output every chunk_size rows so memory use does not depend on the
+    number of rows
+
+    :param output_file:
+        A file-like object from open_output()
+
+    :param rows:
+        An iterable of dicts
+
+    :param format:
+        A unicode string of "csv" or "jsonl"
+
+    :param fieldnames:
+        For CSV, a list of the unicode string columns to write. If None, the
+        keys of the first row are used.
+
+    :param chunk_size:
+        The number of rows to buffer between writes to output_file
+
+    :raises:
+        ValueError - when the format is unknown
+
+    :return:
+        The integer number of rows written
+    """
+
+    writer = RowWriter(output_file, format, fieldnames, chunk_size)
+    for row in rows:
+        writer.write(row)
+    writer.flush()
+    return writer.count
+
+
+class RowWriter(object):
+
+    """
+    Writes rows to a CSV or JSON lines file one at a time, buffering up to
+    chunk_size rows between writes. This allows rows to be written as they
+    are produced by code that is not a simple iterable, such as a callback.
+    flush() must be called once all rows have been written.
+    """
+
+    def __init__(self, output_file, format='csv', fieldnames=None, chunk_size=1000):
+        """
+        :param output_file:
+            A file-like object from open_output()
+
+        :param format:
+            A unicode string of "csv" or "jsonl"
+
+        :param fieldnames:
+            For CSV, a list of the unicode string columns to write. If None,
+            the keys of the first row are used.
+
+        :param chunk_size:
+            The number of rows to buffer between writes to output_file
+
+        :raises:
+            ValueError - when the format is unknown
+        """
+
+        if format not in FORMATS:
+            raise ValueError('Unknown format %s' % format)
+
+        self.output_file = output_file
+        self.format = format
+        self.fieldnames = fieldnames
+        self.chunk_size = chunk_size
+        self.count = 0
+        self._writer = None
+        self._buffer = []
+
+    def write(self, row):
+        """
+        Adds a row to the buffer, writing the buffer out if it is full
+
+        :param row:
+            A dict
+        """
+
+        if self.format == 'csv':
+            if self._writer is None:
+                if self.fieldnames is None:
+                    self.fieldnames = list(row.keys())
+                self._writer = csv.DictWriter(
+                    self.output_file,
+                    [_encode(fieldname) for fieldname in self.fieldnames],
+                    extrasaction='ignore'
+                )
+                self._writer.writeheader()
+            self._buffer.append(dict((_encode(key), _encode(_serialize(value))) for key, value in row.items()))
+        else:
+            line = json.dumps(row, default=_serialize) + '\n'
+            self._buffer.append(line.encode('utf-8') if _PY2 else line)
+
+        self.count += 1
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes any buffered rows to the file
+        """
+
+        if not self._buffer:
+            return
+
+        if self._writer is not None:
+            self._writer.writerows(self._buffer)
+        else:
+            self.output_file.write(''.join(self._buffer) if not _PY2 else b''.join(self._buffer))
+        self.output_file.flush()
+        self._buffer = []
+
+
+class _StandardStream(io.TextIOWrapper):
+
+    """
+    A text wrapper for stdin or stdout that detaches from the stream when it
+    is closed or garbage collected, rather than closing the process's stream
+    """
+
+    _detached = False
+
+    def close(self):
+        if self._detached:
+            return
+        self._detached = True
+        self.detach()
+
+
+def chunks(iterable, chunk_size):
+    """
+    Splits an iterable into lists of at most chunk_size elements, without
+    reading more than one chunk ahead
+
+    :param iterable:
+        The iterable to split
+
+    :param chunk_size:
+        The integer maximum number of elements per chunk
+
+    :return:
+        A generator of lists
+    """
+
+    chunk = []
+    for element in iterable:
+        chunk.append(element)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def zip_columns(columns):
+    """
+    Iterates over parallel columns of values one row at a time, like zip(),
+    but checks that the columns are all the same length rather than
+    stopping at the shortest
+
+    :param columns:
+        A list of (unicode string name, iterable or None) tuples. A column of
+        None is None for every row.
+
+    :raises:
+        ValueError - when a column is shorter or longer than the first
+
+    :return:
+        A generator of tuples, with one value per column
+    """
+
+    missing = object()
+    first_name = columns[0][0]
+    iterators = [(name, None if column is None else iter(column)) for name, column in columns]
+
+    while True:
+        row = []
+        ended = []
+        for name, iterator in iterators:
+            if iterator is None:
+                row.append(None)
+                continue
+            value = next(iterator, missing)
+            if value is missing:
+                ended.append(name)
+            row.append(value)
+
+        if not ended:
+            yield tuple(row)
+            continue
+
+        for name, iterator in iterators:
+            if iterator is not None and (name in ended) != (first_name in ended):
+                raise ValueError('%s is not the same length as %s' % (name, first_name))
+        return
+
+
+def _serialize(value):
+    """
+    Converts values that are not natively supported by the csv and json
+    modules into strings
+
+    :param value:
+        The value to convert
+
+    :return:
+        The value, or a unicode string for Decimals and exceptions
+    """
+
+    if isinstance(value, (Decimal, Exception)):
+        return str_cls(value)
+    if value is None or isinstance(value, (str_cls, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple, dict)):
+        return value
+    raise TypeError('%r is not serializable' % value)
+
+
+def _decode(value):
+    """
+    Decodes a byte string read by the Python 2 csv module
+    """
+
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def _encode(value):
+    """
+    Encodes a unicode string for the Python 2 csv module
+    """
+
+    if _PY2 and isinstance(value, str_cls):
+        return value.encode('utf-8')
+    return value